@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+"""
+Running blocking calls, e.g. outbound HTTP requests, concurrently.
+
+The thread pools are created on first use in each process, so that they
+are not shared with processes forked after the app was loaded, and reused
+for the lifetime of the process. Calls that are still running when
+run_concurrently stops waiting go on in the pool, so every call should have
+its own timeout.
+"""
+
+from __future__ import absolute_import
+
+import os
+import time
+import threading
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+
+__author__ = 'lundberg'
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_thread_pool(name, size):
+    """
+    :param name: Name of the pool, pools are shared by name
+    :param size: Number of threads, if the pool is created
+
+    :type name: str
+    :type size: int
+
+    :rtype: multiprocessing.pool.ThreadPool
+    """
+    key = (os.getpid(), name)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ThreadPool(size)
+        return _pools[key]
+
+
+def run_concurrently(pool, func, items, timeout=None):
+    """
+    Call func(item) for every item in the pool, waiting at most `timeout` seconds in total.
+
+    :param pool: Pool to run the calls in
+    :param func: Function to call
+    :param items: Argument for each call
+    :param timeout: Seconds to wait for all calls, None to wait until they are done
+
+    :type pool: multiprocessing.pool.ThreadPool
+    :type func: callable
+    :type items: list
+    :type timeout: float | None
+
+    :return: item -> (outcome, value). The outcome is 'ok' with the return value, 'failed' with
+             the raised exception or 'timeout' with None.
+    :rtype: dict
+    """
+    started = time.time()
+    pending = [(item, pool.apply_async(func, (item,))) for item in items]
+    results = {}
+    for item, async_result in pending:
+        remaining = None
+        if timeout is not None:
+            remaining = max(timeout - (time.time() - started), 0)
+        try:
+            results[item] = ('ok', async_result.get(remaining))
+        except TimeoutError:
+            results[item] = ('timeout', None)
+        except Exception as e:
+            results[item] = ('failed', e)
+    return results
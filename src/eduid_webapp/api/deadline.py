@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+"""
+Per request deadlines for outbound calls.
+
+Every request gets a time budget, REQUEST_DEADLINE seconds or the value for
+its blueprint in REQUEST_DEADLINES, set when the request starts. Outbound
+calls take their timeout from what is left of the budget with get_timeout,
+and calls that can not be given a timeout are guarded with check_deadline.
+A request that runs out of budget is answered with 504 Gateway Timeout, so
+that a worker is never held longer than the front-end proxy waits for it.
+"""
+
+from __future__ import absolute_import
+
+import time
+
+from flask import current_app, request, g, has_request_context, jsonify
+from requests.exceptions import Timeout
+
+__author__ = 'lundberg'
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def init_deadline(app):
+    """
+    :param app: Flask app
+    :type app: flask.Flask
+
+    :return: Flask app
+    :rtype: flask.Flask
+    """
+    app.config.setdefault('REQUEST_DEADLINE', None)
+    app.config.setdefault('REQUEST_DEADLINES', {})
+    app.before_request(start_deadline)
+    app.errorhandler(DeadlineExceeded)(gateway_timeout)
+    app.errorhandler(Timeout)(gateway_timeout)
+    return app
+
+
+def start_deadline():
+    budget = current_app.config['REQUEST_DEADLINES'].get(request.blueprint, current_app.config['REQUEST_DEADLINE'])
+    g.deadline = time.time() + budget if budget else None
+
+
+def gateway_timeout(error):
+    current_app.logger.error('Request to {!s} ran out of time: {!s}'.format(request.path, error))
+    response = jsonify({'_status': 'error', 'error': 'Gateway timeout'})
+    response.status_code = 504
+    return response
+
+
+def remaining_time():
+    """
+    :return: Seconds left of the current request budget, None if there is no deadline
+    :rtype: float | None
+    """
+    if not has_request_context() or getattr(g, 'deadline', None) is None:
+        return None
+    return g.deadline - time.time()
+
+
+def check_deadline(what):
+    """
+    Raise DeadlineExceeded if the current request budget is exhausted.
+
+    :param what: Description of the call about to be made, for logging
+    :type what: str | unicode
+    """
+    remaining = remaining_time()
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceeded('No time left for {!s}'.format(what))
+
+
+def get_timeout(what, default=None):
+    """
+    Timeout for an outbound call, derived from what is left of the request budget.
+
+    :param what: Description of the call about to be made, for logging
+    :param default: Timeout to use outside of a request or if it is shorter than the remaining budget
+
+    :type what: str | unicode
+    :type default: float | None
+
+    :return: Timeout in seconds, None means no timeout
+    :rtype: float | None
+    """
+    check_deadline(what)
+    remaining = remaining_time()
+    if remaining is None:
+        return default
+    if default is not None:
+        return min(default, remaining)
+    return remaining
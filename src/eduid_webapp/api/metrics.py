@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+"""
+Process local counters and gauges.
+
+init_metrics gives the app a Metrics instance as app.metrics, shared by all
+requests served by the process. Counters are plain integers keyed by a
+dotted name, e.g. 'session.writes', and are only ever incremented. Gauges,
+e.g. 'mongodb.replica_lag.max', are set to their current value.
+
+Every METRICS_LOG_INTERVAL seconds all counters and gauges of the process
+are written to the app log at level INFO, as one line starting with
+'Metrics (pid N):', by a thread started by the first request in each process.
+"""
+
+from __future__ import absolute_import
+
+import os
+import time
+import threading
+from collections import defaultdict
+
+__author__ = 'lundberg'
+
+
+# Only held to check the process id, see Metrics.start_logging
+_fork_lock = threading.Lock()
+
+
+class Metrics(object):
+
+    def __init__(self):
+        self._counters = defaultdict(int)
+        self._lock = threading.Lock()
+        self._logger_pid = None
+
+    def incr(self, name, value=1):
+        """
+        :param name: Counter name
+        :param value: Amount to add
+
+        :type name: str
+        :type value: int
+        """
+        with self._lock:
+            self._counters[name] += value
+
+    def set(self, name, value):
+        """
+        :param name: Gauge name
+        :param value: Current value
+
+        :type name: str
+        :type value: int | float
+        """
+        with self._lock:
+            self._counters[name] = value
+
+    def get(self, name):
+        """
+        :rtype: int
+        """
+        return self._counters.get(name, 0)
+
+    def snapshot(self):
+        """
+        :return: Copy of all counters and gauges
+        :rtype: dict
+        """
+        with self._lock:
+            return dict(self._counters)
+
+    def log(self, logger):
+        """
+        Write all counters and gauges to `logger`, sorted by name.
+
+        :type logger: logging.Logger
+        """
+        counters = self.snapshot()
+        if not counters:
+            return
+        logger.info('Metrics (pid {!s}): {!s}'.format(os.getpid(), ' '.join(
+            '{!s}={!s}'.format(name, value) for name, value in sorted(counters.items()))))
+
+    def _log_loop(self, logger, interval):
+        while True:
+            time.sleep(interval)
+            self.log(logger)
+
+    def start_logging(self, logger, interval):
+        """
+        Log the metrics every `interval` seconds in a background thread, if not already done in this process.
+
+        :type logger: logging.Logger
+        :type interval: int | float
+        """
+        # Threads do not survive a fork, start one in every process
+        if self._logger_pid == os.getpid():
+            return
+        with _fork_lock:
+            if self._logger_pid == os.getpid():
+                return
+            # A thread logging in the parent process can have held the lock when the process forked
+            self._lock = threading.Lock()
+            self._logger_pid = os.getpid()
+        thread = threading.Thread(target=self._log_loop, args=(logger, interval), name='log metrics')
+        thread.daemon = True
+        thread.start()
+
+
+def init_metrics(app):
+    """
+    :param app: Flask app
+    :type app: flask.Flask
+
+    :return: Flask app
+    :rtype: flask.Flask
+    """
+    if getattr(app, 'metrics', None) is None:
+        app.metrics = Metrics()
+        interval = app.config.get('METRICS_LOG_INTERVAL', 300)
+        if interval:
+            app.before_request(lambda: app.metrics.start_logging(app.logger, interval))
+    return app
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import time
+import unittest
+
+from eduid_webapp.api.concurrency import get_thread_pool, run_concurrently
+
+__author__ = 'lundberg'
+
+
+def work(item):
+    if item == 'fail':
+        raise ValueError(item)
+    if item == 'slow':
+        time.sleep(1)
+    return item.upper()
+
+
+class ConcurrencyTests(unittest.TestCase):
+
+    def test_shared_pool(self):
+        self.assertIs(get_thread_pool('test', 2), get_thread_pool('test', 4))
+        self.assertIsNot(get_thread_pool('test', 2), get_thread_pool('other test', 2))
+
+    def test_run_concurrently(self):
+        pool = get_thread_pool('test', 4)
+        t0 = time.time()
+        results = run_concurrently(pool, work, ['a', 'fail', 'slow', 'b'], timeout=0.5)
+        self.assertLess(time.time() - t0, 0.9)
+        self.assertEqual(results['a'], ('ok', 'A'))
+        self.assertEqual(results['b'], ('ok', 'B'))
+        self.assertEqual(results['fail'][0], 'failed')
+        self.assertIsInstance(results['fail'][1], ValueError)
+        self.assertEqual(results['slow'], ('timeout', None))
+
+    def test_run_concurrently_no_timeout(self):
+        pool = get_thread_pool('test', 4)
+        results = run_concurrently(pool, work, ['slow', 'a'])
+        self.assertEqual(results['slow'], ('ok', 'SLOW'))
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import time
+import unittest
+
+from flask import Flask, Blueprint
+
+from eduid_webapp.api.deadline import init_deadline, get_timeout, remaining_time
+
+__author__ = 'lundberg'
+
+
+class DeadlineTests(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask('testing')
+        self.app.config['REQUEST_DEADLINE'] = 10
+        self.app.config['REQUEST_DEADLINES'] = {'slow': 30}
+        init_deadline(self.app)
+        self.timeouts = []
+
+        @self.app.route('/timeout')
+        def timeout():
+            self.timeouts.append(get_timeout('test call', 5))
+            self.timeouts.append(get_timeout('test call'))
+            return 'OK'
+
+        @self.app.route('/exhausted')
+        def exhausted():
+            time.sleep(0.02)
+            get_timeout('test call')
+            return 'OK'
+
+        slow = Blueprint('slow', __name__)
+
+        @slow.route('/slow')
+        def slow_view():
+            self.timeouts.append(remaining_time())
+            return 'OK'
+
+        self.app.register_blueprint(slow)
+        self.client = self.app.test_client()
+
+    def test_timeout(self):
+        response = self.client.get('/timeout')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.timeouts[0], 5)
+        self.assertTrue(5 < self.timeouts[1] <= 10)
+
+    def test_blueprint_deadline(self):
+        self.client.get('/slow')
+        self.assertTrue(10 < self.timeouts[0] <= 30)
+
+    def test_exhausted(self):
+        self.app.config['REQUEST_DEADLINE'] = 0.01
+        response = self.client.get('/exhausted')
+        self.assertEqual(response.status_code, 504)
+
+    def test_no_deadline(self):
+        self.app.config['REQUEST_DEADLINE'] = None
+        self.client.get('/timeout')
+        self.assertEqual(self.timeouts, [5, None])
+        with self.app.app_context():
+            self.assertIsNone(remaining_time())
+            self.assertEqual(get_timeout('test call', 5), 5)
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import logging
+import threading
+import unittest
+
+from flask import Flask
+
+from eduid_webapp.api.metrics import Metrics, init_metrics
+
+__author__ = 'lundberg'
+
+
+class ListHandler(logging.Handler):
+
+    def __init__(self):
+        super(ListHandler, self).__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class MetricsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+        self.handler = ListHandler()
+        self.logger = logging.getLogger('test_metrics')
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+
+    def test_log(self):
+        self.metrics.log(self.logger)
+        self.assertEqual(self.handler.messages, [])
+        self.metrics.incr('session.writes', 2)
+        self.metrics.set('jsconfig.version', 3)
+        self.metrics.log(self.logger)
+        self.assertEqual(len(self.handler.messages), 1)
+        self.assertTrue(self.handler.messages[0].endswith(': jsconfig.version=3 session.writes=2'))
+
+    def test_start_logging_once_per_process(self):
+        threads = self.log_threads()
+        self.metrics.start_logging(self.logger, 60)
+        self.metrics.start_logging(self.logger, 60)
+        self.assertEqual(self.log_threads(), threads + 1)
+        # Like a forked process
+        self.metrics._logger_pid = -1
+        self.metrics.start_logging(self.logger, 60)
+        self.assertEqual(self.log_threads(), threads + 2)
+
+    def test_init_metrics(self):
+        app = Flask('testing')
+        app.config['METRICS_LOG_INTERVAL'] = 60
+        init_metrics(app)
+        metrics = app.metrics
+        init_metrics(app)
+        self.assertIs(app.metrics, metrics)
+
+        @app.route('/')
+        def index():
+            return 'OK'
+
+        # The log thread is started by the first request
+        self.assertIsNone(metrics._logger_pid)
+        app.test_client().get('/')
+        self.assertIsNotNone(metrics._logger_pid)
+
+    def log_threads(self):
+        return len([thread for thread in threading.enumerate()
+                    if thread.name == 'log metrics' and thread.is_alive()])
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+"""
+Central user database with lookups that do not load whole users.
+"""
+
+from __future__ import absolute_import
+
+from eduid_userdb import UserDB
+
+__author__ = 'lundberg'
+
+
+class CentralUserDB(UserDB):
+
+    def get_modified_ts(self, eppn):
+        """
+        :param eppn: eduPersonPrincipalName
+        :type eppn: str
+
+        :return: modified_ts of the user, None if the user is not found or has none
+        :rtype: datetime.datetime | None
+        """
+        doc = self._coll.find_one({'eduPersonPrincipalName': eppn}, {'modified_ts': True})
+        if doc is None:
+            return None
+        return doc.get('modified_ts')
+
+
+def init_central_userdb(app):
+    """
+    Replace app.central_userdb with a CentralUserDB.
+
+    :param app: Flask app
+    :type app: flask.Flask
+
+    :return: Flask app
+    :rtype: flask.Flask
+    """
+    if not isinstance(app.central_userdb, CentralUserDB):
+        app.central_userdb = CentralUserDB(app.config['MONGO_URI'])
+    return app
@@ -34,6 +34,14 @@ from flask import Flask
 
 from eduid_common.authn.utils import get_saml2_config
 from eduid_common.api.app import eduid_init_app
+from eduid_webapp.api.deadline import init_deadline
+from eduid_webapp.api.userdb import init_central_userdb
+from eduid_webapp.authn.federation import start_refresh
+from eduid_webapp.authn.replay import init_replay_cache
+from eduid_webapp.authn.saml2_client import Saml2ClientFactory
+from eduid_webapp.authn.session import init_write_behind_session
+from eduid_webapp.authn.sp_metadata import SPMetadata
+from eduid_webapp.authn.user_cache import init_user_cache
 
 
 def authn_init_app(name, config):
@@ -59,8 +67,27 @@ def authn_init_app(name, config):
     """
     from . import acs_actions
     app = eduid_init_app(name, config, app_class=Flask)
+    app = init_write_behind_session(app)
+    app = init_replay_cache(app)
+    app = init_central_userdb(app)
+    app = init_user_cache(app)
+    app = init_deadline(app)
     app.saml2_config = get_saml2_config(app.config['SAML2_SETTINGS_MODULE'])
     app.config['SAML2_CONFIG'] = app.saml2_config
+    if app.config.get('SAML2_DEFAULT_IDP') is None:
+        idps = app.saml2_config.getattr('idp') or {}
+        if len(idps) == 1:
+            app.config['SAML2_DEFAULT_IDP'] = list(idps.keys())[0]
+    refresh_interval = app.config.get('SAML2_FEDERATION_REFRESH_INTERVAL', 300)
+    if refresh_interval:
+        start_refresh(app.saml2_config.metadata, refresh_interval)
+    app.saml2_client_factory = Saml2ClientFactory(app.saml2_config,
+                                                  crypto_backend=app.config.get('SAML2_CRYPTO_BACKEND', 'xmlsec1'))
+    app.sp_metadata = SPMetadata(app.config['SAML2_SETTINGS_MODULE'],
+                                 sign=app.config.get('SAML2_METADATA_SIGN', False),
+                                 check_interval=app.config.get('SAML2_METADATA_CHECK_INTERVAL', 60),
+                                 max_age=app.config.get('SAML2_METADATA_MAX_AGE', 3600),
+                                 saml2_config=app.saml2_config)
 
     from eduid_webapp.authn.views import authn_views
     app.register_blueprint(authn_views, url_prefix=app.config.get('APPLICATION_ROOT', None))
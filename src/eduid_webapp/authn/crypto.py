@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+"""
+In-process XML signature verification for pysaml2.
+
+pysaml2 verifies signatures by running the xmlsec1 binary, which costs a
+fork/exec and a couple of temporary files for every response. With
+SAML2_CRYPTO_BACKEND = 'XMLSecurity' the signatures are instead verified with
+pyXMLSecurity in the worker process.
+
+pysaml2 hands the backend the IdP certificates from metadata as temporary PEM
+files. The certificate material is cached by content, and every certificate
+is parsed once, not for every response. Its validity period is kept with it
+and checked on every use.
+
+Only the signature of the element pysaml2 asks about, the one with the ID
+node_id, is verified, and only if that ID is unique in the document and the
+signature references that element. Otherwise a valid signature elsewhere in
+the document, e.g. of a wrapped copy of a signed assertion, would be accepted
+for a forged one. pyXMLSecurity can not decrypt, so encryption and decryption are still done
+by the xmlsec1 backend.
+"""
+
+from __future__ import absolute_import
+
+import copy
+import hashlib
+import logging
+import threading
+from datetime import datetime
+
+from OpenSSL import crypto as ssl_crypto
+from saml2.sigver import CryptoBackendXMLSecurity, Unsupported
+
+__author__ = 'lundberg'
+
+logger = logging.getLogger(__name__)
+
+CRYPTO_BACKENDS = ['xmlsec1', 'XMLSecurity']
+
+DS_NS = 'http://www.w3.org/2000/09/xmldsig#'
+
+
+def _asn1_time(value):
+    """
+    :param value: ASN.1 GENERALIZEDTIME from pyOpenSSL, e.g. b'20170101120000Z'
+    :type value: bytes
+
+    :rtype: datetime
+    """
+    return datetime.strptime(value.decode('ascii'), '%Y%m%d%H%M%SZ')
+
+
+def _signed_node(xml, node_name, node_id, id_attr):
+    """
+    :param xml: Parsed document
+    :param node_name: Namespace and name of the signed element, e.g. urn:oasis:names:tc:SAML:2.0:assertion:Assertion
+    :param node_id: ID of the signed element
+    :param id_attr: Name of the ID attribute
+
+    :type xml: lxml.etree._Element
+    :type node_name: str
+    :type node_id: str | None
+    :type id_attr: str
+
+    :return: The element if it is the only one with its ID and its signature references it, else None
+    :rtype: lxml.etree._Element | None
+    """
+    namespace, name = node_name.rsplit(':', 1)
+    tag = '{{{!s}}}{!s}'.format(namespace, name)
+    nodes = [elt for elt in xml.iter(tag) if node_id is None or elt.get(id_attr) == node_id]
+    if len(nodes) != 1:
+        logger.error('Expected one {!s} with {!s} {!r}, found {!s}'.format(name, id_attr, node_id, len(nodes)))
+        return None
+    node = nodes[0]
+    node_id = node.get(id_attr)
+    if node_id is None or len([elt for elt in xml.iter() if elt.get(id_attr) == node_id]) != 1:
+        logger.error('{!s} {!r} of {!s} is missing or not unique'.format(id_attr, node_id, name))
+        return None
+    signatures = node.findall('{{{!s}}}Signature'.format(DS_NS))
+    if len(signatures) != 1:
+        logger.error('Expected one Signature of {!s} {!r}, found {!s}'.format(name, node_id, len(signatures)))
+        return None
+    references = signatures[0].findall('{{{0!s}}}SignedInfo/{{{0!s}}}Reference'.format(DS_NS))
+    if not references or any(ref.get('URI') != '#' + node_id for ref in references):
+        logger.error('Signature of {!s} {!r} does not reference it'.format(name, node_id))
+        return None
+    return node
+
+
+class CachingCryptoBackendXMLSecurity(CryptoBackendXMLSecurity):
+
+    def __init__(self, xmlsec1_backend, debug=False):
+        """
+        :param xmlsec1_backend: Backend used for encryption and decryption
+        :type xmlsec1_backend: saml2.sigver.CryptoBackendXmlSec1
+        """
+        CryptoBackendXMLSecurity.__init__(self, debug=debug)
+        self.xmlsec1_backend = xmlsec1_backend
+        self._certs = {}  # sha1 of the PEM data -> (PEM data, not before, not after), or None if not usable
+        self._lock = threading.Lock()
+
+    def version(self):
+        return 'XMLSecurity (cached certificates)'
+
+    def _cert_pem(self, cert_file):
+        """
+        :param cert_file: PEM file written by pysaml2 from metadata
+        :type cert_file: str
+
+        :return: The certificate if it can be used to verify signatures now, else None
+        :rtype: str | None
+        """
+        with open(cert_file, 'rb') as fd:
+            data = fd.read()
+        key = hashlib.sha1(data).hexdigest()
+        try:
+            cached = self._certs[key]
+        except KeyError:
+            try:
+                cert = ssl_crypto.load_certificate(ssl_crypto.FILETYPE_PEM, data)
+                cached = (data.decode('ascii'), _asn1_time(cert.get_notBefore()), _asn1_time(cert.get_notAfter()))
+            except (ssl_crypto.Error, ValueError) as e:
+                logger.error('Could not load certificate from metadata: {!r}'.format(e))
+                cached = None
+            with self._lock:
+                self._certs[key] = cached
+        if cached is None:
+            return None
+        pem, not_before, not_after = cached
+        now = datetime.utcnow()
+        if not not_before <= now <= not_after:
+            logger.error('Certificate {!s} is not valid, valid from {!s} to {!s}'.format(key, not_before, not_after))
+            return None
+        return pem
+
+    def validate_signature(self, signedtext, cert_file, cert_type, node_name, node_id, id_attr):
+        """
+        :param signedtext: The signed XML data as string
+        :param cert_file: PEM file with the certificate to verify with
+        :param cert_type: Must be 'pem'
+        :param node_name: Namespace and name of the signed element
+        :param node_id: ID of the signed element
+        :param id_attr: Name of the ID attribute
+
+        :return: True on successful validation, False otherwise
+        :rtype: bool
+        """
+        if cert_type != 'pem':
+            raise Unsupported('Only PEM certs supported here')
+        import xmlsec
+
+        pem = self._cert_pem(cert_file)
+        if pem is None:
+            return False
+        xml = xmlsec.parse_xml(signedtext)
+        node = _signed_node(xml, node_name, node_id, id_attr or 'ID')
+        if node is None:
+            return False
+        # Verify a copy of the element on its own, so that its Signature is the only one found and the
+        # reference can only be resolved to it
+        node = copy.deepcopy(node)
+        try:
+            # A PEM keyspec is used as is, no files are read
+            return xmlsec.verify(node, pem, sig_path='./{{{!s}}}Signature'.format(DS_NS))
+        except xmlsec.XMLSigException:
+            return False
+
+    def encrypt(self, *args, **kwargs):
+        return self.xmlsec1_backend.encrypt(*args, **kwargs)
+
+    def encrypt_assertion(self, *args, **kwargs):
+        return self.xmlsec1_backend.encrypt_assertion(*args, **kwargs)
+
+    def decrypt(self, enctext, key_file):
+        return self.xmlsec1_backend.decrypt(enctext, key_file)
+
+
+def init_crypto_backend(security_context, backend, debug=False):
+    """
+    Replace the crypto backend of a pysaml2 security context created for xmlsec1.
+
+    :param security_context: Security context of a Saml2Client
+    :param backend: One of CRYPTO_BACKENDS
+
+    :type security_context: saml2.sigver.SecurityContext
+    :type backend: str
+    """
+    if backend not in CRYPTO_BACKENDS:
+        raise ValueError('Unknown SAML2 crypto backend {!r}'.format(backend))
+    if backend == 'XMLSecurity':
+        security_context.crypto = CachingCryptoBackendXMLSecurity(security_context.crypto, debug=debug)
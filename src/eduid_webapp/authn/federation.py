@@ -0,0 +1,426 @@
+# -*- coding: utf-8 -*-
+
+"""
+Federation metadata for pysaml2, indexed and parsed lazily.
+
+pysaml2 parses a whole metadata aggregate into pysaml2 objects and then into
+dicts when it is loaded, and looks through all of it for some lookups. For a
+federation with thousands of entities that is slow to start, uses a lot of
+memory and is slow to reload.
+
+FederationMetadata streams the aggregate with iterparse and keeps every
+EntityDescriptor as serialized XML, together with an index of the entity
+roles, display names and entity attributes needed for discovery. An entity
+is only parsed the first time it is looked up. Use it from the SAML2
+settings module in place of a 'local' metadata file:
+
+    'metadata': [{
+        'class': 'eduid_webapp.authn.federation.FederationMetadata',
+        'metadata': [('/path/to/federation-metadata.xml', '/path/to/metadata-signer.crt')],
+    }],
+
+The certificate is optional, if given the aggregate signature is checked
+with xmlsec1 before anything is loaded.
+
+With start_refresh the file is checked for changes in a background thread,
+started by the first lookup in every process as threads do not survive the
+fork of a pre-forking server. A changed file is loaded next to the current metadata, and replaces it in
+one assignment when it has been loaded and checked. Requests keep using the
+current metadata until then, and if the new file can not be used.
+"""
+
+from __future__ import absolute_import
+
+import os
+import time
+import logging
+import threading
+from io import BytesIO
+from hashlib import sha1
+
+from saml2 import md, saml, samlp, SAMLError
+from saml2.mdstore import InMemoryMetaData, ToOld
+from saml2.sigver import CryptoBackendXmlSec1, SignatureError, get_xmlsec_binary
+from saml2.time_util import valid
+
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
+
+__author__ = 'lundberg'
+
+logger = logging.getLogger(__name__)
+
+# Only held to check the process id, see FederationMetadata._ensure_refreshing
+_fork_lock = threading.Lock()
+
+MDUI_NAMESPACE = 'urn:oasis:names:tc:SAML:metadata:ui'
+MDATTR_NAMESPACE = 'urn:oasis:names:tc:SAML:metadata:attribute'
+XML_LANG = '{http://www.w3.org/XML/1998/namespace}lang'
+
+ENTITY_DESCRIPTOR = '{{{!s}}}EntityDescriptor'.format(md.NAMESPACE)
+ENTITIES_DESCRIPTOR = '{{{!s}}}EntitiesDescriptor'.format(md.NAMESPACE)
+ARTIFACT_RESOLUTION_SERVICE = '{{{!s}}}ArtifactResolutionService'.format(md.NAMESPACE)
+DISPLAY_NAME = '{{{!s}}}DisplayName'.format(MDUI_NAMESPACE)
+ORGANIZATION_DISPLAY_NAME = '{{{ns}}}Organization/{{{ns}}}OrganizationDisplayName'.format(ns=md.NAMESPACE)
+ENTITY_ATTRIBUTE = '{{{md}}}Extensions/{{{mdattr}}}EntityAttributes/{{{saml}}}Attribute'.format(
+    md=md.NAMESPACE, mdattr=MDATTR_NAMESPACE, saml=saml.NAMESPACE)
+ATTRIBUTE_VALUE = '{{{!s}}}AttributeValue'.format(saml.NAMESPACE)
+
+# Role descriptor element -> the key pysaml2 uses for it
+ROLES = {
+    '{{{!s}}}{!s}'.format(md.NAMESPACE, tag): key for tag, key in [
+        ('IDPSSODescriptor', 'idpsso_descriptor'),
+        ('SPSSODescriptor', 'spsso_descriptor'),
+        ('AttributeAuthorityDescriptor', 'attribute_authority_descriptor'),
+        ('AuthnAuthorityDescriptor', 'authn_authority_descriptor'),
+        ('PDPDescriptor', 'pdp_descriptor'),
+        ('RoleDescriptor', 'role_descriptor'),
+        ('AffiliationDescriptor', 'affiliation_descriptor'),
+    ]
+}
+
+
+class IndexedEntity(object):
+
+    __slots__ = ['entity_id', 'xml', 'roles', 'display_names', 'attributes', 'artifact']
+
+    def __init__(self, entity_id, xml, roles, display_names, attributes, artifact):
+        """
+        :param entity_id: Entity id
+        :param xml: The serialized EntityDescriptor
+        :param roles: pysaml2 keys of the SAML2 roles of the entity, e.g. 'idpsso_descriptor'
+        :param display_names: Display names by language
+        :param attributes: Entity attribute values by attribute name
+        :param artifact: If the entity has an ArtifactResolutionService
+
+        :type entity_id: str | unicode
+        :type xml: bytes
+        :type roles: list
+        :type display_names: dict
+        :type attributes: dict
+        :type artifact: bool
+        """
+        self.entity_id = entity_id
+        self.xml = xml
+        self.roles = roles
+        self.display_names = display_names
+        self.attributes = attributes
+        self.artifact = artifact
+
+    @classmethod
+    def from_element(cls, elem):
+        """
+        :param elem: EntityDescriptor element
+        :type elem: xml.etree.ElementTree.Element
+
+        :return: The indexed entity, or None if it has no SAML2 roles
+        :rtype: IndexedEntity | None
+        """
+        roles = []
+        artifact = False
+        for child in elem:
+            role = ROLES.get(child.tag)
+            if role is None:
+                continue
+            # Same rule as pysaml2, every role except affiliation needs to support SAML2
+            if role != 'affiliation_descriptor' and \
+                    samlp.NAMESPACE not in child.get('protocolSupportEnumeration', '').split():
+                continue
+            roles.append(role)
+            if child.find(ARTIFACT_RESOLUTION_SERVICE) is not None:
+                artifact = True
+        if not roles:
+            return None
+
+        display_names = {}
+        for name in list(elem.iter(DISPLAY_NAME)) + elem.findall(ORGANIZATION_DISPLAY_NAME):
+            if name.text:
+                # mdui names go first and are preferred over organization names
+                display_names.setdefault(name.get(XML_LANG, 'en'), name.text.strip())
+
+        attributes = {}
+        for attribute in elem.findall(ENTITY_ATTRIBUTE):
+            values = attributes.setdefault(attribute.get('Name'), [])
+            values.extend(value.text.strip() for value in attribute.findall(ATTRIBUTE_VALUE) if value.text)
+
+        return cls(elem.get('entityID'), ElementTree.tostring(elem), roles, display_names, attributes, artifact)
+
+
+class FederationSnapshot(object):
+
+    def __init__(self, stamp):
+        """
+        :param stamp: (mtime, size) of the file the entities were loaded from
+        :type stamp: tuple
+        """
+        self.stamp = stamp
+        self.entities = {}  # entity id -> IndexedEntity
+        self.by_role = {}  # pysaml2 role key -> [entity id]
+        self.by_attribute = {}  # (attribute name, value) -> [entity id]
+        self.parsed = {}  # entity id -> pysaml2 entity dict, or None if filtered out
+
+    def add(self, entity):
+        """
+        :type entity: IndexedEntity
+        """
+        if entity.entity_id in self.entities:
+            logger.error('Duplicated entity descriptor (entity id: {!r})'.format(entity.entity_id))
+            return
+        self.entities[entity.entity_id] = entity
+        for role in entity.roles:
+            self.by_role.setdefault(role, []).append(entity.entity_id)
+        for name, values in entity.attributes.items():
+            for value in values:
+                self.by_attribute.setdefault((name, value), []).append(entity.entity_id)
+
+
+class FederationMetadata(InMemoryMetaData):
+
+    def __init__(self, attrc, filename=None, cert=None, **kwargs):
+        """
+        :param attrc: Attribute converters
+        :param filename: Path to the metadata aggregate
+        :param cert: Path to the certificate the aggregate is signed with, not checked if None
+
+        :type filename: str
+        :type cert: str | None
+        """
+        super(FederationMetadata, self).__init__(attrc, **kwargs)
+        if not filename:
+            raise SAMLError('No file specified.')
+        self.filename = filename
+        self.cert = cert
+        self._snapshot = FederationSnapshot(None)
+        self._refresh_lock = threading.Lock()
+        self._refresh_interval = None
+        self._refresher_pid = None
+
+    def _stamp(self):
+        stat = os.stat(self.filename)
+        return stat.st_mtime, stat.st_size
+
+    def _check_signature(self, data):
+        node_name = '{!s}:{!s}'.format(md.EntitiesDescriptor.c_namespace, md.EntitiesDescriptor.c_tag)
+        crypto = CryptoBackendXmlSec1(get_xmlsec_binary())
+        if not crypto.validate_signature(data, self.cert, 'pem', node_name, None, ''):
+            raise SignatureError('Could not verify the signature of {!s}'.format(self.filename))
+
+    def _read(self):
+        """
+        Load and index the aggregate, without parsing the entities.
+
+        :rtype: FederationSnapshot
+        """
+        # Stat before reading, a change while reading is picked up by the next refresh
+        snapshot = FederationSnapshot(self._stamp())
+        if self.cert:
+            with open(self.filename, 'rb') as fd:
+                data = fd.read()
+            self._check_signature(data)
+            source = BytesIO(data)
+        else:
+            source = self.filename
+
+        root = None
+        for event, elem in ElementTree.iterparse(source, events=('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = elem
+                    valid_until = elem.get('validUntil')
+                    if self.check_validity and valid_until and not valid(valid_until):
+                        raise ToOld('Metadata not valid anymore, it\'s only valid until {!s}'.format(valid_until))
+                continue
+            if elem.tag == ENTITY_DESCRIPTOR:
+                entity = IndexedEntity.from_element(elem)
+                if entity is not None:
+                    snapshot.add(entity)
+                # Everything needed is in the index now
+                elem.clear()
+        if root is None or root.tag not in [ENTITIES_DESCRIPTOR, ENTITY_DESCRIPTOR]:
+            raise SAMLError('No SAML2 metadata in {!s}'.format(self.filename))
+        for entity_ids in snapshot.by_role.values():
+            entity_ids.sort()
+        return snapshot
+
+    def load(self):
+        self._snapshot = self._read()
+        logger.info('Loaded {!s} entities from {!s}'.format(len(self._snapshot.entities), self.filename))
+        return True
+
+    def refresh(self):
+        """
+        Load the aggregate again if the file has changed, keeping the current metadata on errors.
+
+        :return: True if new metadata was loaded
+        :rtype: bool
+        """
+        with self._refresh_lock:
+            try:
+                if self._stamp() == self._snapshot.stamp:
+                    return False
+                snapshot = self._read()
+            except Exception as e:
+                logger.error('Could not refresh metadata from {!s}: {!r}'.format(self.filename, e))
+                return False
+            self._snapshot = snapshot
+        logger.info('Refreshed {!s} entities from {!s}'.format(len(snapshot.entities), self.filename))
+        return True
+
+    def _refresh_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            self.refresh()
+
+    def start_refresh(self, interval):
+        """
+        Check the file for changes every `interval` seconds in a background thread. The thread is
+        started by the first lookup in each process, so that it is running in forked workers.
+
+        :type interval: int
+        """
+        self._refresh_interval = interval
+
+    def _ensure_refreshing(self):
+        # Threads do not survive a fork, start one in every process doing lookups
+        if self._refresh_interval is None or self._refresher_pid == os.getpid():
+            return
+        with _fork_lock:
+            if self._refresher_pid == os.getpid():
+                return
+            # The refresher of the parent process can have held the lock when the process forked
+            self._refresh_lock = threading.Lock()
+            self._refresher_pid = os.getpid()
+        refresher = threading.Thread(target=self._refresh_loop, args=(self._refresh_interval,),
+                                     name='refresh {!s}'.format(self.filename))
+        refresher.daemon = True
+        refresher.start()
+
+    def _current(self):
+        """
+        :return: The current metadata
+        :rtype: FederationSnapshot
+        """
+        self._ensure_refreshing()
+        return self._snapshot
+
+    def _parse(self, entity):
+        """
+        :type entity: IndexedEntity
+
+        :return: The entity as parsed by pysaml2, None if it was filtered out or is too old
+        :rtype: dict | None
+        """
+        entity_descr = md.entity_descriptor_from_string(entity.xml)
+        parser = InMemoryMetaData(self.attrc, check_validity=self.check_validity, filter=self.filter)
+        parser.do_entity_descriptor(entity_descr)
+        if parser.to_old:
+            self.to_old.extend(parser.to_old)
+        return parser.entity.get(entity.entity_id)
+
+    def __getitem__(self, item):
+        snapshot = self._current()
+        try:
+            ent = snapshot.parsed[item]
+        except KeyError:
+            ent = self._parse(snapshot.entities[item])
+            snapshot.parsed[item] = ent
+        if ent is None:
+            raise KeyError(item)
+        return ent
+
+    def __contains__(self, item):
+        return item in self._current().entities
+
+    def __len__(self):
+        return len(self._current().entities)
+
+    def keys(self):
+        return list(self._current().entities.keys())
+
+    def items(self):
+        # Parses every entity, use the index based methods below where possible
+        res = []
+        for entity_id in self.keys():
+            try:
+                res.append((entity_id, self[entity_id]))
+            except KeyError:
+                pass
+        return res
+
+    def values(self):
+        return [ent for _, ent in self.items()]
+
+    def with_descriptor(self, descriptor):
+        res = {}
+        for entity_id in self._current().by_role.get('{!s}_descriptor'.format(descriptor), []):
+            try:
+                res[entity_id] = self[entity_id]
+            except KeyError:
+                pass
+        return res
+
+    def construct_source_id(self):
+        # Called for every new Saml2Client, only entities with an artifact resolution service are needed
+        res = {}
+        for entity in self._current().entities.values():
+            if not entity.artifact:
+                continue
+            try:
+                res[sha1(entity.entity_id.encode('utf-8')).digest()] = self[entity.entity_id]
+            except KeyError:
+                pass
+        return res
+
+    def identity_providers(self):
+        """
+        :return: Entity ids of the identity providers, sorted
+        :rtype: list
+        """
+        return list(self._current().by_role.get('idpsso_descriptor', []))
+
+    def with_entity_attribute(self, name, value):
+        """
+        :param name: Entity attribute name, e.g. http://macedir.org/entity-category
+        :param value: Entity attribute value
+
+        :return: Entity ids of the entities with the attribute value
+        :rtype: list
+        """
+        return list(self._current().by_attribute.get((name, value), []))
+
+    def display_name(self, entity_id, langpref='en'):
+        """
+        :return: Display name of the entity in langpref, or any language if missing, None for unknown entities
+        :rtype: str | unicode | None
+        """
+        try:
+            names = self._current().entities[entity_id].display_names
+        except KeyError:
+            return None
+        if langpref in names:
+            return names[langpref]
+        return next(iter(names.values()), None)
+
+
+def start_refresh(metadata_store, interval):
+    """
+    Start background refreshing of all FederationMetadata in a pysaml2 metadata store, in every
+    process from its first lookup.
+
+    :param metadata_store: Metadata of a SAML2 configuration
+    :param interval: Seconds between checks for changed files
+
+    :type metadata_store: saml2.mdstore.MetadataStore
+    :type interval: int
+
+    :return: Number of refreshed metadata sources
+    :rtype: int
+    """
+    count = 0
+    for _md in metadata_store.metadata.values():
+        if isinstance(_md, FederationMetadata):
+            _md.start_refresh(interval)
+            count += 1
+    return count
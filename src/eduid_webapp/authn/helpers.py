@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import json
+from xml.etree.ElementTree import ParseError
+
+from flask import current_app
+from saml2 import BINDING_HTTP_POST
+from saml2.response import UnsolicitedResponse
+from werkzeug.exceptions import BadRequest
+
+from eduid_common.authn.cache import IdentityCache, OutstandingQueriesCache
+from eduid_webapp.authn.replay import assertion_ids
+
+__author__ = 'lundberg'
+
+# Outstanding query ids, oldest first
+OUTSTANDING_QUERIES_ORDER = '_saml2_outstanding_queries_order'
+
+
+def session_size(session):
+    """
+    :return: Approximate size in bytes of the session when stored
+    :rtype: int
+    """
+    return len(json.dumps(dict(session.items()), default=str))
+
+
+def prune_outstanding_queries(session, max_queries, max_session_size=None):
+    """
+    Drop the oldest outstanding queries, e.g. from abandoned logins, until at most
+    max_queries remain and the session is no larger than max_session_size.
+
+    Queries added since the last call are taken to be the newest. Call before
+    adding a query, to make room for it, and after, to record its place.
+
+    :param session: The current session
+    :param max_queries: Maximum number of outstanding queries to keep
+    :param max_session_size: Maximum session size in bytes, not checked if None
+
+    :type session: eduid_common.session.session.Session
+    :type max_queries: int
+    :type max_session_size: int | None
+    """
+    oq_cache = OutstandingQueriesCache(session)
+    queries = oq_cache.outstanding_queries()
+    order = [query_id for query_id in session.get(OUTSTANDING_QUERIES_ORDER, []) if query_id in queries]
+    order.extend(query_id for query_id in queries if query_id not in order)
+    pruned = 0
+    while order and (len(order) > max_queries or
+                     (max_session_size is not None and session_size(session) > max_session_size)):
+        oq_cache.delete(order.pop(0))
+        pruned += 1
+    if pruned:
+        current_app.logger.info('Pruned {!s} outstanding SAML2 queries from the session'.format(pruned))
+    session[OUTSTANDING_QUERIES_ORDER] = order
+
+
+def get_authn_response(session, raw_response):
+    """
+    Parse and verify a SAML2 authentication response, using a client from the
+    app's Saml2ClientFactory so that the configured crypto backend is used.
+
+    :param session: The current session
+    :param raw_response: The base64 encoded SAMLResponse
+
+    :type session: eduid_common.session.session.Session
+    :type raw_response: str | unicode
+
+    :return: Session info from the response
+    :rtype: dict
+    """
+    replay_cache = current_app.replay_cache
+    for assertion_id in assertion_ids(raw_response):
+        if replay_cache.seen(assertion_id):
+            current_app.logger.error('Replayed SAML assertion {!r}'.format(assertion_id))
+            raise BadRequest('SAML response has already been used.')
+
+    client = current_app.saml2_client_factory(identity_cache=IdentityCache(session))
+    oq_cache = OutstandingQueriesCache(session)
+    outstanding_queries = oq_cache.outstanding_queries()
+
+    try:
+        response = client.parse_authn_request_response(raw_response, BINDING_HTTP_POST, outstanding_queries)
+    except AssertionError:
+        current_app.logger.error('SAML response is not verified')
+        raise BadRequest('SAML response is not verified. May be caused by the response was not issued at a '
+                         'reasonable time or the SAML status is not ok. Check the IdP datetime setup.')
+    except ParseError as e:
+        current_app.logger.error('SAML response is not correctly formatted: {!r}'.format(e))
+        raise BadRequest('SAML response is not correctly formatted and therefore the XML document could not be '
+                         'parsed.')
+    except UnsolicitedResponse:
+        current_app.logger.error('Unsolicited SAML response')
+        raise BadRequest('Unsolicited SAML response.')
+
+    if response is None:
+        current_app.logger.error('SAML response is None')
+        raise BadRequest('SAML response has errors. Please check the logs.')
+
+    if not replay_cache.add(response.assertion.id, response.not_on_or_after):
+        current_app.logger.error('Replayed SAML assertion {!r}'.format(response.assertion.id))
+        raise BadRequest('SAML response has already been used.')
+
+    oq_cache.delete(response.session_id())
+    return response.session_info()
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+"""
+SAML2 global logout with concurrent back-channel requests.
+
+pysaml2's global_logout sends the SOAP logout requests to the session
+participants one after another, each without a timeout. Here the
+participants with a SOAP single logout service are logged out concurrently,
+each request limited to SAML2_LOGOUT_PARTICIPANT_TIMEOUT seconds, and the
+caller waits for them at most until the request deadline. Participants
+that fail or do not answer in time are logged, the local logout is done
+anyway.
+
+The client and its state and identity caches are backed by the session of
+the request, so the logout requests are made and the responses parsed on
+the request thread. Only sending the requests is done in the pool.
+
+Participants that only support front-channel logout are handled like
+before, with a redirect of the user to the first of them.
+"""
+
+from __future__ import absolute_import
+
+import logging
+from functools import partial
+
+from saml2 import BINDING_HTTP_REDIRECT, BINDING_SOAP
+from saml2.client_base import LogoutError
+from saml2.mdstore import destinations
+
+from eduid_webapp.api.concurrency import get_thread_pool, run_concurrently
+
+__author__ = 'lundberg'
+
+logger = logging.getLogger(__name__)
+
+
+class LogoutResult(object):
+
+    def __init__(self):
+        self.statuses = {}  # entity id -> 'ok', 'failed' or 'timeout' for the back-channel logouts
+        self.http_info = None  # Front-channel logout to continue with, if any
+
+    @property
+    def done(self):
+        """
+        :return: True if no front-channel logout remains
+        :rtype: bool
+        """
+        return self.http_info is None
+
+
+def _has_soap_logout(client, entity_id):
+    try:
+        return bool(client.metadata.single_logout_service(entity_id, BINDING_SOAP, 'idpsso'))
+    except Exception:
+        return False
+
+
+def _soap_logout_request(client, name_id, reason, entity_id):
+    """
+    Make a logout request like client.do_logout does for the SOAP binding.
+
+    :return: Arguments for client.send
+    :rtype: dict
+    """
+    srvs = client.metadata.single_logout_service(entity_id, BINDING_SOAP, 'idpsso')
+    destination = destinations(srvs)[0]
+    try:
+        session_indexes = [client.users.get_info_from(name_id, entity_id, False)['session_index']]
+    except KeyError:
+        session_indexes = None
+    _, request = client.create_logout_request(destination, entity_id, name_id=name_id, reason=reason,
+                                              session_indexes=session_indexes)
+    if client.logout_requests_signed:
+        srequest = client.sign(request)
+    else:
+        srequest = str(request)
+    return client.apply_binding(BINDING_SOAP, srequest, destination)
+
+
+def _send(client, http_infos, participant_timeout, entity_id):
+    """
+    Run in the pool, must not use the session.
+
+    :return: The SOAP response, None if the participant did not answer with 200 OK
+    :rtype: str | None
+    """
+    response = client.send(timeout=participant_timeout, **http_infos[entity_id])
+    if response.status_code != 200:
+        return None
+    return response.text
+
+
+def _logged_out(client, soap_response):
+    """
+    :return: True if the participant logged the subject out
+    :rtype: bool
+    """
+    if soap_response is None:
+        return False
+    response = client.parse_logout_request_response(soap_response, BINDING_SOAP)
+    return response is not None and response.status_ok()
+
+
+def concurrent_global_logout(client, name_id, participant_timeout, timeout=None, threads=10, reason=''):
+    """
+    :param client: Client with the identity cache of the current session
+    :param name_id: The subject to log out
+    :param participant_timeout: Seconds to wait for each back-channel logout request
+    :param timeout: Seconds to wait for all back-channel logouts, None to wait until they are done
+    :param threads: Size of the pool the back-channel logouts run in
+    :param reason: Logout reason sent to the participants
+
+    :type client: saml2.client.Saml2Client
+    :type name_id: saml2.saml.NameID
+    :type participant_timeout: float
+    :type timeout: float | None
+    :type threads: int
+    :type reason: str
+
+    :rtype: LogoutResult
+    """
+    entity_ids = client.users.issuers_of_info(name_id)
+    back_channel = [entity_id for entity_id in entity_ids if _has_soap_logout(client, entity_id)]
+    front_channel = [entity_id for entity_id in entity_ids if entity_id not in back_channel]
+    result = LogoutResult()
+
+    if back_channel:
+        http_infos = {}
+        for entity_id in back_channel:
+            try:
+                http_infos[entity_id] = _soap_logout_request(client, name_id, reason, entity_id)
+            except Exception as e:
+                logger.error('Back-channel logout request for {!r} not possible: {!r}'.format(entity_id, e))
+                result.statuses[entity_id] = 'failed'
+        pool = get_thread_pool('saml2-logout', threads)
+        send = partial(_send, client, http_infos, participant_timeout)
+        outcomes = run_concurrently(pool, send, list(http_infos.keys()), timeout)
+        for entity_id, (outcome, value) in outcomes.items():
+            if outcome == 'ok':
+                try:
+                    if not _logged_out(client, value):
+                        outcome = 'failed'
+                except Exception as e:
+                    outcome, value = 'failed', e
+            if outcome != 'ok':
+                logger.error('Back-channel logout from {!r}: {!s} {!r}'.format(entity_id, outcome, value))
+            result.statuses[entity_id] = outcome
+
+    if front_channel:
+        try:
+            logouts = client.do_logout(name_id, front_channel, reason, None, expected_binding=BINDING_HTTP_REDIRECT)
+            result.http_info = logouts[front_channel[0]][1]
+        except LogoutError as e:
+            logger.error('Front-channel logout not possible: {!r}'.format(e))
+    return result
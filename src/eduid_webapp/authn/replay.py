@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+"""
+Replay protection for SAML2 assertions.
+
+Every assertion accepted by the ACS is recorded in Redis under its ID, with
+a TTL reaching to the end of the assertion validity, after which pysaml2
+rejects it anyway. A response is checked against the cache before pysaml2
+parses it and verifies the signatures, using the IDs of the assertions
+that are visible in the XML, so that a repeated POST is rejected without
+doing the work again. The response is not trusted at that point, so it is
+parsed with defusedxml. Encrypted assertions are only checked when they have
+been decrypted and verified, when the assertion is recorded.
+
+Recording uses SET NX, so that of two concurrent uses of an assertion only
+one is accepted. Nothing is recorded for responses that do not verify, as
+anybody can post an unsigned response with the ID of someone else's
+assertion.
+"""
+
+from __future__ import absolute_import
+
+import time
+import base64
+import logging
+
+import redis
+from defusedxml import ElementTree
+from saml2 import saml
+
+from eduid_common.session.session import get_redis_pool
+
+__author__ = 'lundberg'
+
+logger = logging.getLogger(__name__)
+
+ASSERTION = '{{{!s}}}Assertion'.format(saml.NAMESPACE)
+
+
+def assertion_ids(raw_response):
+    """
+    IDs of the unencrypted assertions in a response, without verifying anything.
+
+    :param raw_response: The base64 encoded SAMLResponse
+    :type raw_response: str | unicode
+
+    :return: Assertion IDs, empty if there are none or the response can not be parsed
+    :rtype: list
+    """
+    try:
+        # Entities and DTDs are refused, the response is not verified yet
+        root = ElementTree.fromstring(base64.b64decode(raw_response))
+    except Exception as e:
+        # Reported properly when pysaml2 parses the response
+        logger.debug('Could not look for assertion ids: {!r}'.format(e))
+        return []
+    return [elem.get('ID') for elem in root.iter(ASSERTION) if elem.get('ID')]
+
+
+class ReplayCache(object):
+
+    def __init__(self, redis_client, prefix='saml2-assertion:', default_ttl=3600):
+        """
+        :param redis_client: Redis connection
+        :param prefix: Prefix for the Redis keys
+        :param default_ttl: Seconds to remember assertions without an end of validity
+
+        :type redis_client: redis.StrictRedis
+        :type prefix: str
+        :type default_ttl: int
+        """
+        self.redis = redis_client
+        self.prefix = prefix
+        self.default_ttl = default_ttl
+
+    def _key(self, assertion_id):
+        return '{!s}{!s}'.format(self.prefix, assertion_id)
+
+    def seen(self, assertion_id):
+        """
+        :rtype: bool
+        """
+        return bool(self.redis.exists(self._key(assertion_id)))
+
+    def add(self, assertion_id, not_on_or_after=None):
+        """
+        Record a verified assertion.
+
+        :param assertion_id: Assertion ID
+        :param not_on_or_after: End of the assertion validity in seconds since the epoch
+
+        :type assertion_id: str | unicode
+        :type not_on_or_after: int | None
+
+        :return: False if the assertion had already been recorded
+        :rtype: bool
+        """
+        if not_on_or_after:
+            ttl = max(int(not_on_or_after - time.time()), 1)
+        else:
+            ttl = self.default_ttl
+        return bool(self.redis.set(self._key(assertion_id), int(time.time()), ex=ttl, nx=True))
+
+
+def get_redis_client(config):
+    """
+    :param config: App configuration with the REDIS_* settings, as used for the sessions
+    :type config: dict
+
+    :rtype: redis.StrictRedis
+    """
+    return redis.StrictRedis(connection_pool=get_redis_pool(config))
+
+
+def init_replay_cache(app):
+    """
+    :param app: Flask app
+    :type app: flask.Flask
+
+    :return: Flask app
+    :rtype: flask.Flask
+    """
+    app.config.setdefault('SAML2_REPLAY_CACHE_DEFAULT_TTL', 3600)
+    app.replay_cache = ReplayCache(get_redis_client(app.config),
+                                   default_ttl=app.config['SAML2_REPLAY_CACHE_DEFAULT_TTL'])
+    return app
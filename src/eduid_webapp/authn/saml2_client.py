@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import copy
+import threading
+
+from saml2.client import Saml2Client
+from saml2.population import Population
+
+from eduid_webapp.authn.crypto import init_crypto_backend
+
+try:
+    from cookielib import CookieJar
+except ImportError:  # Python3
+    from http.cookiejar import CookieJar
+
+__author__ = 'lundberg'
+
+
+class Saml2ClientFactory(object):
+    """
+    Per process factory for Saml2Client instances bound to a SAML2 configuration.
+
+    Creating a Saml2Client sets up a security context (locating xmlsec1 and
+    reading the signing key), computes source ids for every entity in the
+    metadata and reads the rest of the SP configuration. That is done once,
+    for a template client, and every request gets a shallow copy of it with
+    its own state cache, identity cache and cookies.
+    """
+
+    def __init__(self, saml2_config, crypto_backend='xmlsec1'):
+        """
+        :param saml2_config: SAML2 SP configuration
+        :param crypto_backend: Backend for XML signatures, see eduid_webapp.authn.crypto
+
+        :type saml2_config: saml2.config.SPConfig
+        :type crypto_backend: str
+        """
+        self.saml2_config = saml2_config
+        self.crypto_backend = crypto_backend
+        self._template = None
+        self._lock = threading.Lock()
+
+    @property
+    def template(self):
+        """
+        :return: Client holding the configuration bound parts shared by all requests
+        :rtype: Saml2Client
+        """
+        if self._template is None:
+            with self._lock:
+                if self._template is None:
+                    template = Saml2Client(self.saml2_config)
+                    init_crypto_backend(template.sec, self.crypto_backend, debug=template.debug)
+                    self._template = template
+        return self._template
+
+    def __call__(self, state_cache=None, identity_cache=None):
+        """
+        :param state_cache: Where the client keeps state information, usually a StateCache
+        :param identity_cache: Where the client keeps identity information, usually an IdentityCache
+
+        :type state_cache: dict
+        :type identity_cache: dict
+
+        :return: Client for the current request
+        :rtype: Saml2Client
+        """
+        template = self.template
+        client = copy.copy(template)
+        # Everything below is per request state set up by Saml2Client.__init__
+        client.users = Population(identity_cache)
+        client.state = state_cache if state_cache is not None else {}
+        client.lock = threading.Lock()
+        client.cookiejar = CookieJar()
+        client.request_args = dict(template.request_args)
+        client.artifact = {}
+        client.artifact2response = {}
+        return client
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+
+"""
+Write-behind sessions for the authn app.
+
+A login calls session.persist() several times, from schedule_action, from
+the ACS action and from the SAML2 caches, and every call is a write of the
+whole session to Redis. With init_write_behind_session the session keeps
+track of the keys changed during a request served by the app, and
+persist() only records that a write is wanted. The session is written once,
+when the response is saved, if anything changed or a write was asked for.
+
+If no response is saved, because the view raised an exception, the session
+is written when the request is torn down if persist() was called, as it
+would have been without write-behind. Changes that persist() was not asked
+to write are dropped, as the session interface would have dropped them.
+
+The session is stored as a single Redis value, so that one write carries
+every changed key. Outside of a dispatched request, e.g. in a
+test_request_context, persist() writes immediately as before.
+
+Per request the number of persist() calls and actual writes are logged and
+added to the app metrics as 'session.persist_calls' and 'session.writes'.
+"""
+
+from __future__ import absolute_import
+
+import logging
+
+from flask import current_app, session
+
+from eduid_webapp.api.metrics import init_metrics
+
+__author__ = 'lundberg'
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindSession(object):
+
+    _own_attributes = ['base', 'deferred', 'flushed', 'dirty', 'persist_requested', 'persist_calls', 'writes']
+
+    def __init__(self, base):
+        """
+        :param base: The session written by persist()
+        :type base: eduid_common.api.session.EduidSession
+        """
+        self.base = base
+        self.deferred = False  # Writes are held until flush
+        self.flushed = False  # The response is being saved
+        self.dirty = set()
+        self.persist_requested = False
+        self.persist_calls = 0
+        self.writes = 0
+
+    def __getattr__(self, item):
+        if item in WriteBehindSession._own_attributes:
+            raise AttributeError(item)
+        return getattr(self.base, item)
+
+    def __setattr__(self, key, value):
+        if key in WriteBehindSession._own_attributes:
+            object.__setattr__(self, key, value)
+        else:
+            setattr(self.base, key, value)
+
+    def __getitem__(self, key):
+        return self.base[key]
+
+    def __setitem__(self, key, value):
+        # Values can be mutated in place and set again, so every assignment counts as a change
+        self.base[key] = value
+        self.dirty.add(key)
+
+    def __delitem__(self, key):
+        del self.base[key]
+        self.dirty.add(key)
+
+    def __contains__(self, key):
+        return key in self.base
+
+    def __iter__(self):
+        return iter(self.base)
+
+    def __len__(self):
+        return len(self.base)
+
+    def get(self, key, default=None):
+        return self.base.get(key, default)
+
+    def keys(self):
+        return self.base.keys()
+
+    def values(self):
+        return self.base.values()
+
+    def items(self):
+        return self.base.items()
+
+    def pop(self, key, *args):
+        if key in self.base:
+            self.dirty.add(key)
+        return self.base.pop(key, *args)
+
+    def setdefault(self, key, default=None):
+        if key not in self.base:
+            self.dirty.add(key)
+        return self.base.setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        changes = dict(*args, **kwargs)
+        self.base.update(changes)
+        self.dirty.update(changes.keys())
+
+    def clear(self):
+        self.dirty.update(list(self.base.keys()))
+        self.base.clear()
+
+    def _write(self):
+        self.base.persist()
+        self.writes += 1
+        self.dirty.clear()
+        self.persist_requested = False
+
+    def persist(self):
+        self.persist_calls += 1
+        if self.deferred:
+            self.persist_requested = True
+        elif self.flushed and not self.dirty:
+            # Already written when the response was saved
+            return
+        else:
+            self._write()
+
+    def flush(self):
+        """
+        Write the session if it changed or a write was asked for since the request started.
+        """
+        self.deferred = False
+        self.flushed = True
+        if self.dirty or self.persist_requested:
+            self._write()
+
+
+class WriteBehindSessionInterface(object):
+
+    def __init__(self, base):
+        """
+        :param base: The session interface of the app
+        :type base: flask.sessions.SessionInterface
+        """
+        self.base = base
+
+    def __getattr__(self, item):
+        if item == 'base':
+            raise AttributeError(item)
+        return getattr(self.base, item)
+
+    def open_session(self, app, request):
+        sess = self.base.open_session(app, request)
+        if sess is None:
+            return None
+        return WriteBehindSession(sess)
+
+    def save_session(self, app, sess, response):
+        if not isinstance(sess, WriteBehindSession):
+            return self.base.save_session(app, sess, response)
+        sess.flush()
+        result = self.base.save_session(app, sess, response)
+        _count_writes(app, sess)
+        return result
+
+
+def _count_writes(app, sess):
+    logger.debug('Session persist calls: {!s}, writes: {!s}'.format(sess.persist_calls, sess.writes))
+    app.metrics.incr('session.persist_calls', sess.persist_calls)
+    app.metrics.incr('session.writes', sess.writes)
+
+
+def defer_session_writes():
+    sess = session._get_current_object()
+    if isinstance(sess, WriteBehindSession):
+        sess.deferred = True
+
+
+def flush_unsaved_session(exception=None):
+    """
+    Write the session if persist() was called during a request that did not save its response.
+    """
+    sess = session._get_current_object()
+    if not isinstance(sess, WriteBehindSession) or not sess.deferred:
+        return
+    if sess.persist_requested:
+        logger.debug('Writing session of a request that ended with {!r}'.format(exception))
+        sess.flush()
+    else:
+        sess.deferred = False
+    _count_writes(current_app, sess)
+
+
+def init_write_behind_session(app):
+    """
+    :param app: Flask app with its session interface set up
+    :type app: flask.Flask
+
+    :return: Flask app
+    :rtype: flask.Flask
+    """
+    init_metrics(app)
+    if not isinstance(app.session_interface, WriteBehindSessionInterface):
+        app.session_interface = WriteBehindSessionInterface(app.session_interface)
+        app.before_request(defer_session_writes)
+        app.teardown_request(flush_unsaved_session)
+    return app
@@ -6,6 +6,44 @@ SECRET_KEY = ''
 MONGO_URI = 'mongodb://'
 REDIS_HOST = ''
 
+# Backend for XML signature verification, 'xmlsec1' (subprocess) or 'XMLSecurity' (in-process)
+SAML2_CRYPTO_BACKEND = 'xmlsec1'
+
+# SP metadata served at /saml2-metadata
+SAML2_METADATA_SIGN = False
+SAML2_METADATA_CHECK_INTERVAL = 60  # Seconds between checks for changed SAML2 settings or certificates
+SAML2_METADATA_MAX_AGE = 3600  # Seconds, sent in Cache-Control
+
+# IdP to use when a login does not ask for one, defaults to the IdP in the SAML2 settings if there is only one
+SAML2_DEFAULT_IDP = None
+# Seconds between checks for changed eduid_webapp.authn.federation.FederationMetadata files, 0 to never check
+SAML2_FEDERATION_REFRESH_INTERVAL = 300
+
+# Seconds to remember used assertions that do not say how long they are valid
+SAML2_REPLAY_CACHE_DEFAULT_TTL = 3600
+# Oldest outstanding authentication requests are dropped from the session beyond these limits
+SAML2_MAX_OUTSTANDING_QUERIES = 10
+SAML2_MAX_SESSION_SIZE = 16384  # Bytes
+
+# Users looked up by eppn, see eduid_webapp.authn.user_cache. A size of 0 disables the cache.
+USER_CACHE_SIZE = 1000
+USER_CACHE_TTL = 60  # Seconds
+USER_CACHE_CHECK_MODIFIED = False  # Check modified_ts in the database before using a cached user
+# Check modified_ts in the database before using a cached user in the ACS
+SAML2_ACS_CHECK_USER_MODIFIED = False
+# Always read the user from the database in the ACS
+SAML2_ACS_BYPASS_USER_CACHE = False
+
+# Log out of the session participants with SOAP single logout concurrently, see eduid_webapp.authn.logout
+SAML2_CONCURRENT_LOGOUT = True
+SAML2_LOGOUT_PARTICIPANT_TIMEOUT = 5  # Seconds for each participant
+SAML2_LOGOUT_THREADS = 10
+# Seconds a request may take, the back-channel logouts are not waited for beyond it
+REQUEST_DEADLINE = 25
+REQUEST_DEADLINES = {}
+# Seconds between logging the process metrics (cache hits, session writes etc.), 0 to not log them
+METRICS_LOG_INTERVAL = 300
+
 
 required_loa = {
     'personal': 'http://www.swamid.se/policy/assurance/al1',
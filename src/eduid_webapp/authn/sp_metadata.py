@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+"""
+Precomputed SAML2 SP metadata.
+
+The metadata document is generated once, optionally signed with the SP key,
+and kept as bytes together with its ETag and the time its inputs last changed.
+The ID of a signed document is derived from the entity ID and the contents of
+the settings, certificate and key files, so that every process serves the same
+document, with the same ETag, for the same inputs. At most every
+SAML2_METADATA_CHECK_INTERVAL seconds the modification times of the SAML2
+settings module and of the certificate and key files are compared with the
+ones the document was generated from, and the document is regenerated from a
+freshly loaded configuration if any of them changed.
+"""
+
+from __future__ import absolute_import
+
+import os
+import time
+import hashlib
+import logging
+import threading
+from datetime import datetime
+
+from flask import Response
+from saml2.metadata import entity_descriptor, sign_entity_descriptor
+from saml2.sigver import security_context
+
+from eduid_common.authn.utils import get_saml2_config
+
+__author__ = 'lundberg'
+
+logger = logging.getLogger(__name__)
+
+
+class SPMetadataDocument(object):
+
+    def __init__(self, data, mtimes):
+        """
+        :param data: Serialized metadata
+        :param mtimes: Modification times of the files the metadata was generated from
+
+        :type data: bytes
+        :type mtimes: dict
+        """
+        self.data = data
+        self.mtimes = mtimes
+        self.etag = hashlib.sha1(data).hexdigest()
+        known = [mtime for mtime in mtimes.values() if mtime is not None]
+        if known:
+            self.last_modified = datetime.utcfromtimestamp(max(known)).replace(microsecond=0)
+        else:
+            self.last_modified = datetime.utcnow().replace(microsecond=0)
+
+
+class SPMetadata(object):
+
+    def __init__(self, settings_module, sign=False, check_interval=60, max_age=3600, saml2_config=None):
+        """
+        :param settings_module: Path to the SAML2 settings module
+        :param sign: Sign the metadata with the SP key
+        :param check_interval: Seconds between checks for changed settings or certificates
+        :param max_age: Cache-Control max-age in seconds
+        :param saml2_config: Already loaded configuration for settings_module
+
+        :type settings_module: str
+        :type sign: bool
+        :type check_interval: int
+        :type max_age: int
+        :type saml2_config: saml2.config.SPConfig
+        """
+        self.settings_module = settings_module
+        self.sign = sign
+        self.check_interval = check_interval
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._checked = time.time()
+        self._document = self._generate(saml2_config)
+
+    @staticmethod
+    def _watched_files(saml2_config):
+        files = [saml2_config.cert_file, saml2_config.key_file]
+        for keypair in saml2_config.encryption_keypairs or []:
+            files.extend([keypair.get('cert_file'), keypair.get('key_file')])
+        return [path for path in files if path]
+
+    def _mtimes(self, files):
+        mtimes = {}
+        for path in [self.settings_module] + files:
+            try:
+                mtimes[path] = os.stat(path).st_mtime
+            except OSError:
+                mtimes[path] = None
+        return mtimes
+
+    @staticmethod
+    def _signed_id(saml2_config, files):
+        """
+        :return: ID for the signed metadata, the same for the same entity ID, settings and keys
+        :rtype: str
+        """
+        digest = hashlib.sha1(saml2_config.entityid.encode('utf-8'))
+        for path in files:
+            with open(path, 'rb') as fd:
+                digest.update(fd.read())
+        # An XML ID can not start with a digit
+        return 'id-{!s}'.format(digest.hexdigest())
+
+    def _generate(self, saml2_config=None):
+        """
+        :param saml2_config: Configuration to generate the metadata from, loaded from the settings module if None
+        :type saml2_config: saml2.config.SPConfig | None
+
+        :rtype: SPMetadataDocument
+        """
+        if saml2_config is None:
+            saml2_config = get_saml2_config(self.settings_module)
+        # Get the mtimes before reading the files, a change while generating is picked up by the next check
+        files = self._watched_files(saml2_config)
+        mtimes = self._mtimes(files)
+        edesc = entity_descriptor(saml2_config)
+        if self.sign:
+            ident = self._signed_id(saml2_config, [self.settings_module] + files)
+            _, data = sign_entity_descriptor(edesc, ident, security_context(saml2_config))
+        else:
+            data = edesc.to_string()
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        return SPMetadataDocument(data, mtimes)
+
+    @property
+    def document(self):
+        """
+        :return: Current metadata, regenerated first if the settings or certificates changed
+        :rtype: SPMetadataDocument
+        """
+        now = time.time()
+        if now - self._checked >= self.check_interval and self._lock.acquire(False):
+            # Only one thread checks, the others keep serving the current document
+            try:
+                self._checked = now
+                files = [path for path in self._document.mtimes if path != self.settings_module]
+                if self._mtimes(files) != self._document.mtimes:
+                    logger.info('SAML2 settings or certificates changed, regenerating SP metadata')
+                    self._document = self._generate()
+            except Exception as e:
+                # Files can be in the middle of being replaced, keep the current document and retry later
+                logger.error('Could not regenerate SP metadata: {!r}'.format(e))
+            finally:
+                self._lock.release()
+        return self._document
+
+    def response(self, request):
+        """
+        :param request: The current request, used for conditional responses
+        :type request: flask.Request
+
+        :rtype: flask.Response
+        """
+        document = self.document
+        response = Response(document.data, 200, mimetype='text/xml')
+        response.headers['Content-Type'] = 'text/xml; charset=utf8'
+        response.set_etag(document.etag)
+        response.last_modified = document.last_modified
+        response.cache_control.public = True
+        response.cache_control.max_age = self.max_age
+        return response.make_conditional(request)
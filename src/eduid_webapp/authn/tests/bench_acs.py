@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+"""
+ACS throughput benchmark comparing the SAML2 crypto backends.
+
+Parses and verifies N signed authentication responses with a client from
+Saml2ClientFactory, once with the xmlsec1 subprocess backend and once with
+the in-process XMLSecurity backend, using `--concurrency` threads.
+
+Usage:
+
+    python -m eduid_webapp.authn.tests.bench_acs [-n 500] [-c 4]
+"""
+
+from __future__ import absolute_import, print_function
+
+import time
+import argparse
+import threading
+
+from saml2 import BINDING_HTTP_POST
+from saml2.cache import Cache
+from saml2.s_utils import sid
+
+from eduid_webapp.authn.crypto import CRYPTO_BACKENDS
+from eduid_webapp.authn.saml2_client import Saml2ClientFactory
+from eduid_webapp.authn.tests.saml_responses import ResponseFactory, make_sp_config
+
+try:
+    import Queue as queue
+except ImportError:  # Python3
+    import queue
+
+__author__ = 'lundberg'
+
+
+def worker(factory, responses, latencies, errors):
+    while True:
+        try:
+            session_id, saml_response = responses.get_nowait()
+        except queue.Empty:
+            return
+        t0 = time.time()
+        try:
+            client = factory(identity_cache=Cache())
+            response = client.parse_authn_request_response(saml_response, BINDING_HTTP_POST, {session_id: '/'})
+            assert response.session_info()['ava']['eduPersonPrincipalName'] == ['hubba-bubba']
+        except Exception as e:
+            errors.append(e)
+        latencies.append(time.time() - t0)
+
+
+def run(sp_config, backend, saml_responses, concurrency):
+    factory = Saml2ClientFactory(sp_config, crypto_backend=backend)
+    factory.template  # Set up outside of the timing
+    responses = queue.Queue()
+    for item in saml_responses:
+        responses.put(item)
+    latencies, errors = [], []
+    threads = [threading.Thread(target=worker, args=(factory, responses, latencies, errors))
+               for _ in range(concurrency)]
+    t0 = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.time() - t0, sorted(latencies), errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare ACS throughput of the SAML2 crypto backends')
+    parser.add_argument('-n', '--count', type=int, default=500, help='Number of responses per backend')
+    parser.add_argument('-c', '--concurrency', type=int, default=1, help='Number of threads')
+    args = parser.parse_args()
+
+    sp_config = make_sp_config(want_assertions_signed=True)
+    response_factory = ResponseFactory(sp_config)
+    print('Signing {!s} responses...'.format(args.count))
+    saml_responses = []
+    for _ in range(args.count):
+        session_id = sid()
+        saml_responses.append((session_id, response_factory.saml_response(session_id, 'hubba-bubba')))
+
+    print('{:<12} {:>10} {:>12} {:>10} {:>10} {:>8}'.format('backend', 'total (s)', 'responses/s', 'p50 (ms)',
+                                                          'p99 (ms)', 'errors'))
+    for backend in CRYPTO_BACKENDS:
+        total, latencies, errors = run(sp_config, backend, saml_responses, args.concurrency)
+        print('{:<12} {:>10.3f} {:>12.1f} {:>10.2f} {:>10.2f} {:>8}'.format(
+            backend, total, len(latencies) / total, 1000 * latencies[len(latencies) // 2],
+            1000 * latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], len(errors)))
+        if errors:
+            print('  first error: {!r}'.format(errors[0]))
+
+
+if __name__ == '__main__':
+    main()
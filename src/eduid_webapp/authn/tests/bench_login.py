@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+
+"""
+Login throughput benchmark for the ACS.
+
+Starts N logins the way the /login view does, one session and one user per
+login, and signs (and optionally encrypts) a response for each of them with
+the test IdP from saml_responses. The responses are then posted to
+/saml2-acs from `--concurrency` threads. Needs a MongoDB and a Redis to talk
+to, the user database is dropped afterwards.
+
+Every login is for a user of its own, so the user lookups are not answered
+from the user cache and the numbers are those of a user logging in for the
+first time in a while. The crypto backends are compared by bench_acs, this
+benchmark uses the SAML2_CRYPTO_BACKEND default of the app.
+
+Every request is split into stages by timing the functions doing the work,
+each stage counting its own time without the stages called from it:
+
+    xml parse          parse_authn_request_response without signature check and decryption
+    signature check    the crypto backend verifying a signature
+    decrypt            the crypto backend decrypting an assertion
+    user lookup        finding the user in the central user db, through the user cache
+    session persist    writing the session to Redis
+    redirect           the ACS action building the response
+    other              everything else, e.g. Flask and cookie handling
+
+Usage:
+
+    python -m eduid_webapp.authn.tests.bench_login --mongo-uri mongodb://localhost --redis-host localhost \\
+        [-n 500] [-c 4] [--encrypt]
+"""
+
+from __future__ import absolute_import, print_function
+
+import os
+import time
+import argparse
+import threading
+from copy import deepcopy
+from functools import wraps
+from collections import defaultdict
+
+from bson import ObjectId
+from flask import session
+from saml2.client import Saml2Client
+
+from eduid_userdb.data_samples import NEW_USER_EXAMPLE
+from eduid_userdb.user import User
+from eduid_common.authn.cache import OutstandingQueriesCache
+from eduid_webapp.authn import views
+from eduid_webapp.authn.app import authn_init_app
+from eduid_webapp.authn.saml2_client import Saml2ClientFactory
+from eduid_webapp.authn.tests.saml_responses import ResponseFactory, make_sp_config
+
+try:
+    import Queue as queue
+except ImportError:  # Python3
+    import queue
+
+__author__ = 'lundberg'
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+STAGES = ['xml parse', 'signature check', 'decrypt', 'user lookup', 'session persist', 'redirect', 'other']
+
+
+class StageTimer(object):
+    """
+    Collects the exclusive time spent in each stage of the requests made by the current thread.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.requests = []  # One {stage: seconds} per request
+
+    def timed(self, func, stage):
+        """
+        :return: func, counting the time spent in it, minus other timed functions it calls, under `stage`
+        """
+        local = self._local
+
+        @wraps(func)
+        def timed(*args, **kwargs):
+            stack = getattr(local, 'stack', None)
+            if stack is None:
+                return func(*args, **kwargs)
+            stack.append(0.0)
+            t0 = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.time() - t0
+                nested = stack.pop()
+                local.stages[stage] += elapsed - nested
+                stack[-1] += elapsed
+
+        return timed
+
+    def wrap(self, obj, attr, stage):
+        setattr(obj, attr, self.timed(getattr(obj, attr), stage))
+
+    def start(self):
+        self._local.stack = [0.0]
+        self._local.stages = defaultdict(float)
+        self._local.t0 = time.time()
+
+    def stop(self):
+        total = time.time() - self._local.t0
+        stages = self._local.stages
+        stages['other'] = total - self._local.stack[0]
+        stages['total'] = total
+        self._local.stack = None
+        with self._lock:
+            self.requests.append(dict(stages))
+
+    def report(self, wall_time, errors):
+        def percentile(values, p):
+            return values[min(len(values) - 1, int(len(values) * p))]
+
+        print('{:<16} {:>9} {:>9} {:>9} {:>9}'.format('stage (ms)', 'mean', 'p50', 'p90', 'p99'))
+        for stage in STAGES + ['total']:
+            values = sorted(timing.get(stage, 0.0) for timing in self.requests)
+            print('{:<16} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f}'.format(
+                stage, 1000 * sum(values) / len(values), 1000 * percentile(values, 0.5),
+                1000 * percentile(values, 0.9), 1000 * percentile(values, 0.99)))
+        print('\n{!s} logins in {:.2f} s, {:.1f} logins/s, {!s} errors'.format(
+            len(self.requests), wall_time, len(self.requests) / wall_time, errors))
+
+
+def create_user(app, eppn):
+    userdata = deepcopy(NEW_USER_EXAMPLE)
+    userdata['_id'] = ObjectId()
+    userdata['eduPersonPrincipalName'] = eppn
+    for mail in userdata['mailAliases']:
+        mail['email'] = '{!s}-{!s}'.format(eppn, mail['email'])
+    user = User(data=userdata)
+    user.modified_ts = True
+    app.central_userdb.save(user, check_sync=False)
+
+
+def start_login(app):
+    """
+    Start a login like the /login view does.
+
+    :return: Session cookie and the id of the outstanding authentication request
+    :rtype: (str, str)
+    """
+    with app.test_request_context('/login'):
+        app.dispatch_request()
+        OutstandingQueriesCache(session).set(session.token, '/')
+        session.persist()
+        return '{!s}={!s}'.format(app.config['SESSION_COOKIE_NAME'], session.token), session.token
+
+
+def instrument(app, timer):
+    crypto = app.saml2_client_factory.template.sec.crypto
+    timer.wrap(Saml2Client, 'parse_authn_request_response', 'xml parse')
+    timer.wrap(crypto, 'validate_signature', 'signature check')
+    timer.wrap(crypto, 'decrypt', 'decrypt')
+    for attr in ['get_user_by_eppn', 'get_user_by_attr']:
+        if hasattr(app.central_userdb, attr):
+            timer.wrap(app.central_userdb, attr, 'user lookup')
+
+    get_action = views.get_action
+    views.get_action = lambda: timer.timed(get_action(), 'redirect')
+
+    lock = threading.Lock()
+    timed_classes = set()
+
+    @app.before_request
+    def wrap_session_class():
+        # The session class is only known once a session has been opened, time the actual writes
+        session_class = type(session._get_current_object().base)
+        with lock:
+            if session_class not in timed_classes:
+                timer.wrap(session_class, 'persist', 'session persist')
+                timed_classes.add(session_class)
+
+
+def worker(app, timer, logins, errors):
+    client = app.test_client()
+    while True:
+        try:
+            cookie, saml_response = logins.get_nowait()
+        except queue.Empty:
+            return
+        timer.start()
+        response = client.post('/saml2-acs', data={'SAMLResponse': saml_response, 'RelayState': '/'},
+                               headers={'Cookie': cookie})
+        timer.stop()
+        if response.status_code != 302:
+            errors.append(response.status_code)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark logins per second through the ACS')
+    parser.add_argument('--mongo-uri', required=True, help='MongoDB URI, the user database will be dropped')
+    parser.add_argument('--redis-host', required=True, help='Redis host for sessions')
+    parser.add_argument('--redis-port', type=int, default=6379, help='Redis port')
+    parser.add_argument('-n', '--count', type=int, default=500, help='Number of logins')
+    parser.add_argument('-c', '--concurrency', type=int, default=4, help='Number of concurrent logins')
+    parser.add_argument('--encrypt', action='store_true', help='Encrypt the assertions')
+    args = parser.parse_args()
+
+    config = {
+        'MONGO_URI': args.mongo_uri,
+        'REDIS_HOST': args.redis_host,
+        'REDIS_PORT': args.redis_port,
+        'REDIS_DB': 0,
+        'SECRET_KEY': 'bench',
+        'SESSION_COOKIE_NAME': 'sessid',
+        'SERVER_NAME': 'test.localhost:6544',
+        'SAML2_LOGIN_REDIRECT_URL': '/',
+        'SAML2_LOGOUT_REDIRECT_URL': '/logged-out',
+        'SAML2_SETTINGS_MODULE': os.path.join(HERE, 'saml2_settings.py'),
+    }
+    app = authn_init_app('bench', config)
+    # Trust the test IdP signing with the test certificates
+    app.saml2_config = make_sp_config(want_assertions_signed=True)
+    app.config['SAML2_CONFIG'] = app.saml2_config
+    app.saml2_client_factory = Saml2ClientFactory(app.saml2_config,
+                                                  crypto_backend=app.config.get('SAML2_CRYPTO_BACKEND', 'xmlsec1'))
+
+    try:
+        response_factory = ResponseFactory(app.saml2_config)
+        print('Starting {!s} logins...'.format(args.count))
+        logins = queue.Queue()
+        for n in range(args.count):
+            # A user per login, a single user would be found in the user cache after the first login
+            eppn = 'bench-login-{!s}'.format(n)
+            create_user(app, eppn)
+            cookie, session_id = start_login(app)
+            logins.put((cookie, response_factory.saml_response(session_id, eppn, encrypt=args.encrypt)))
+
+        timer = StageTimer()
+        instrument(app, timer)
+        errors = []
+        threads = [threading.Thread(target=worker, args=(app, timer, logins, errors))
+                   for _ in range(args.concurrency)]
+        t0 = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall_time = time.time() - t0
+        print('{!s} concurrent, {!s} backend{!s}\n'.format(
+            args.concurrency, app.saml2_client_factory.crypto_backend, ', encrypted' if args.encrypt else ''))
+        timer.report(wall_time, len(errors))
+    finally:
+        with app.app_context():
+            app.central_userdb._drop_whole_collection()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+"""
+Microbenchmark of creating a SAML2 logout request.
+
+Compares building a new Saml2Client for every request, as the logout views
+used to do, with getting one from Saml2ClientFactory. Both create a logout
+request for a logged in subject with the test SP configuration.
+
+Usage:
+
+    python -m eduid_webapp.authn.tests.bench_logout [-n 1000] [--settings path/to/saml2_settings.py]
+"""
+
+from __future__ import absolute_import, print_function
+
+import os
+import time
+import argparse
+
+from saml2.cache import Cache
+from saml2.client import Saml2Client
+from saml2.population import Population
+from saml2.saml import NameID, NAMEID_FORMAT_TRANSIENT
+
+from eduid_common.authn.utils import get_saml2_config
+from eduid_webapp.authn.saml2_client import Saml2ClientFactory
+
+__author__ = 'lundberg'
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+IDP = 'https://idp.example.com/simplesaml/saml2/idp/metadata.php'
+
+
+def logged_in_identity(name_id):
+    """
+    :return: Identity cache for a subject logged in at the test IdP
+    :rtype: saml2.cache.Cache
+    """
+    identity = Cache()
+    Population(identity).add_information_about_person({
+        'name_id': name_id,
+        'issuer': IDP,
+        'not_on_or_after': int(time.time()) + 3600,
+        'ava': {'eduPersonPrincipalName': ['hubba-bubba']},
+    })
+    return identity
+
+
+def run(count, make_client, identity, name_id):
+    t0 = time.time()
+    for _ in range(count):
+        client = make_client(state_cache={}, identity_cache=identity)
+        client.global_logout(name_id)
+    return time.time() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare logout request cost with and without a client factory')
+    parser.add_argument('-n', '--count', type=int, default=1000, help='Number of logout requests')
+    parser.add_argument('--settings', default=os.path.join(HERE, 'saml2_settings.py'), help='SAML2 settings module')
+    args = parser.parse_args()
+
+    saml2_config = get_saml2_config(args.settings)
+    name_id = NameID(format=NAMEID_FORMAT_TRANSIENT, text='transient-id')
+    identity = logged_in_identity(name_id)
+    factory = Saml2ClientFactory(saml2_config)
+
+    def new_client(state_cache, identity_cache):
+        return Saml2Client(saml2_config, state_cache=state_cache, identity_cache=identity_cache)
+
+    print('{:<16} {:>10} {:>14}'.format('client', 'total (s)', 'per request (ms)'))
+    for name, make_client in [('new per request', new_client), ('factory', factory)]:
+        run(min(args.count, 10), make_client, identity, name_id)  # Warm up
+        total = run(args.count, make_client, identity, name_id)
+        print('{:<16} {:>10.3f} {:>14.3f}'.format(name, total, 1000 * total / args.count))
+
+
+if __name__ == '__main__':
+    main()
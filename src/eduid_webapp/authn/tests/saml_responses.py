@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+"""
+Signed and encrypted SAML2 authentication responses for benchmarks.
+
+The test IdP signs with the same key pair as the test SP (certs/server.key
+and certs/server.crt), and idp_metadata returns IdP metadata with that
+certificate, so that responses made here verify against an SP configured
+with make_sp_config. Encrypted assertions are encrypted for certs/server.crt,
+which the SP decrypts with certs/server.key.
+"""
+
+from __future__ import absolute_import
+
+import os
+import time
+import base64
+import tempfile
+from copy import deepcopy
+
+from saml2 import samlp
+from saml2.config import SPConfig
+from saml2.s_utils import sid
+from saml2.sigver import pre_signature_part, pre_encryption_part, security_context
+from saml2.time_util import instant, in_a_while
+
+from eduid_webapp.authn.tests.saml2_settings import SAML_CONFIG
+
+__author__ = 'lundberg'
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+IDP = 'https://idp.example.com/simplesaml/saml2/idp/metadata.php'
+CERT_FILE = os.path.join(HERE, 'certs', 'server.crt')
+
+IDP_METADATA = """<?xml version="1.0" encoding="UTF-8"?>
+<md:EntityDescriptor xmlns:md="urn:oasis:names:tc:SAML:2.0:metadata" xmlns:ds="http://www.w3.org/2000/09/xmldsig#"
+                     entityID="{idp}">
+  <md:IDPSSODescriptor protocolSupportEnumeration="urn:oasis:names:tc:SAML:2.0:protocol">
+    <md:KeyDescriptor use="signing">
+      <ds:KeyInfo><ds:X509Data><ds:X509Certificate>{cert}</ds:X509Certificate></ds:X509Data></ds:KeyInfo>
+    </md:KeyDescriptor>
+    <md:SingleLogoutService Binding="urn:oasis:names:tc:SAML:2.0:bindings:HTTP-Redirect"
+                            Location="https://idp.example.com/simplesaml/saml2/idp/SingleLogoutService.php"/>
+    <md:SingleSignOnService Binding="urn:oasis:names:tc:SAML:2.0:bindings:HTTP-Redirect"
+                            Location="https://idp.example.com/simplesaml/saml2/idp/SSOService.php"/>
+  </md:IDPSSODescriptor>
+</md:EntityDescriptor>
+"""
+
+RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<samlp:Response xmlns:samlp="urn:oasis:names:tc:SAML:2.0:protocol" xmlns:saml="urn:oasis:names:tc:SAML:2.0:assertion"
+                xmlns:xs="http://www.w3.org/2001/XMLSchema" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+                ID="{response_id}" Version="2.0" IssueInstant="{now}" Destination="{destination}"
+                InResponseTo="{session_id}">
+  <saml:Issuer>{idp}</saml:Issuer>
+  <samlp:Status><samlp:StatusCode Value="urn:oasis:names:tc:SAML:2.0:status:Success"/></samlp:Status>
+  <saml:Assertion ID="{assertion_id}" Version="2.0" IssueInstant="{now}">
+    <saml:Issuer>{idp}</saml:Issuer>
+    <saml:Subject>
+      <saml:NameID Format="urn:oasis:names:tc:SAML:2.0:nameid-format:transient"
+                   SPNameQualifier="{sp}">{name_id}</saml:NameID>
+      <saml:SubjectConfirmation Method="urn:oasis:names:tc:SAML:2.0:cm:bearer">
+        <saml:SubjectConfirmationData NotOnOrAfter="{not_on_or_after}" Recipient="{destination}"
+                                      InResponseTo="{session_id}"/>
+      </saml:SubjectConfirmation>
+    </saml:Subject>
+    <saml:Conditions NotBefore="{not_before}" NotOnOrAfter="{not_on_or_after}">
+      <saml:AudienceRestriction><saml:Audience>{sp}</saml:Audience></saml:AudienceRestriction>
+    </saml:Conditions>
+    <saml:AuthnStatement AuthnInstant="{now}" SessionNotOnOrAfter="{not_on_or_after}"
+                         SessionIndex="{session_index}">
+      <saml:AuthnContext>
+        <saml:AuthnContextClassRef>urn:oasis:names:tc:SAML:2.0:ac:classes:Password</saml:AuthnContextClassRef>
+      </saml:AuthnContext>
+    </saml:AuthnStatement>
+    <saml:AttributeStatement>
+      <saml:Attribute Name="urn:oid:1.3.6.1.4.1.5923.1.1.1.6"
+                      NameFormat="urn:oasis:names:tc:SAML:2.0:attrname-format:uri">
+        <saml:AttributeValue xsi:type="xs:string">{eppn}</saml:AttributeValue>
+      </saml:Attribute>
+    </saml:AttributeStatement>
+  </saml:Assertion>
+</samlp:Response>
+"""
+
+
+def idp_metadata(cert_file=CERT_FILE):
+    """
+    :return: Metadata for the test IdP, signing with the key for `cert_file`
+    :rtype: str
+    """
+    with open(cert_file) as fd:
+        cert = ''.join(line.strip() for line in fd if not line.startswith('-----'))
+    return IDP_METADATA.format(idp=IDP, cert=cert)
+
+
+def make_sp_config(metadata_dir=None, **sp_settings):
+    """
+    Test SP configuration trusting the test IdP in idp_metadata.
+
+    :param metadata_dir: Where to write the IdP metadata, a new temporary directory if None
+    :param sp_settings: Settings for the 'sp' service, e.g. want_assertions_signed=True
+
+    :rtype: saml2.config.SPConfig
+    """
+    if metadata_dir is None:
+        metadata_dir = tempfile.mkdtemp()
+    metadata_file = os.path.join(metadata_dir, 'idp_metadata.xml')
+    with open(metadata_file, 'w') as fd:
+        fd.write(idp_metadata())
+    config = deepcopy(SAML_CONFIG)
+    config['metadata'] = {'local': [metadata_file]}
+    config['service']['sp'].update(sp_settings)
+    sp_config = SPConfig()
+    sp_config.load(config)
+    return sp_config
+
+
+class ResponseFactory(object):
+
+    def __init__(self, sp_config):
+        """
+        :param sp_config: Configuration of the SP the responses are for, its key pair is used to sign
+        :type sp_config: saml2.config.SPConfig
+        """
+        self.sp = sp_config.entityid
+        self.destination = sp_config.getattr('endpoints', 'sp')['assertion_consumer_service'][0][0]
+        self.sec = security_context(sp_config)
+
+    def response_xml(self, session_id, eppn, lifetime=5):
+        """
+        :param session_id: The id of the authentication request
+        :param eppn: eduPersonPrincipalName of the user
+        :param lifetime: Minutes the assertion is valid
+
+        :return: Unsigned response
+        :rtype: str
+        """
+        return RESPONSE.format(
+            response_id=sid(), assertion_id=sid(), session_index=sid(), name_id=sid(),
+            session_id=session_id, idp=IDP, sp=self.sp, destination=self.destination, eppn=eppn,
+            now=instant(), not_before=instant(time_stamp=time.time() - 60),
+            not_on_or_after=in_a_while(minutes=lifetime),
+        )
+
+    def signed_response(self, session_id, eppn, lifetime=5):
+        """
+        :return: Response with a signed assertion
+        :rtype: str
+        """
+        response = samlp.response_from_string(self.response_xml(session_id, eppn, lifetime))
+        assertion = response.assertion[0]
+        assertion.signature = pre_signature_part(assertion.id, self.sec.my_cert, 1)
+        return self.sec.sign_statement('{!s}'.format(response), 'urn:oasis:names:tc:SAML:2.0:assertion:Assertion',
+                                       node_id=assertion.id)
+
+    def encrypted_response(self, session_id, eppn, lifetime=5):
+        """
+        :return: Response with a signed assertion, encrypted for the SP
+        :rtype: str
+        """
+        response = samlp.response_from_string(self.signed_response(session_id, eppn, lifetime))
+        return self.sec.crypto.encrypt_assertion(response, CERT_FILE, pre_encryption_part())
+
+    def saml_response(self, session_id, eppn, lifetime=5, encrypt=False):
+        """
+        :return: Signed, and optionally encrypted, response as posted to the ACS
+        :rtype: str
+        """
+        if encrypt:
+            data = self.encrypted_response(session_id, eppn, lifetime)
+        else:
+            data = self.signed_response(session_id, eppn, lifetime)
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        return base64.b64encode(data)
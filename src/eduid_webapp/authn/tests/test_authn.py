@@ -34,7 +34,9 @@ import os
 import time
 import json
 import base64
+from datetime import datetime
 
+from mock import patch
 from werkzeug.exceptions import NotFound
 from werkzeug.http import dump_cookie
 from flask import session
@@ -49,6 +51,8 @@ from eduid_common.authn.tests.responses import (auth_response,
                                                 logout_response,
                                                 logout_request)
 from eduid_webapp.authn.app import authn_init_app
+from eduid_webapp.authn.logout import LogoutResult
+from eduid_webapp.authn.sp_metadata import SPMetadata
 from eduid_common.api.app import eduid_init_app
 
 
@@ -80,6 +84,13 @@ class AuthnAPITestBase(EduidAPITestCase):
         """
         return authn_init_app('test.localhost', config)
 
+    def tearDown(self):
+        # The test responses all use the same assertion id
+        replay_cache = self.app.replay_cache
+        for key in replay_cache.redis.scan_iter('{!s}*'.format(replay_cache.prefix)):
+            replay_cache.redis.delete(key)
+        super(AuthnAPITestBase, self).tearDown()
+
     def add_outstanding_query(self, came_from):
         """
         Add a SAML2 authentication query to the queries cache.
@@ -213,6 +224,11 @@ class AuthnAPITestCase(AuthnAPITestBase):
     def test_terminate_authn(self):
         self.authn('/terminate', force_authn=True)
 
+    def test_login_unknown_idp(self):
+        with self.app.test_client() as c:
+            resp = c.get('/login?idp=https://unknown.example.com/idp')
+            self.assertEqual(resp.status_code, 400)
+
     def test_login_assertion_consumer_service(self):
         eppn = 'hubba-bubba'
 
@@ -222,6 +238,53 @@ class AuthnAPITestCase(AuthnAPITestBase):
 
         self.acs('/login', eppn, _check)
 
+    def test_assertion_consumer_service_single_session_write(self):
+        eppn = 'hubba-bubba'
+        came_from = '/camefrom/'
+        with self.app.test_client() as c:
+            c.get('/login')
+            token = session._session.token
+        cookie = self.dump_session_cookie(token)
+        with self.app.test_request_context('/saml2-acs', headers={'Cookie': cookie}):
+            OutstandingQueriesCache(session).set(token, came_from)
+            session.persist()
+
+        persist_calls = self.app.metrics.get('session.persist_calls')
+        writes = self.app.metrics.get('session.writes')
+        with self.app.test_client() as c:
+            resp = c.post('/saml2-acs', headers={'Cookie': cookie},
+                          data={'SAMLResponse': base64.b64encode(auth_response(token, eppn)),
+                                'RelayState': came_from})
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(session['eduPersonPrincipalName'], eppn)
+        self.assertEqual(self.app.metrics.get('session.writes') - writes, 1)
+        self.assertGreater(self.app.metrics.get('session.persist_calls') - persist_calls, 0)
+
+    def test_replayed_assertion(self):
+        eppn = 'hubba-bubba'
+        came_from = '/camefrom/'
+        session_id = self.add_outstanding_query(came_from)
+        cookie = self.dump_session_cookie(session_id)
+        data = {'SAMLResponse': base64.b64encode(auth_response(session_id, eppn)), 'RelayState': came_from}
+        with self.app.test_client() as c:
+            resp = c.post('/saml2-acs', headers={'Cookie': cookie}, data=data)
+            self.assertEqual(resp.status_code, 302)
+
+        # Make the session expect the response again, only the replay cache should stop it
+        with self.app.test_request_context('/saml2-acs', headers={'Cookie': cookie}):
+            OutstandingQueriesCache(session).set(session_id, came_from)
+            session.persist()
+        with self.app.test_client() as c:
+            resp = c.post('/saml2-acs', headers={'Cookie': cookie}, data=data)
+            self.assertEqual(resp.status_code, 400)
+
+    def test_outstanding_queries_pruned(self):
+        max_queries = self.app.config['SAML2_MAX_OUTSTANDING_QUERIES']
+        with self.app.test_client() as c:
+            for _ in range(max_queries + 3):
+                c.get('/login')
+            self.assertEqual(len(OutstandingQueriesCache(session).outstanding_queries()), max_queries)
+
     def test_chpass_assertion_consumer_service(self):
         eppn = 'hubba-bubba'
 
@@ -350,6 +413,43 @@ class LogoutRequestTests(AuthnAPITestBase):
             response = c.get('/saml2-metadata')
             self.assertEqual(response.status, '200 OK')
 
+    def test_metadataview_conditional(self):
+        with self.app.test_client() as c:
+            response = c.get('/saml2-metadata')
+            self.assertEqual(response.status, '200 OK')
+            self.assertIsNotNone(response.headers.get('ETag'))
+            self.assertIsNotNone(response.headers.get('Last-Modified'))
+            self.assertIn('max-age', response.headers.get('Cache-Control'))
+
+            response2 = c.get('/saml2-metadata', headers={'If-None-Match': response.headers['ETag']})
+            self.assertEqual(response2.status_code, 304)
+            self.assertEqual(response2.data, b'')
+
+    def test_metadata_regenerated_on_change(self):
+        sp_metadata = self.app.sp_metadata
+        document = sp_metadata.document
+        sp_metadata.check_interval = 0
+        self.assertIs(sp_metadata.document, document)
+        cert_file = self.app.saml2_config.cert_file
+        mtime = os.stat(cert_file).st_mtime
+        os.utime(cert_file, (mtime + 10, mtime + 10))
+        try:
+            self.assertIsNot(sp_metadata.document, document)
+        finally:
+            os.utime(cert_file, (mtime, mtime))
+
+    def test_metadata_last_modified(self):
+        document = self.app.sp_metadata.document
+        newest = max(mtime for mtime in document.mtimes.values() if mtime is not None)
+        self.assertEqual(document.last_modified, datetime.utcfromtimestamp(newest).replace(microsecond=0))
+
+    def test_signed_metadata_deterministic(self):
+        settings_module = self.app.config['SAML2_SETTINGS_MODULE']
+        first = SPMetadata(settings_module, sign=True, saml2_config=self.app.saml2_config)
+        second = SPMetadata(settings_module, sign=True, saml2_config=self.app.saml2_config)
+        self.assertEqual(first.document.etag, second.document.etag)
+        self.assertEqual(first.document.data, second.document.data)
+
     def test_logout_nologgedin(self):
         eppn = 'hubba-bubba'
         csrft = 'csrf token'
@@ -377,6 +477,46 @@ class LogoutRequestTests(AuthnAPITestBase):
             self.assertIn('https://idp.example.com/simplesaml/saml2/idp/'
                           'SingleLogoutService.php', response2.location)
 
+    def _concurrent_logout(self, statuses, http_info=None):
+        result = LogoutResult()
+        result.statuses = statuses
+        result.http_info = http_info
+        cookie = self.login('hubba-bubba', '/afterlogin/')
+        csrft = 'csrf token'
+        with patch('eduid_webapp.authn.views.concurrent_global_logout', return_value=result) as logout:
+            with self.app.test_request_context('/logout', method='POST',
+                                               headers={'Cookie': cookie},
+                                               data={'csrf': csrft}):
+                session['_csrft_'] = csrft
+                response = self.app.dispatch_request()
+                self.assertEqual(logout.call_count, 1)
+                return response, dict(session)
+
+    def test_logout_back_channel(self):
+        response, sess = self._concurrent_logout({'https://idp1.example.com': 'ok'})
+        self.assertEqual(response.status, '302 FOUND')
+        self.assertIn(self.app.config['SAML2_LOGOUT_REDIRECT_URL'], response.location)
+        self.assertNotIn('user_eppn', sess)
+        self.assertEqual(self.app.metrics.get('logout.back_channel.ok'), 1)
+
+    def test_logout_back_channel_timeout_and_error(self):
+        response, sess = self._concurrent_logout({'https://idp1.example.com': 'timeout',
+                                                  'https://idp2.example.com': 'failed'})
+        # The local logout is done anyway
+        self.assertEqual(response.status, '302 FOUND')
+        self.assertIn(self.app.config['SAML2_LOGOUT_REDIRECT_URL'], response.location)
+        self.assertNotIn('user_eppn', sess)
+        self.assertEqual(self.app.metrics.get('logout.back_channel.timeout'), 1)
+        self.assertEqual(self.app.metrics.get('logout.back_channel.failed'), 1)
+
+    def test_logout_back_channel_and_front_channel(self):
+        location = 'https://idp.example.com/simplesaml/saml2/idp/SingleLogoutService.php?SAMLRequest=x'
+        response, sess = self._concurrent_logout({'https://idp1.example.com': 'ok'},
+                                                 http_info={'headers': [('Location', location)]})
+        self.assertEqual(response.status, '302 FOUND')
+        self.assertEqual(response.location, location)
+        self.assertEqual(sess.get('user_eppn'), 'hubba-bubba')
+
     def test_logout_service_startingSP(self):
 
         came_from = '/afterlogin/'
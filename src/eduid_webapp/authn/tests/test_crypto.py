@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import xmlsec
+from lxml import etree
+from OpenSSL import crypto as ssl_crypto
+
+from eduid_webapp.authn.crypto import CachingCryptoBackendXMLSecurity
+
+__author__ = 'lundberg'
+
+ASSERTION_NODE = 'urn:oasis:names:tc:SAML:2.0:assertion:Assertion'
+
+ASSERTION = """<saml:Assertion xmlns:saml="urn:oasis:names:tc:SAML:2.0:assertion" ID="{id}" Version="2.0"
+ IssueInstant="2017-01-01T12:00:00Z"><saml:Issuer>https://idp.example.com</saml:Issuer><saml:Subject>
+<saml:NameID>{name_id}</saml:NameID></saml:Subject></saml:Assertion>"""
+
+RESPONSE = """<samlp:Response xmlns:samlp="urn:oasis:names:tc:SAML:2.0:protocol" ID="id-response" Version="2.0"
+ IssueInstant="2017-01-01T12:00:00Z"><samlp:Status><samlp:StatusCode
+ Value="urn:oasis:names:tc:SAML:2.0:status:Success"/></samlp:Status>{assertions}</samlp:Response>"""
+
+
+def _write_cert(directory, not_before, not_after):
+    """
+    :return: Paths to the key and certificate files
+    :rtype: (str, str)
+    """
+    key = ssl_crypto.PKey()
+    key.generate_key(ssl_crypto.TYPE_RSA, 2048)
+    cert = ssl_crypto.X509()
+    cert.get_subject().CN = 'idp.example.com'
+    cert.set_serial_number(1)
+    cert.gmtime_adj_notBefore(not_before)
+    cert.gmtime_adj_notAfter(not_after)
+    cert.set_issuer(cert.get_subject())
+    cert.set_pubkey(key)
+    cert.sign(key, 'sha256')
+    key_file = os.path.join(directory, 'idp{!s}.key'.format(not_after))
+    cert_file = os.path.join(directory, 'idp{!s}.crt'.format(not_after))
+    with open(key_file, 'wb') as fd:
+        fd.write(ssl_crypto.dump_privatekey(ssl_crypto.FILETYPE_PEM, key))
+    with open(cert_file, 'wb') as fd:
+        fd.write(ssl_crypto.dump_certificate(ssl_crypto.FILETYPE_PEM, cert))
+    return key_file, cert_file
+
+
+class CachingCryptoBackendXMLSecurityTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.key_file, self.cert_file = _write_cert(self.tmpdir, -3600, 3600)
+        self.backend = CachingCryptoBackendXMLSecurity(xmlsec1_backend=None)
+        self.signed_assertion = self._signed_assertion('id-signed', 'alice')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _signed_assertion(self, assertion_id, name_id):
+        xml = xmlsec.parse_xml(ASSERTION.format(id=assertion_id, name_id=name_id))
+        signed = xmlsec.sign(xml, self.key_file, self.cert_file, reference_uri='#' + assertion_id, insert_index=1)
+        return etree.tostring(signed).decode('utf-8')
+
+    def _validate(self, xml, node_id, cert_file=None):
+        return self.backend.validate_signature(xml, cert_file or self.cert_file, 'pem', ASSERTION_NODE, node_id, 'ID')
+
+    def test_signed_assertion(self):
+        response = RESPONSE.format(assertions=self.signed_assertion)
+        self.assertTrue(self._validate(response, 'id-signed'))
+
+    def test_tampered_assertion(self):
+        response = RESPONSE.format(assertions=self.signed_assertion.replace('alice', 'mallory'))
+        self.assertFalse(self._validate(response, 'id-signed'))
+
+    def test_wrapped_assertion(self):
+        # The signed assertion is still in the document, but pysaml2 would use the forged one
+        forged = ASSERTION.format(id='id-forged', name_id='mallory')
+        wrapped = '<samlp:Extensions>{!s}</samlp:Extensions>'.format(self.signed_assertion)
+        response = RESPONSE.format(assertions=wrapped + forged)
+        self.assertFalse(self._validate(response, 'id-forged'))
+
+    def test_forged_assertion_with_signed_id(self):
+        forged = ASSERTION.format(id='id-signed', name_id='mallory')
+        wrapped = '<samlp:Extensions>{!s}</samlp:Extensions>'.format(self.signed_assertion)
+        response = RESPONSE.format(assertions=forged + wrapped)
+        self.assertFalse(self._validate(response, 'id-signed'))
+
+    def test_signature_of_other_element(self):
+        # The forged assertion carries the signature of another assertion
+        other = self._signed_assertion('id-other', 'mallory')
+        forged = other.replace('ID="id-other"', 'ID="id-forged"')
+        response = RESPONSE.format(assertions=forged)
+        self.assertFalse(self._validate(response, 'id-forged'))
+
+    def test_expired_certificate(self):
+        key_file, cert_file = _write_cert(self.tmpdir, -7200, -3600)
+        self.key_file, self.cert_file = key_file, cert_file
+        response = RESPONSE.format(assertions=self._signed_assertion('id-expired', 'alice'))
+        self.assertFalse(self._validate(response, 'id-expired', cert_file=cert_file))
+
+    def test_certificate_expires_while_cached(self):
+        response = RESPONSE.format(assertions=self.signed_assertion)
+        self.assertTrue(self._validate(response, 'id-signed'))
+        self.assertEqual(len(self.backend._certs), 1)
+        for key, (pem, not_before, not_after) in list(self.backend._certs.items()):
+            self.backend._certs[key] = (pem, not_before, not_before)
+        self.assertFalse(self._validate(response, 'id-signed'))
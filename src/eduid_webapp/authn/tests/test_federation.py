@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from saml2.attribute_converter import ac_factory
+from saml2.mdstore import ToOld
+
+from eduid_webapp.authn.federation import FederationMetadata
+
+__author__ = 'lundberg'
+
+ENTITY_CATEGORY = 'http://macedir.org/entity-category'
+RESEARCH_AND_SCHOLARSHIP = 'http://refeds.org/category/research-and-scholarship'
+
+AGGREGATE = """<?xml version="1.0" encoding="UTF-8"?>
+<md:EntitiesDescriptor xmlns:md="urn:oasis:names:tc:SAML:2.0:metadata"
+                       xmlns:mdui="urn:oasis:names:tc:SAML:metadata:ui"
+                       xmlns:mdattr="urn:oasis:names:tc:SAML:metadata:attribute"
+                       xmlns:saml="urn:oasis:names:tc:SAML:2.0:assertion"
+                       {valid_until}Name="test-federation">
+{entities}
+</md:EntitiesDescriptor>
+"""
+
+IDP = """<md:EntityDescriptor entityID="https://idp{n}.example.com/idp">
+  <md:Extensions>
+    <mdattr:EntityAttributes>
+      <saml:Attribute Name="{category}" NameFormat="urn:oasis:names:tc:SAML:2.0:attrname-format:uri">
+        <saml:AttributeValue>{rands}</saml:AttributeValue>
+      </saml:Attribute>
+    </mdattr:EntityAttributes>
+  </md:Extensions>
+  <md:IDPSSODescriptor protocolSupportEnumeration="urn:oasis:names:tc:SAML:2.0:protocol">
+    <md:Extensions>
+      <mdui:UIInfo>
+        <mdui:DisplayName xml:lang="sv">IdP {n} sv</mdui:DisplayName>
+        <mdui:DisplayName xml:lang="en">IdP {n}</mdui:DisplayName>
+      </mdui:UIInfo>
+    </md:Extensions>
+    <md:SingleSignOnService Binding="urn:oasis:names:tc:SAML:2.0:bindings:HTTP-Redirect"
+                            Location="https://idp{n}.example.com/sso"/>
+  </md:IDPSSODescriptor>
+</md:EntityDescriptor>
+"""
+
+SP = """<md:EntityDescriptor entityID="https://sp.example.com/sp">
+  <md:SPSSODescriptor protocolSupportEnumeration="urn:oasis:names:tc:SAML:2.0:protocol">
+    <md:ArtifactResolutionService Binding="urn:oasis:names:tc:SAML:2.0:bindings:SOAP"
+                                  Location="https://sp.example.com/ars" index="0"/>
+    <md:AssertionConsumerService Binding="urn:oasis:names:tc:SAML:2.0:bindings:HTTP-POST"
+                                 Location="https://sp.example.com/acs" index="0"/>
+  </md:SPSSODescriptor>
+  <md:Organization>
+    <md:OrganizationName xml:lang="en">Example</md:OrganizationName>
+    <md:OrganizationDisplayName xml:lang="en">Example SP</md:OrganizationDisplayName>
+    <md:OrganizationURL xml:lang="en">https://sp.example.com/</md:OrganizationURL>
+  </md:Organization>
+</md:EntityDescriptor>
+"""
+
+SAML1_ONLY = """<md:EntityDescriptor entityID="https://saml1.example.com/idp">
+  <md:IDPSSODescriptor protocolSupportEnumeration="urn:oasis:names:tc:SAML:1.1:protocol">
+    <md:SingleSignOnService Binding="urn:mace:shibboleth:1.0:profiles:AuthnRequest"
+                            Location="https://saml1.example.com/sso"/>
+  </md:IDPSSODescriptor>
+</md:EntityDescriptor>
+"""
+
+
+class FederationMetadataTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'federation.xml')
+        self.write_aggregate(idps=3)
+        self.metadata = FederationMetadata(ac_factory(), self.filename)
+        self.metadata.load()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_aggregate(self, idps, valid_until=None):
+        entities = [IDP.format(n=n, category=ENTITY_CATEGORY, rands=RESEARCH_AND_SCHOLARSHIP if n % 2 else 'other')
+                    for n in range(idps)]
+        entities.extend([SP, SAML1_ONLY])
+        valid_until = 'validUntil="{!s}" '.format(valid_until) if valid_until else ''
+        with open(self.filename, 'w') as fd:
+            fd.write(AGGREGATE.format(entities='\n'.join(entities), valid_until=valid_until))
+        # Make sure a rewrite is seen as a change even within the mtime resolution
+        stat = os.stat(self.filename)
+        os.utime(self.filename, (stat.st_atime, stat.st_mtime + idps))
+
+    def refresh_threads(self):
+        name = 'refresh {!s}'.format(self.filename)
+        return len([thread for thread in threading.enumerate() if thread.name == name])
+
+    def test_index(self):
+        self.assertEqual(len(self.metadata), 4)
+        self.assertIn('https://sp.example.com/sp', self.metadata)
+        self.assertNotIn('https://saml1.example.com/idp', self.metadata)
+        self.assertEqual(self.metadata.identity_providers(),
+                         ['https://idp{!s}.example.com/idp'.format(n) for n in range(3)])
+        self.assertEqual(self.metadata.with_entity_attribute(ENTITY_CATEGORY, RESEARCH_AND_SCHOLARSHIP),
+                         ['https://idp1.example.com/idp'])
+        self.assertEqual(self.metadata.display_name('https://idp0.example.com/idp'), 'IdP 0')
+        self.assertEqual(self.metadata.display_name('https://idp0.example.com/idp', 'sv'), 'IdP 0 sv')
+        self.assertEqual(self.metadata.display_name('https://sp.example.com/sp', 'sv'), 'Example SP')
+        self.assertIsNone(self.metadata.display_name('https://unknown.example.com/'))
+        # Nothing is parsed just to build the index
+        self.assertEqual(self.metadata._snapshot.parsed, {})
+
+    def test_lazy_parse(self):
+        entity = self.metadata['https://idp2.example.com/idp']
+        self.assertIn('idpsso_descriptor', entity)
+        self.assertEqual(list(self.metadata._snapshot.parsed.keys()), ['https://idp2.example.com/idp'])
+        self.assertIs(self.metadata['https://idp2.example.com/idp'], entity)
+        srvs = self.metadata.service('https://idp2.example.com/idp', 'idpsso_descriptor', 'single_sign_on_service',
+                                     'urn:oasis:names:tc:SAML:2.0:bindings:HTTP-Redirect')
+        self.assertEqual(srvs[0]['location'], 'https://idp2.example.com/sso')
+        with self.assertRaises(KeyError):
+            self.metadata['https://unknown.example.com/']
+
+    def test_construct_source_id(self):
+        source_ids = self.metadata.construct_source_id()
+        self.assertEqual(len(source_ids), 1)
+        self.assertEqual(list(self.metadata._snapshot.parsed.keys()), ['https://sp.example.com/sp'])
+
+    def test_refresh(self):
+        self.metadata['https://idp0.example.com/idp']
+        self.assertFalse(self.metadata.refresh())
+        self.write_aggregate(idps=5)
+        self.assertTrue(self.metadata.refresh())
+        self.assertEqual(len(self.metadata.identity_providers()), 5)
+        self.assertEqual(self.metadata._snapshot.parsed, {})
+
+    def test_refresh_keeps_metadata_on_error(self):
+        with open(self.filename, 'w') as fd:
+            fd.write('<md:EntitiesDescriptor')
+        self.assertFalse(self.metadata.refresh())
+        self.assertEqual(len(self.metadata.identity_providers()), 3)
+
+    def test_refresh_thread_per_process(self):
+        self.metadata.start_refresh(60)
+        # Not started before the first lookup, e.g. in the process that forks the workers
+        self.assertIsNone(self.metadata._refresher_pid)
+        self.assertEqual(len(self.metadata.identity_providers()), 3)
+        self.assertEqual(self.metadata._refresher_pid, os.getpid())
+        self.assertEqual(self.refresh_threads(), 1)
+        self.metadata.keys()
+        self.assertEqual(self.refresh_threads(), 1)
+        # Like a forked worker, with the refresh lock held by the parent process
+        self.metadata._refresh_lock.acquire()
+        self.metadata._refresher_pid = -1
+        self.metadata.keys()
+        self.assertEqual(self.refresh_threads(), 2)
+        self.write_aggregate(idps=5)
+        self.assertTrue(self.metadata.refresh())
+
+    def test_too_old(self):
+        self.write_aggregate(idps=1, valid_until='2000-01-01T00:00:00Z')
+        with self.assertRaises(ToOld):
+            FederationMetadata(ac_factory(), self.filename).load()
+        self.assertFalse(self.metadata.refresh())
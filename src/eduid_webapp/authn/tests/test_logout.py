@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import time
+import threading
+import unittest
+
+from saml2 import BINDING_HTTP_REDIRECT, BINDING_SOAP
+
+from eduid_webapp.authn.logout import concurrent_global_logout
+
+__author__ = 'lundberg'
+
+SOAP_IDPS = ['https://idp1.example.com', 'https://idp2.example.com', 'https://idp3.example.com']
+REDIRECT_IDP = 'https://idp4.example.com'
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+
+class FakeLogoutResponse(object):
+
+    def __init__(self, ok):
+        self.ok = ok
+
+    def status_ok(self):
+        return self.ok
+
+
+class FakeMetadata(object):
+
+    def __init__(self, soap_idps):
+        self.soap_idps = soap_idps
+
+    def single_logout_service(self, entity_id, binding, typ):
+        if binding == BINDING_SOAP and entity_id not in self.soap_idps:
+            return []
+        return [{'location': '{!s}/slo'.format(entity_id), 'binding': binding}]
+
+
+class FakeIdentityCache(object):
+    """
+    Identity cache that must only be used on the thread that created it, like the session backed one.
+    """
+
+    def __init__(self, entity_ids):
+        self.entity_ids = entity_ids
+        self.thread = threading.current_thread()
+
+    def _check_thread(self):
+        assert threading.current_thread() is self.thread, 'identity cache used outside the request thread'
+
+    def issuers_of_info(self, name_id):
+        self._check_thread()
+        return list(self.entity_ids)
+
+    def get_info_from(self, name_id, entity_id, check_not_on_or_after=True):
+        self._check_thread()
+        return {'session_index': 'session-index-{!s}'.format(entity_id)}
+
+
+class FakeClient(object):
+    """
+    The parts of Saml2Client used by concurrent_global_logout, answering for the IdPs in `answers`
+    with 'ok', 'denied', 'error' (HTTP 500), 'raise' or 'slow'.
+    """
+
+    logout_requests_signed = False
+
+    def __init__(self, answers, soap_idps=SOAP_IDPS, delay=0.2):
+        self.answers = answers
+        self.delay = delay
+        self.metadata = FakeMetadata(soap_idps)
+        self.users = FakeIdentityCache(answers.keys())
+        self.sent = []
+        self.send_threads = set()
+        self.front_channel = None
+
+    def create_logout_request(self, destination, entity_id, name_id=None, reason=None, session_indexes=None):
+        return 'id-{!s}'.format(entity_id), entity_id
+
+    def sign(self, request):
+        return request
+
+    def apply_binding(self, binding, msg_str, destination):
+        return {'url': destination, 'method': 'POST', 'data': msg_str}
+
+    def send(self, url, method='GET', timeout=None, data=None):
+        self.sent.append((data, timeout))
+        self.send_threads.add(threading.current_thread())
+        answer = self.answers[data]
+        time.sleep(self.delay)
+        if answer == 'raise':
+            raise ValueError('connection refused')
+        if answer == 'error':
+            return FakeResponse(500, '')
+        if answer == 'slow':
+            time.sleep(self.delay * 5)
+        return FakeResponse(200, answer)
+
+    def parse_logout_request_response(self, text, binding):
+        return FakeLogoutResponse(text == 'ok')
+
+    def do_logout(self, name_id, entity_ids, reason, expire, expected_binding=None):
+        self.front_channel = (entity_ids, expected_binding)
+        return dict((entity_id, (expected_binding, {'headers': [('Location', '{!s}/slo'.format(entity_id))]}))
+                    for entity_id in entity_ids)
+
+
+class ConcurrentGlobalLogoutTests(unittest.TestCase):
+
+    def test_parallel_success(self):
+        client = FakeClient(dict((entity_id, 'ok') for entity_id in SOAP_IDPS))
+        started = time.time()
+        result = concurrent_global_logout(client, 'name-id', participant_timeout=5, timeout=5, threads=3)
+        # The three participants answer after 0.2 seconds each
+        self.assertLess(time.time() - started, 0.5)
+        self.assertEqual(result.statuses, dict((entity_id, 'ok') for entity_id in SOAP_IDPS))
+        self.assertTrue(result.done)
+        self.assertNotIn(threading.current_thread(), client.send_threads)
+        self.assertEqual(sorted(client.sent), sorted((entity_id, 5) for entity_id in SOAP_IDPS))
+
+    def test_participant_timeout(self):
+        client = FakeClient({SOAP_IDPS[0]: 'ok', SOAP_IDPS[1]: 'slow'})
+        result = concurrent_global_logout(client, 'name-id', participant_timeout=5, timeout=0.5, threads=3)
+        self.assertEqual(result.statuses, {SOAP_IDPS[0]: 'ok', SOAP_IDPS[1]: 'timeout'})
+        self.assertTrue(result.done)
+
+    def test_participant_error(self):
+        client = FakeClient({SOAP_IDPS[0]: 'ok', SOAP_IDPS[1]: 'raise', SOAP_IDPS[2]: 'error'})
+        result = concurrent_global_logout(client, 'name-id', participant_timeout=5, timeout=5, threads=3)
+        self.assertEqual(result.statuses, {SOAP_IDPS[0]: 'ok', SOAP_IDPS[1]: 'failed', SOAP_IDPS[2]: 'failed'})
+        self.assertTrue(result.done)
+
+    def test_participant_denied(self):
+        client = FakeClient({SOAP_IDPS[0]: 'denied'})
+        result = concurrent_global_logout(client, 'name-id', participant_timeout=5, timeout=5, threads=3)
+        self.assertEqual(result.statuses, {SOAP_IDPS[0]: 'failed'})
+
+    def test_front_channel(self):
+        client = FakeClient({SOAP_IDPS[0]: 'ok', REDIRECT_IDP: 'ok'})
+        result = concurrent_global_logout(client, 'name-id', participant_timeout=5, timeout=5, threads=3)
+        self.assertEqual(result.statuses, {SOAP_IDPS[0]: 'ok'})
+        self.assertFalse(result.done)
+        self.assertEqual(client.front_channel, ([REDIRECT_IDP], BINDING_HTTP_REDIRECT))
+        self.assertEqual(result.http_info['headers'], [('Location', '{!s}/slo'.format(REDIRECT_IDP))])
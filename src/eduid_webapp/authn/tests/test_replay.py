@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import base64
+import unittest
+
+from eduid_webapp.authn.replay import assertion_ids
+
+__author__ = 'lundberg'
+
+RESPONSE = b"""<?xml version="1.0"?>
+<samlp:Response xmlns:samlp="urn:oasis:names:tc:SAML:2.0:protocol"
+ xmlns:saml="urn:oasis:names:tc:SAML:2.0:assertion" ID="id-response" Version="2.0">
+<saml:Assertion ID="id-assertion" Version="2.0"/></samlp:Response>"""
+
+ENTITY_RESPONSE = b"""<?xml version="1.0"?>
+<!DOCTYPE lolz [<!ENTITY lol "lol"><!ENTITY lol2 "&lol;&lol;&lol;&lol;&lol;&lol;&lol;&lol;&lol;&lol;">]>
+<samlp:Response xmlns:samlp="urn:oasis:names:tc:SAML:2.0:protocol"
+ xmlns:saml="urn:oasis:names:tc:SAML:2.0:assertion" ID="id-response" Version="2.0">
+<saml:Assertion ID="id-assertion" Version="2.0">&lol2;</saml:Assertion></samlp:Response>"""
+
+
+class AssertionIdsTests(unittest.TestCase):
+
+    def test_assertion_ids(self):
+        self.assertEqual(assertion_ids(base64.b64encode(RESPONSE)), ['id-assertion'])
+
+    def test_entities_refused(self):
+        self.assertEqual(assertion_ids(base64.b64encode(ENTITY_RESPONSE)), [])
+
+    def test_not_xml(self):
+        self.assertEqual(assertion_ids(base64.b64encode(b'not xml')), [])
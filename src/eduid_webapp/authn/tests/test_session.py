@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import unittest
+
+from flask import Flask, session
+from flask.sessions import SessionInterface
+
+from eduid_webapp.authn.session import WriteBehindSession, init_write_behind_session
+
+__author__ = 'lundberg'
+
+
+class CountingSession(dict):
+    """
+    Session counting the writes, in place of a Redis backed session.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(CountingSession, self).__init__(*args, **kwargs)
+        self.persisted = []
+
+    def persist(self):
+        self.persisted.append(dict(self))
+
+
+class CountingSessionInterface(SessionInterface):
+
+    def __init__(self):
+        self.sessions = []
+
+    def open_session(self, app, request):
+        sess = CountingSession({'user_eppn': 'hubba-bubba'})
+        self.sessions.append(sess)
+        return sess
+
+    def save_session(self, app, sess, response):
+        pass
+
+
+class WriteBehindSessionTests(unittest.TestCase):
+
+    def setUp(self):
+        self.base = CountingSession({'user_eppn': 'hubba-bubba'})
+        self.session = WriteBehindSession(self.base)
+
+    def test_write_through(self):
+        self.session['a'] = 1
+        self.session.persist()
+        self.session['b'] = 2
+        self.session.persist()
+        self.assertEqual(len(self.base.persisted), 2)
+        self.assertEqual(self.session.writes, 2)
+
+    def test_deferred(self):
+        self.session.deferred = True
+        self.session['a'] = 1
+        self.session.persist()
+        self.session['b'] = 2
+        del self.session['user_eppn']
+        self.session.persist()
+        self.assertEqual(self.base.persisted, [])
+
+        self.session.flush()
+        self.assertEqual(self.base.persisted, [{'a': 1, 'b': 2}])
+        self.assertEqual(self.session.persist_calls, 2)
+        self.assertEqual(self.session.writes, 1)
+
+    def test_flush_unchanged(self):
+        self.session.deferred = True
+        self.assertEqual(self.session['user_eppn'], 'hubba-bubba')
+        self.session.flush()
+        self.assertEqual(self.base.persisted, [])
+
+    def test_persist_after_flush(self):
+        self.session.deferred = True
+        self.session['a'] = 1
+        self.session.flush()
+        # E.g. the session interface saving the session after the flush
+        self.session.persist()
+        self.assertEqual(len(self.base.persisted), 1)
+        self.session['b'] = 2
+        self.session.persist()
+        self.assertEqual(len(self.base.persisted), 2)
+
+    def test_attributes(self):
+        self.session.new = True
+        self.assertTrue(self.base.new)
+        self.assertIs(self.session.base, self.base)
+        self.assertNotIn('dirty', self.base.__dict__)
+
+
+class WriteBehindSessionAppTests(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.interface = CountingSessionInterface()
+        self.app.session_interface = self.interface
+        init_write_behind_session(self.app)
+
+        @self.app.route('/persist')
+        def persist():
+            session['a'] = 1
+            session.persist()
+            session['b'] = 2
+            session.persist()
+            return 'ok'
+
+        @self.app.route('/persist-and-fail')
+        def persist_and_fail():
+            session['a'] = 1
+            session.persist()
+            session['b'] = 2
+            raise RuntimeError('view failed')
+
+        @self.app.route('/change-and-fail')
+        def change_and_fail():
+            session['a'] = 1
+            raise RuntimeError('view failed')
+
+    def test_written_once(self):
+        response = self.app.test_client().get('/persist')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.interface.sessions[0].persisted, [{'user_eppn': 'hubba-bubba', 'a': 1, 'b': 2}])
+        self.assertEqual(self.app.metrics.get('session.persist_calls'), 2)
+        self.assertEqual(self.app.metrics.get('session.writes'), 1)
+
+    def test_written_when_view_fails(self):
+        response = self.app.test_client().get('/persist-and-fail')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self.interface.sessions[0].persisted, [{'user_eppn': 'hubba-bubba', 'a': 1, 'b': 2}])
+        self.assertEqual(self.app.metrics.get('session.writes'), 1)
+
+    def test_written_when_exception_propagates(self):
+        self.app.config['PROPAGATE_EXCEPTIONS'] = True
+        with self.assertRaises(RuntimeError):
+            self.app.test_client().get('/persist-and-fail')
+        self.assertEqual(len(self.interface.sessions[0].persisted), 1)
+
+    def test_not_written_without_persist(self):
+        response = self.app.test_client().get('/change-and-fail')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self.interface.sessions[0].persisted, [])
+        self.assertEqual(self.app.metrics.get('session.writes'), 0)
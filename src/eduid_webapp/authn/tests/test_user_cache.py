@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import unittest
+from datetime import datetime
+
+from flask import Flask
+
+from eduid_webapp.api.metrics import Metrics
+from eduid_webapp.authn.user_cache import CachingUserDB, bypass_user_cache, check_user_modified
+
+__author__ = 'lundberg'
+
+
+class DictUser(object):
+
+    def __init__(self, data):
+        self._data = data
+
+    @property
+    def eppn(self):
+        return self._data['eduPersonPrincipalName']
+
+    @property
+    def modified_ts(self):
+        return self._data.get('modified_ts')
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class DictUserDB(object):
+    """
+    User database counting the full user reads, in place of MongoDB.
+    """
+
+    UserClass = DictUser
+
+    def __init__(self):
+        self.docs = {}
+        self.reads = 0
+        self.modified_ts_reads = 0
+
+    def get_user_by_eppn(self, eppn, raise_on_missing=True):
+        self.reads += 1
+        doc = self.docs.get(eppn)
+        return DictUser(dict(doc)) if doc is not None else None
+
+    def get_modified_ts(self, eppn):
+        self.modified_ts_reads += 1
+        doc = self.docs.get(eppn)
+        return doc.get('modified_ts') if doc is not None else None
+
+    def save(self, user):
+        self.docs[user.eppn] = user.to_dict()
+
+
+class CachingUserDBTests(unittest.TestCase):
+
+    def setUp(self):
+        self.userdb = DictUserDB()
+        self.userdb.docs['hubba-bubba'] = {'eduPersonPrincipalName': 'hubba-bubba',
+                                           'modified_ts': datetime(2017, 1, 1)}
+        self.metrics = Metrics()
+        self.cache = CachingUserDB(self.userdb, self.metrics, size=2, ttl=60)
+
+    def test_hit(self):
+        user1 = self.cache.get_user_by_eppn('hubba-bubba')
+        user2 = self.cache.get_user_by_eppn('hubba-bubba', raise_on_missing=False)
+        self.assertEqual(user2.eppn, 'hubba-bubba')
+        self.assertIsNot(user1, user2)
+        self.assertEqual(self.userdb.reads, 1)
+        self.assertEqual(self.metrics.get('user_cache.misses'), 1)
+        self.assertEqual(self.metrics.get('user_cache.hits'), 1)
+        self.assertEqual(self.userdb.modified_ts_reads, 0)
+
+    def test_modified(self):
+        self.cache.check_modified = True
+        self.cache.get_user_by_eppn('hubba-bubba')
+        self.userdb.docs['hubba-bubba']['modified_ts'] = datetime(2017, 1, 2)
+        user = self.cache.get_user_by_eppn('hubba-bubba')
+        self.assertEqual(user.modified_ts, datetime(2017, 1, 2))
+        self.assertEqual(self.userdb.reads, 2)
+        self.assertEqual(self.metrics.get('user_cache.stale'), 1)
+
+    def test_modified_not_checked(self):
+        self.cache.get_user_by_eppn('hubba-bubba')
+        self.userdb.docs['hubba-bubba']['modified_ts'] = datetime(2017, 1, 2)
+        user = self.cache.get_user_by_eppn('hubba-bubba')
+        self.assertEqual(user.modified_ts, datetime(2017, 1, 1))
+        self.assertEqual(self.userdb.reads, 1)
+
+    def test_modified_checked_in_request(self):
+        self.cache.get_user_by_eppn('hubba-bubba')
+        self.userdb.docs['hubba-bubba']['modified_ts'] = datetime(2017, 1, 2)
+        app = Flask('testing')
+        with app.test_request_context('/'):
+            check_user_modified()
+            user = self.cache.get_user_by_eppn('hubba-bubba')
+        self.assertEqual(user.modified_ts, datetime(2017, 1, 2))
+        self.assertEqual(self.metrics.get('user_cache.stale'), 1)
+
+    def test_expired(self):
+        self.cache.ttl = -1
+        self.cache.get_user_by_eppn('hubba-bubba')
+        self.cache.get_user_by_eppn('hubba-bubba')
+        self.assertEqual(self.userdb.reads, 2)
+
+    def test_bounded(self):
+        for eppn in ['a', 'b', 'c']:
+            self.userdb.docs[eppn] = {'eduPersonPrincipalName': eppn}
+            self.cache.get_user_by_eppn(eppn)
+        self.assertEqual(list(self.cache._users.keys()), ['b', 'c'])
+
+    def test_save_invalidates(self):
+        user = self.cache.get_user_by_eppn('hubba-bubba')
+        self.cache.save(user)
+        self.assertNotIn('hubba-bubba', self.cache._users)
+
+    def test_missing_user(self):
+        self.assertIsNone(self.cache.get_user_by_eppn('missing'))
+        self.assertIsNone(self.cache.get_user_by_eppn('missing'))
+        self.assertEqual(self.userdb.reads, 2)
+
+    def test_bypass(self):
+        self.cache.get_user_by_eppn('hubba-bubba')
+        app = Flask('testing')
+        with app.test_request_context('/'):
+            bypass_user_cache()
+            self.cache.get_user_by_eppn('hubba-bubba')
+        self.assertEqual(self.userdb.reads, 2)
+        self.assertEqual(self.metrics.get('user_cache.bypassed'), 1)
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+"""
+Short lived cache of users for the authn app.
+
+The ACS and the logout view look up the user by eppn in the central user
+database, and a user doing a login followed by a chpass or terminate
+reauthn is looked up several times within minutes. CachingUserDB wraps the
+central user database and keeps the data of the last USER_CACHE_SIZE users
+looked up by eppn for at most USER_CACHE_TTL seconds.
+
+Users saved through the cache are dropped from it, changes made by other
+apps are seen when the cached user expires. Every lookup gets its own User
+instance, built from the cached data.
+
+A request can call check_user_modified to only use a cached user if its
+modified_ts in the database is unchanged, checked with a query returning
+only that field. The ACS does that with SAML2_ACS_CHECK_USER_MODIFIED, and
+USER_CACHE_CHECK_MODIFIED does it for every lookup. A request can also
+call bypass_user_cache to always read the users it needs from the
+database, the ACS does that with SAML2_ACS_BYPASS_USER_CACHE.
+Lookups are counted in the app metrics as 'user_cache.hits', '.misses',
+'.stale' and '.bypassed'.
+"""
+
+from __future__ import absolute_import
+
+import time
+import threading
+from copy import deepcopy
+from collections import OrderedDict
+
+from flask import g, has_request_context
+
+from eduid_webapp.api.metrics import init_metrics
+
+__author__ = 'lundberg'
+
+
+def bypass_user_cache():
+    """
+    Read users from the database for the rest of the current request.
+    """
+    g.bypass_user_cache = True
+
+
+def check_user_modified():
+    """
+    Only use cached users that are unchanged in the database for the rest of the current request.
+    """
+    g.check_user_modified = True
+
+
+def _bypassed():
+    return has_request_context() and getattr(g, 'bypass_user_cache', False)
+
+
+def _check_requested():
+    return has_request_context() and getattr(g, 'check_user_modified', False)
+
+
+class CachingUserDB(object):
+
+    def __init__(self, userdb, metrics, size=1000, ttl=60, check_modified=False):
+        """
+        :param userdb: The central user database
+        :param metrics: Where to count lookups
+        :param size: Maximum number of cached users
+        :param ttl: Seconds a user is cached
+        :param check_modified: Check modified_ts in the database before using a cached user
+
+        :type userdb: eduid_webapp.api.userdb.CentralUserDB
+        :type metrics: eduid_webapp.api.metrics.Metrics
+        :type size: int
+        :type ttl: int
+        :type check_modified: bool
+        """
+        self.userdb = userdb
+        self.metrics = metrics
+        self.size = size
+        self.ttl = ttl
+        self.check_modified = check_modified
+        self._users = OrderedDict()  # eppn -> (expires, user data), least recently used first
+        self._lock = threading.Lock()
+
+    def __getattr__(self, item):
+        if item == 'userdb':
+            raise AttributeError(item)
+        return getattr(self.userdb, item)
+
+    def _get(self, eppn):
+        with self._lock:
+            try:
+                expires, data = self._users.pop(eppn)
+            except KeyError:
+                return None
+            if expires < time.time():
+                return None
+            self._users[eppn] = (expires, data)
+            return data
+
+    def _put(self, eppn, user):
+        with self._lock:
+            self._users.pop(eppn, None)
+            self._users[eppn] = (time.time() + self.ttl, user.to_dict())
+            while len(self._users) > self.size:
+                self._users.popitem(last=False)
+
+    def invalidate(self, eppn):
+        with self._lock:
+            self._users.pop(eppn, None)
+
+    def get_user_by_eppn(self, eppn, *args, **kwargs):
+        """
+        Same as UserDB.get_user_by_eppn, from the cache if possible.
+        """
+        if _bypassed():
+            self.metrics.incr('user_cache.bypassed')
+        else:
+            data = self._get(eppn)
+            if data is not None:
+                check = self.check_modified or _check_requested()
+                if not check or self.userdb.get_modified_ts(eppn) == data.get('modified_ts'):
+                    self.metrics.incr('user_cache.hits')
+                    return self.userdb.UserClass(data=deepcopy(data))
+                self.metrics.incr('user_cache.stale')
+            else:
+                self.metrics.incr('user_cache.misses')
+        user = self.userdb.get_user_by_eppn(eppn, *args, **kwargs)
+        if user is None:
+            self.invalidate(eppn)
+        else:
+            self._put(eppn, user)
+        return user
+
+    def save(self, user, *args, **kwargs):
+        self.invalidate(user.eppn)
+        return self.userdb.save(user, *args, **kwargs)
+
+
+def init_user_cache(app):
+    """
+    Replace app.central_userdb with a CachingUserDB for it, app.central_userdb must be a CentralUserDB.
+
+    :param app: Flask app
+    :type app: flask.Flask
+
+    :return: Flask app
+    :rtype: flask.Flask
+    """
+    init_metrics(app)
+    if app.config.get('USER_CACHE_SIZE', 1000) and not isinstance(app.central_userdb, CachingUserDB):
+        app.central_userdb = CachingUserDB(app.central_userdb, app.metrics,
+                                           size=app.config.get('USER_CACHE_SIZE', 1000),
+                                           ttl=app.config.get('USER_CACHE_TTL', 60),
+                                           check_modified=app.config.get('USER_CACHE_CHECK_MODIFIED', False))
+    return app
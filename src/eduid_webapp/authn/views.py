@@ -32,17 +32,19 @@
 
 from saml2 import BINDING_HTTP_REDIRECT
 from saml2.ident import decode
-from saml2.client import Saml2Client
 from saml2.response import LogoutResponse
-from saml2.metadata import entity_descriptor
 from werkzeug.exceptions import Forbidden
-from flask import request, session, redirect, abort, make_response
+from flask import request, session, redirect, abort
 from flask import current_app, Blueprint
 
 from eduid_common.authn.utils import get_location
-from eduid_common.authn.eduid_saml2 import get_authn_request, get_authn_response
+from eduid_common.authn.eduid_saml2 import get_authn_request
 from eduid_common.authn.eduid_saml2 import authenticate
 from eduid_webapp.authn.acs_registry import get_action, schedule_action
+from eduid_webapp.api.deadline import get_timeout
+from eduid_webapp.authn.logout import concurrent_global_logout
+from eduid_webapp.authn.helpers import get_authn_response, prune_outstanding_queries
+from eduid_webapp.authn.user_cache import bypass_user_cache, check_user_modified
 from eduid_common.authn.cache import IdentityCache, StateCache
 
 import logging
@@ -79,14 +81,26 @@ def terminate():
 def _authn(action, force_authn=False):
     redirect_url = current_app.config.get('SAML2_LOGIN_REDIRECT_URL', '/')
     relay_state = request.args.get('next', redirect_url)
-    idps = current_app.saml2_config.getattr('idp')
-    assert len(idps) == 1
-    idp = idps.keys()[0]
-    idp = request.args.get('idp', idp)
+    idp = request.args.get('idp', current_app.config.get('SAML2_DEFAULT_IDP'))
+    if idp is None:
+        current_app.logger.error('No IdP requested and no default IdP configured')
+        abort(400)
+    # Only the requested entity is parsed, see eduid_webapp.authn.federation
+    try:
+        entity = current_app.saml2_config.metadata[idp]
+    except KeyError:
+        entity = {}
+    if 'idpsso_descriptor' not in entity:
+        current_app.logger.error('Unknown IdP requested: {!r}'.format(idp))
+        abort(400)
     loa = request.args.get('required_loa', None)
+    max_queries = current_app.config.get('SAML2_MAX_OUTSTANDING_QUERIES', 10)
+    # Make room for the new query, keeping the session size bounded
+    prune_outstanding_queries(session, max_queries - 1, current_app.config.get('SAML2_MAX_SESSION_SIZE'))
     authn_request = get_authn_request(current_app.config, session,
                                       relay_state, idp, required_loa=loa,
                                       force_authn=force_authn)
+    prune_outstanding_queries(session, max_queries)
     schedule_action(action)
     current_app.logger.info('Redirecting the user to the IdP for ' + action)
     return redirect(get_location(authn_request))
@@ -100,9 +114,13 @@ def assertion_consumer_service():
     if 'SAMLResponse' not in request.form:
         abort(400)
     xmlstr = request.form['SAMLResponse']
-    session_info = get_authn_response(current_app.config, session, xmlstr)
+    session_info = get_authn_response(session, xmlstr)
     current_app.logger.debug('Trying to locate the user authenticated by the IdP')
 
+    if current_app.config.get('SAML2_ACS_BYPASS_USER_CACHE', False):
+        bypass_user_cache()
+    elif current_app.config.get('SAML2_ACS_CHECK_USER_MODIFIED', False):
+        check_user_modified()
     user = authenticate(current_app, session_info)
     if user is None:
         current_app.logger.error('Could not find the user identified by the IdP')
@@ -144,9 +162,7 @@ def logout():
     state = StateCache(session)
     identity = IdentityCache(session)
 
-    client = Saml2Client(current_app.saml2_config,
-                         state_cache=state,
-                         identity_cache=identity)
+    client = current_app.saml2_client_factory(state_cache=state, identity_cache=identity)
 
     subject_id = _get_name_id(session)
     if subject_id is None:
@@ -155,6 +171,23 @@ def logout():
             'the subject id for user {!r}'.format(user))
         location = current_app.config.get('SAML2_LOGOUT_REDIRECT_URL')
 
+    elif current_app.config.get('SAML2_CONCURRENT_LOGOUT', True):
+        result = concurrent_global_logout(client, subject_id,
+                                          current_app.config.get('SAML2_LOGOUT_PARTICIPANT_TIMEOUT', 5),
+                                          timeout=get_timeout('saml2 back-channel logout'),
+                                          threads=current_app.config.get('SAML2_LOGOUT_THREADS', 10))
+        for outcome in result.statuses.values():
+            current_app.metrics.incr('logout.back_channel.{!s}'.format(outcome))
+        if result.done:
+            logger.debug('Performing local logout for {!r}'.format(user))
+            session.clear()
+            location = current_app.config.get('SAML2_LOGOUT_REDIRECT_URL')
+            location = request.form.get('RelayState', location)
+            return redirect(location)
+        location = get_location(result.http_info)
+        logger.info('Redirecting to {!r} to continue the logout process '
+                    'for user {!r}'.format(location, user))
+
     else:
         logouts = client.global_logout(subject_id)
         loresponse = logouts.values()[0]
@@ -191,9 +224,7 @@ def logout_service():
 
     state = StateCache(session)
     identity = IdentityCache(session)
-    client = Saml2Client(current_app.saml2_config,
-                         state_cache=state,
-                         identity_cache=identity)
+    client = current_app.saml2_client_factory(state_cache=state, identity_cache=identity)
 
     logout_redirect_url = current_app.config.get('SAML2_LOGOUT_REDIRECT_URL')
     next_page = session.get('next', logout_redirect_url)
@@ -247,8 +278,7 @@ def metadata():
     """
     Returns an XML with the SAML 2.0 metadata for this
     SP as configured in the saml2_settings.py file.
+    The document is generated at startup and when the settings or
+    certificates change, see eduid_webapp.authn.sp_metadata.
     """
-    metadata = entity_descriptor(current_app.saml2_config)
-    response = make_response(metadata.to_string(), 200)
-    response.headers['Content-Type'] = "text/xml; charset=utf8"
-    return response
+    return current_app.sp_metadata.response(request)
@@ -35,6 +35,9 @@ from __future__ import absolute_import
 
 from eduid_common.api.app import eduid_init_app_no_db
 
+from eduid_webapp.jsconfig.cache import init_jsconfig_cache
+from eduid_webapp.jsconfig.settings.front import jsconfig
+
 
 def jsconfig_init_app(name, config):
     """
@@ -58,6 +61,7 @@ def jsconfig_init_app(name, config):
 
     app = eduid_init_app_no_db(name, config)
     app.config.update(config)
+    init_jsconfig_cache(app, jsconfig)
 
     from eduid_webapp.jsconfig.views import jsconfig_views
     app.register_blueprint(jsconfig_views, url_prefix=app.config.get('APPLICATION_ROOT', None))
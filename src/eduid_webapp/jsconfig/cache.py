@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+
+"""
+In memory copy of the front end configuration.
+
+The configuration served by GET /config is the defaults in
+jsconfig.settings.front updated with the keys under the etcd namespace
+JSCONFIG_ETCD_NAMESPACE. Instead of reading etcd on every request, each
+process keeps the merged configuration in memory and a background thread
+watches the namespace, reading and swapping in the whole configuration when
+something under it changes. If the watch does not report a change within
+JSCONFIG_POLL_INTERVAL seconds the configuration is read anyway, so a
+broken watch delays changes by at most that long. If etcd can not be read,
+the last configuration is kept.
+
+Each snapshot of the configuration also keeps the serialised responses made
+from it, so that they are only serialised once per configuration version.
+
+The cache can be created before the server forks its workers, each worker
+starts its own watcher on first use.
+
+The version of the configuration, increased every time it changes, and the
+seconds since it was last read from etcd are kept in the app metrics as
+'jsconfig.version' and 'jsconfig.refresh_lag'.
+"""
+
+from __future__ import absolute_import
+
+import os
+import hashlib
+import time
+import logging
+import threading
+from copy import deepcopy
+
+import etcd
+from eduid_common.config.parsers.etcd import EtcdConfigParser
+
+from eduid_webapp.api.metrics import init_metrics
+
+__author__ = 'lundberg'
+
+logger = logging.getLogger(__name__)
+
+# Only held to check the process id, see JSConfigCache._ensure_watching
+_fork_lock = threading.Lock()
+
+
+class SerialisedPayload(object):
+
+    def __init__(self, data, mimetype):
+        """
+        :param data: Response body
+        :param mimetype: Response mimetype
+
+        :type data: bytes
+        :type mimetype: str
+        """
+        self.data = data
+        self.mimetype = mimetype
+        self.etag = hashlib.sha1(data).hexdigest()
+
+
+class ConfigSnapshot(object):
+
+    def __init__(self, config, version, etcd_index=None, payloads=None):
+        """
+        :param config: The merged configuration
+        :param version: Increased every time the configuration changes
+        :param etcd_index: etcd index the configuration was read at
+        :param payloads: Serialised responses of this configuration version
+
+        :type config: dict
+        :type version: int
+        :type etcd_index: int | None
+        :type payloads: dict | None
+        """
+        self.config = config
+        self.version = version
+        self.etcd_index = etcd_index
+        self.read_ts = time.time()
+        self.payloads = payloads if payloads is not None else {}
+
+    def get_payload(self, key, serialise):
+        """
+        :param key: What else than the configuration the payload depends on, e.g. the request path
+        :param serialise: Makes the payload from the configuration
+
+        :type key: str | tuple
+        :type serialise: callable
+
+        :rtype: SerialisedPayload
+        """
+        payload = self.payloads.get(key)
+        if payload is None:
+            payload = serialise(self.config)
+            self.payloads[key] = payload
+        return payload
+
+
+class JSConfigCache(object):
+
+    def __init__(self, defaults, parser, metrics, poll_interval=60):
+        """
+        :param defaults: Configuration used for the keys not in etcd
+        :param parser: Parser for the etcd namespace
+        :param metrics: Where to keep the version and refresh lag
+        :param poll_interval: Seconds to wait for a change before reading the configuration anyway
+
+        :type defaults: dict
+        :type parser: eduid_common.config.parsers.etcd.EtcdConfigParser
+        :type metrics: eduid_webapp.api.metrics.Metrics
+        :type poll_interval: int
+        """
+        self.defaults = deepcopy(defaults)
+        self.parser = parser
+        self.metrics = metrics
+        self.poll_interval = poll_interval
+        self._snapshot = None
+        self._refresh_lock = threading.Lock()
+        self._watcher_pid = None
+
+    def _etcd_index(self):
+        """
+        :return: Current etcd index, None if the namespace does not exist
+        :rtype: int | None
+        """
+        try:
+            return self.parser.client.read(self.parser.ns).etcd_index
+        except etcd.EtcdKeyNotFound:
+            return None
+
+    def _read(self):
+        """
+        :return: The merged configuration and the etcd index it is at least as new as
+        :rtype: (dict, int | None)
+        """
+        # Get the index first, a change made while the configuration is read is then picked up by the watch
+        etcd_index = self._etcd_index()
+        config = deepcopy(self.defaults)
+        config.update(self.parser.read_configuration(silent=True))
+        return config, etcd_index
+
+    def refresh(self):
+        """
+        Read the configuration from etcd, keeping the current configuration on errors.
+
+        :return: True if the configuration changed
+        :rtype: bool
+        """
+        with self._refresh_lock:
+            current = self._snapshot
+            try:
+                config, etcd_index = self._read()
+            except Exception as e:
+                logger.error('Could not read the configuration from {!s}: {!r}'.format(self.parser.ns, e))
+                if current is None:
+                    self._snapshot = ConfigSnapshot(deepcopy(self.defaults), 1)
+                    self.metrics.set('jsconfig.version', 1)
+                return False
+            if current is not None and config == current.config:
+                self._snapshot = ConfigSnapshot(current.config, current.version, etcd_index, current.payloads)
+                return False
+            version = current.version + 1 if current is not None else 1
+            self._snapshot = ConfigSnapshot(config, version, etcd_index)
+            self.metrics.set('jsconfig.version', version)
+        logger.info('Loaded version {!s} of the configuration from {!s}'.format(version, self.parser.ns))
+        return True
+
+    def _wait_for_change(self):
+        snapshot = self._snapshot
+        index = snapshot.etcd_index + 1 if snapshot.etcd_index is not None else None
+        try:
+            self.parser.client.watch(self.parser.ns, index=index, recursive=True, timeout=self.poll_interval)
+        except etcd.EtcdWatchTimedOut:
+            pass
+
+    def _watch_loop(self):
+        while True:
+            try:
+                self._wait_for_change()
+            except Exception as e:
+                logger.error('Could not watch {!s}: {!r}'.format(self.parser.ns, e))
+                time.sleep(self.poll_interval)
+            self.refresh()
+
+    def _ensure_watching(self):
+        # Threads do not survive a fork, start one in every process serving requests
+        if self._watcher_pid == os.getpid():
+            return
+        with _fork_lock:
+            if self._watcher_pid == os.getpid():
+                return
+            # The watcher of the parent process can have held the lock when the process forked
+            self._refresh_lock = threading.Lock()
+            self._watcher_pid = os.getpid()
+        if self._snapshot is None:
+            self.refresh()
+        watcher = threading.Thread(target=self._watch_loop, name='watch {!s}'.format(self.parser.ns))
+        watcher.daemon = True
+        watcher.start()
+
+    def get_snapshot(self):
+        """
+        :return: The current configuration, the configuration of a snapshot is never modified
+        :rtype: ConfigSnapshot
+        """
+        self._ensure_watching()
+        snapshot = self._snapshot
+        if snapshot is None:
+            # Another thread is doing the first read
+            self.refresh()
+            snapshot = self._snapshot
+        self.metrics.set('jsconfig.refresh_lag', time.time() - snapshot.read_ts)
+        return snapshot
+
+
+def init_jsconfig_cache(app, defaults):
+    """
+    :param app: Flask app
+    :param defaults: Configuration used for the keys not in etcd
+
+    :type app: flask.Flask
+    :type defaults: dict
+
+    :return: Flask app
+    :rtype: flask.Flask
+    """
+    init_metrics(app)
+    parser = EtcdConfigParser(app.config.get('JSCONFIG_ETCD_NAMESPACE', '/eduid/webapp/jsapps/'))
+    app.jsconfig_cache = JSConfigCache(defaults, parser, app.metrics,
+                                       poll_interval=app.config.get('JSCONFIG_POLL_INTERVAL', 60))
+    return app
@@ -52,3 +52,12 @@ SECRET_KEY = ''
 # Logging
 LOG_FILE = None
 LOG_LEVEL = 'INFO'
+
+# etcd namespace with the front end configuration
+JSCONFIG_ETCD_NAMESPACE = '/eduid/webapp/jsapps/'
+# Seconds to wait for a change in etcd before reading the configuration anyway
+JSCONFIG_POLL_INTERVAL = 60
+# Cache-Control header of the configuration responses, that also have an ETag
+JSCONFIG_CACHE_CONTROL = 'public, max-age=60'
+# Seconds between logging the process metrics (cache hits, session writes etc.), 0 to not log them
+METRICS_LOG_INTERVAL = 300
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import json
+
+from eduid_common.api.testing import EduidAPITestCase
+from eduid_webapp.jsconfig.app import jsconfig_init_app
+from eduid_webapp.jsconfig.cache import JSConfigCache
+from eduid_webapp.jsconfig.settings.front import jsconfig
+from eduid_webapp.jsconfig.tests.test_cache import FakeEtcdClient, FakeParser
+
+__author__ = 'lundberg'
+
+
+class JSConfigTests(EduidAPITestCase):
+
+    def setUp(self):
+        super(JSConfigTests, self).setUp()
+        self.etcd_client = FakeEtcdClient()
+        self.etcd_client.set('dashboard_url', 'https://dashboard.example.com/')
+        self.app.jsconfig_cache = JSConfigCache(jsconfig, FakeParser(self.etcd_client), self.app.metrics)
+        self.client = self.app.test_client()
+
+    def load_app(self, config):
+        """
+        Called from the parent class, so we can provide the appropriate flask
+        app for this test case.
+        """
+        return jsconfig_init_app('test', config)
+
+    def update_config(self, config):
+        config.update({
+            'JSCONFIG_CACHE_CONTROL': 'public, max-age=60',
+        })
+        return config
+
+    def test_get_config(self):
+        response = self.client.get('/config')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(response.headers.get('ETag'))
+        self.assertEqual(response.headers.get('Cache-Control'), 'public, max-age=60')
+        data = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(data['payload']['DASHBOARD_URL'], 'https://dashboard.example.com/')
+        self.assertEqual(data['payload']['PERSONAL_DATA_URL'], '/personal-data/user')
+
+    def test_get_config_not_modified(self):
+        response = self.client.get('/config')
+        etag = response.headers['ETag']
+        response = self.client.get('/config', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        self.assertEqual(response.headers.get('ETag'), etag)
+        self.assertEqual(response.headers.get('Cache-Control'), 'public, max-age=60')
+
+    def test_get_config_changed(self):
+        response = self.client.get('/config')
+        etag = response.headers['ETag']
+        self.etcd_client.set('dashboard_url', 'https://dashboard2.example.com/')
+        self.app.jsconfig_cache.refresh()
+        response = self.client.get('/config', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        data = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(data['payload']['DASHBOARD_URL'], 'https://dashboard2.example.com/')
+
+    def test_payload_per_request_kind(self):
+        response = self.client.get('/config')
+        xhr_response = self.client.get('/config', headers={'X-Requested-With': 'XMLHttpRequest'})
+        self.assertEqual(xhr_response.status_code, 200)
+        self.assertEqual(json.loads(response.data.decode('utf-8')), json.loads(xhr_response.data.decode('utf-8')))
+        # Marshalled separately, as jsonify formats the responses differently
+        self.assertEqual(len(self.app.jsconfig_cache.get_snapshot().payloads), 2)
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import json
+import time
+import threading
+import unittest
+
+import etcd
+
+from eduid_webapp.api.metrics import Metrics
+from eduid_webapp.jsconfig.cache import JSConfigCache, SerialisedPayload
+
+__author__ = 'lundberg'
+
+NAMESPACE = '/eduid/webapp/jsapps/'
+
+
+class FakeEtcdResult(object):
+
+    def __init__(self, etcd_index):
+        self.etcd_index = etcd_index
+
+
+class FakeEtcdClient(object):
+    """
+    The parts of etcd.Client used by the cache, with the keys in a dict.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.etcd_index = 1
+        self.error = None
+        self.watches = []
+        self.watch_timeout = 0.05
+        self.changed = threading.Event()
+
+    def set(self, key, value):
+        self.values[NAMESPACE + key] = json.dumps(value)
+        self.etcd_index += 1
+        self.changed.set()
+
+    def read(self, key, recursive=False):
+        if self.error is not None:
+            raise self.error
+        return FakeEtcdResult(self.etcd_index)
+
+    def watch(self, key, index=None, recursive=False, timeout=None):
+        self.watches.append((index, timeout))
+        # Like a watch that never sees the change
+        time.sleep(self.watch_timeout)
+        raise etcd.EtcdWatchTimedOut('Watch timed out', payload={})
+
+
+class FakeParser(object):
+    """
+    EtcdConfigParser reading from a FakeEtcdClient.
+    """
+
+    def __init__(self, client, ns=NAMESPACE):
+        self.client = client
+        self.ns = ns
+
+    def read_configuration(self, silent=False):
+        if self.client.error is not None:
+            raise self.client.error
+        return dict((key.split('/')[-1].upper(), json.loads(value)) for key, value in self.client.values.items())
+
+
+class JSConfigCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeEtcdClient()
+        self.client.set('dashboard_url', 'https://dashboard.example.com/')
+        self.metrics = Metrics()
+        self.cache = JSConfigCache({'DASHBOARD_URL': '/', 'DEBUG': False}, FakeParser(self.client), self.metrics)
+
+    def test_first_read(self):
+        self.assertTrue(self.cache.refresh())
+        snapshot = self.cache._snapshot
+        self.assertEqual(snapshot.config, {'DASHBOARD_URL': 'https://dashboard.example.com/', 'DEBUG': False})
+        self.assertEqual(snapshot.version, 1)
+        self.assertEqual(snapshot.etcd_index, self.client.etcd_index)
+        self.assertEqual(self.metrics.get('jsconfig.version'), 1)
+
+    def test_change(self):
+        self.cache.refresh()
+        self.client.set('debug', True)
+        self.assertTrue(self.cache.refresh())
+        snapshot = self.cache._snapshot
+        self.assertTrue(snapshot.config['DEBUG'])
+        self.assertEqual(snapshot.version, 2)
+        self.assertEqual(self.metrics.get('jsconfig.version'), 2)
+
+    def test_etcd_error(self):
+        self.cache.refresh()
+        snapshot = self.cache._snapshot
+        self.client.error = etcd.EtcdConnectionFailed('Connection to etcd failed')
+        self.assertFalse(self.cache.refresh())
+        self.assertIs(self.cache._snapshot, snapshot)
+        self.assertEqual(self.cache._snapshot.config['DASHBOARD_URL'], 'https://dashboard.example.com/')
+
+    def test_etcd_error_on_first_read(self):
+        self.client.error = etcd.EtcdConnectionFailed('Connection to etcd failed')
+        self.assertFalse(self.cache.refresh())
+        self.assertEqual(self.cache._snapshot.config, {'DASHBOARD_URL': '/', 'DEBUG': False})
+        self.assertEqual(self.cache._snapshot.version, 1)
+
+    def test_version_only_bumped_on_change(self):
+        self.cache.refresh()
+        payload = self.cache._snapshot.get_payload('GET /config', lambda config: SerialisedPayload(b'{}', 'json'))
+        # A change of some other key in etcd
+        self.client.etcd_index += 1
+        self.assertFalse(self.cache.refresh())
+        snapshot = self.cache._snapshot
+        self.assertEqual(snapshot.version, 1)
+        self.assertEqual(snapshot.etcd_index, self.client.etcd_index)
+        self.assertEqual(self.metrics.get('jsconfig.version'), 1)
+        # The serialised payloads are kept for the unchanged configuration
+        self.assertIs(snapshot.get_payload('GET /config', None), payload)
+
+    def test_watch_timeout_falls_back_to_poll(self):
+        self.cache.poll_interval = 0.05
+        snapshot = self.cache.get_snapshot()
+        self.assertEqual(snapshot.version, 1)
+        self.client.set('debug', True)
+        deadline = time.time() + 5
+        while self.cache._snapshot.version == 1 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.cache.get_snapshot().version, 2)
+        self.assertTrue(self.cache.get_snapshot().config['DEBUG'])
+        # The watch waits for the change after the index the configuration was read at
+        index, timeout = self.client.watches[0]
+        self.assertEqual(index, snapshot.etcd_index + 1)
+        self.assertEqual(timeout, 0.05)
+
+    def test_lock_reset_in_forked_process(self):
+        self.cache.refresh()
+        # Like a fork while the watcher of the parent process was refreshing
+        self.cache._refresh_lock.acquire()
+        self.cache._watcher_pid = -1
+        self.cache.poll_interval = 60
+        self.client.watch_timeout = 60
+        self.assertEqual(self.cache.get_snapshot().version, 1)
+        self.client.set('debug', True)
+        self.assertTrue(self.cache.refresh())
@@ -33,24 +33,42 @@
 
 from __future__ import absolute_import
 
-from flask import Blueprint
+from flask import Blueprint, current_app, request
 
-from eduid_common.config.parsers.etcd import EtcdConfigParser
 from eduid_common.api.decorators import MarshalWith
 from eduid_common.api.schemas.base import FluxStandardAction
-from eduid_webapp.jsconfig.settings.front import jsconfig
+from eduid_webapp.jsconfig.cache import SerialisedPayload
 
 
 jsconfig_views = Blueprint('jsconfig', __name__, url_prefix='')
 
 
-@jsconfig_views.route('/config', methods=['GET'])
 @MarshalWith(FluxStandardAction)
-def get_config():
+def _marshal_config(config):
+    return config
+
+
+def _serialise_config(config):
+    response = _marshal_config(config)
+    return SerialisedPayload(response.get_data(), response.mimetype)
 
-    parser = EtcdConfigParser('/eduid/webapp/jsapps/')
-    config = parser.read_configuration(silent=True)
 
-    jsconfig.update(config)
+def _payload_key():
+    """
+    What the marshalled config depends on besides the config: the response type is made from the
+    request method and path, and jsonify only pretty prints responses to non XHR requests.
 
-    return jsconfig
+    :rtype: tuple
+    """
+    return request.method, request.path, request.is_xhr
+
+
+@jsconfig_views.route('/config', methods=['GET'])
+def get_config():
+    # The config is only marshalled once per config version
+    payload = current_app.jsconfig_cache.get_snapshot().get_payload(_payload_key(), _serialise_config)
+    response = current_app.response_class(payload.data, mimetype=payload.mimetype)
+    response.set_etag(payload.etag)
+    if current_app.config.get('JSCONFIG_CACHE_CONTROL'):
+        response.headers['Cache-Control'] = current_app.config['JSCONFIG_CACHE_CONTROL']
+    return response.make_conditional(request)
@@ -5,6 +5,7 @@ from __future__ import absolute_import
 from eduid_common.api.app import eduid_init_app
 from eduid_common.api import am, msg
 from eduid_userdb.proofing import LetterProofingStateDB, LetterProofingUserDB
+from eduid_webapp.api.deadline import init_deadline
 from eduid_webapp.letter_proofing.ekopost import Ekopost
 
 __author__ = 'lundberg'
@@ -24,6 +25,7 @@ def init_letter_proofing_app(name, config=None):
     """
 
     app = eduid_init_app(name, config)
+    app = init_deadline(app)
 
     # Register views
     from eduid_webapp.letter_proofing.views import letter_proofing_views
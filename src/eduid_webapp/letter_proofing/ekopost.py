@@ -7,6 +7,8 @@ import base64
 from datetime import datetime
 from hammock import Hammock
 
+from eduid_webapp.api.deadline import get_timeout
+
 __author__ = 'john'
 
 
@@ -33,6 +35,9 @@ class Ekopost(object):
             self._ekopost_api = Hammock(self.app.config.get("EKOPOST_API_URI"), auth=auth, verify=verify_ssl)
         return self._ekopost_api
 
+    def _timeout(self, what):
+        return get_timeout('Ekopost {!s}'.format(what), self.app.config.get('EKOPOST_API_TIMEOUT'))
+
     def send(self, eppn, document):
         """
         Send a letter containing a PDF-document
@@ -83,7 +88,8 @@ class Ekopost(object):
             'cost_center': cost_center
         })
 
-        response = self.ekopost_api.campaigns.POST(data=campaign_data, headers={'Content-Type': 'application/json'})
+        response = self.ekopost_api.campaigns.POST(data=campaign_data, headers={'Content-Type': 'application/json'},
+                                                    timeout=self._timeout('create campaign'))
 
         if response.status_code == 200:
             return response.json()
@@ -114,7 +120,8 @@ class Ekopost(object):
             campaigns(campaign_id).\
             envelopes.POST(
             data=envelope_data,
-            headers={'Content-Type': 'application/json'})
+            headers={'Content-Type': 'application/json'},
+            timeout=self._timeout('create envelope'))
 
         if response.status_code == 200:
             return response.json()
@@ -147,7 +154,8 @@ class Ekopost(object):
             envelopes(envelope_id).\
             content.POST(
             data=content_data,
-            headers={'Content-Type': 'application/json'})
+            headers={'Content-Type': 'application/json'},
+            timeout=self._timeout('create content'))
 
         if response.status_code == 200:
             return response.json()
@@ -164,7 +172,7 @@ class Ekopost(object):
         response = self.ekopost_api.\
             campaigns(campaign_id).\
             envelopes(envelope_id).\
-            close.POST(headers={'Content-Type': 'application/json'})
+            close.POST(headers={'Content-Type': 'application/json'}, timeout=self._timeout('close envelope'))
 
         if response.status_code == 200:
             return response.json()
@@ -181,7 +189,7 @@ class Ekopost(object):
         """
         response = self.ekopost_api.\
             campaigns(campaign_id).\
-            close.POST(headers={'Content-Type': 'application/json'})
+            close.POST(headers={'Content-Type': 'application/json'}, timeout=self._timeout('close campaign'))
 
         if response.status_code == 200:
             return response.json()
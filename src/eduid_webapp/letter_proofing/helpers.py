@@ -7,6 +7,7 @@ from datetime import datetime, timedelta
 
 from eduid_userdb.proofing import LetterProofingState
 from eduid_common.api.utils import get_short_hash
+from eduid_webapp.api.deadline import check_deadline
 from eduid_webapp.letter_proofing import pdf
 
 __author__ = 'lundberg'
@@ -77,7 +78,8 @@ def get_address(user, proofing_state):
     """
     current_app.logger.info('Getting address for user {!r}'.format(user))
     current_app.logger.debug('NIN: {!s}'.format(proofing_state.nin.number))
-    # Lookup official address via Navet
+    # Lookup official address via Navet, the relay call can not be given a timeout
+    check_deadline('postal address lookup')
     address = current_app.msg_relay.get_postal_address(proofing_state.nin.number)
     current_app.logger.debug('Official address: {!r}'.format(address))
     return address
@@ -41,4 +41,11 @@ EKOPOST_API_VERIFY_SSL = 'true'
 EKOPOST_API_USER = ''
 EKOPOST_API_PW = ''
 EKOPOST_DEBUG_PDF = ''
+# Seconds to wait for every Ekopost API call, also limited by the request deadline
+EKOPOST_API_TIMEOUT = 10
+
+# Seconds a request may spend in outbound calls, keep it below the front-end proxy timeout.
+# REQUEST_DEADLINES overrides it per blueprint name.
+REQUEST_DEADLINE = 25
+REQUEST_DEADLINES = {}
 
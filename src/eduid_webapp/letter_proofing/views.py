@@ -12,6 +12,7 @@ from eduid_userdb.nin import Nin
 from eduid_webapp.letter_proofing import pdf
 from eduid_webapp.letter_proofing import schemas
 from eduid_webapp.letter_proofing.ekopost import EkopostException
+from eduid_webapp.api.deadline import check_deadline
 from eduid_webapp.letter_proofing.helpers import create_proofing_state, check_state, get_address, send_letter
 
 __author__ = 'lundberg'
@@ -117,6 +118,10 @@ def verify_code(user, verification_code):
     letter_proofing_data['transaction_id'] = proofing_state.proofing_letter.transaction_id
     user.add_letter_proofing_data(letter_proofing_data)
 
+    # The relay call can not be given a timeout, so the deadline is checked before the user is saved.
+    # Once saved, the sync is always requested.
+    check_deadline('attribute manager sync')
+
     # User from central db is as up to date as it can be no need to check for modified time
     user.modified_ts = True
     current_app.proofing_userdb.save(user, check_sync=False)
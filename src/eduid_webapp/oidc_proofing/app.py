@@ -3,7 +3,7 @@
 from __future__ import absolute_import
 
 from requests.exceptions import ConnectionError
-from oic.oic import Client
+from oic.oic import Client as OicClient
 from oic.oic.message import RegistrationRequest
 from oic.utils.authn.client import CLIENT_AUTHN_METHOD
 
@@ -12,13 +12,29 @@ from eduid_common.api import am
 from eduid_common.authn.utils import no_authn_views
 from eduid_userdb.proofing import OidcProofingStateDB, OidcProofingUserDB
 
+from eduid_webapp.api.deadline import init_deadline, get_timeout
 from eduid_webapp.oidc_proofing.mock_proof import ProofDB
+from eduid_webapp.oidc_proofing.maintenance import setup_state_indexes
 
 __author__ = 'lundberg'
 
 
+class Client(OicClient):
+    """
+    oic client that limits every request to the provider by the remaining request deadline.
+    """
+
+    def __init__(self, timeout=None, **kwargs):
+        super(Client, self).__init__(**kwargs)
+        self.timeout = timeout
+
+    def http_request(self, url, method='GET', **kwargs):
+        kwargs.setdefault('timeout', get_timeout('{!s} {!s}'.format(method, url), self.timeout))
+        return super(Client, self).http_request(url, method=method, **kwargs)
+
+
 def init_oidc_client(app):
-    oidc_client = Client(client_authn_method=CLIENT_AUTHN_METHOD)
+    oidc_client = Client(timeout=app.config['OIDC_HTTP_TIMEOUT'], client_authn_method=CLIENT_AUTHN_METHOD)
     oidc_client.store_registration_info(RegistrationRequest(**app.config['CLIENT_REGISTRATION_INFO']))
     provider = app.config['PROVIDER_CONFIGURATION_INFO']['issuer']
     try:
@@ -53,6 +69,7 @@ def init_oidc_proofing_app(name, config):
 
     app = eduid_init_app(name, config)
     app.config.update(config)
+    app = init_deadline(app)
 
     from eduid_webapp.oidc_proofing.views import oidc_proofing_views
     app.register_blueprint(oidc_proofing_views)
@@ -70,6 +87,7 @@ def init_oidc_proofing_app(name, config):
     app.proofing_statedb = OidcProofingStateDB(app.config['MONGO_URI'])
     app.proofing_userdb = OidcProofingUserDB(app.config['MONGO_URI'])
     app.proofdb = ProofDB(app.config['MONGO_URI'])  # Temporary demo db
+    setup_state_indexes(app.proofing_statedb, app.config['PROOFING_STATE_LIFETIME'])
 
     return app
 
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+"""
+Maintenance of the OIDC proofing state collection.
+
+A proofing state is saved when the OP accepts an authentication request and
+removed when the authorization response arrives. States for users that never
+complete the proofing are expired by a TTL index, and the states that were
+left behind before the index existed can be removed with this module:
+
+    python -m eduid_webapp.oidc_proofing.maintenance --mongo-uri mongodb://localhost --lifetime 86400
+
+Proofing states are only written once, when created, so modified_ts is used
+as their creation time.
+"""
+
+from __future__ import absolute_import, print_function
+
+import logging
+import argparse
+from datetime import datetime, timedelta
+
+from pymongo.errors import OperationFailure
+from eduid_userdb.proofing import OidcProofingStateDB
+
+__author__ = 'lundberg'
+
+logger = logging.getLogger(__name__)
+
+STATE_INDEX_NAME = 'state-unique-idx'
+TTL_INDEX_NAME = 'modified_ts-ttl-idx'
+
+
+def setup_state_indexes(state_db, lifetime):
+    """
+    Install a unique index on state, used to find the proofing state in the
+    authorization response, and a TTL index that removes proofing states
+    `lifetime` seconds after they were created.
+
+    :param state_db: Proofing state database
+    :param lifetime: Seconds to keep a proofing state
+
+    :type state_db: OidcProofingStateDB
+    :type lifetime: int
+
+    :return: True if both indexes are in place, failures are logged as this runs at app start
+    :rtype: bool
+    """
+    coll = state_db._coll
+    ok = True
+    try:
+        coll.ensure_index('state', name=STATE_INDEX_NAME, unique=True, background=True)
+    except OperationFailure as e:
+        # Most likely duplicate state values, lookups still work without the index
+        logger.error('Could not create unique index on state in {!r}: {!s}'.format(coll.full_name, e))
+        ok = False
+
+    try:
+        ttl_index = coll.index_information().get(TTL_INDEX_NAME)
+        if ttl_index is None:
+            coll.ensure_index('modified_ts', name=TTL_INDEX_NAME, expireAfterSeconds=lifetime, background=True)
+        elif ttl_index.get('expireAfterSeconds') != lifetime:
+            logger.info('Changing proofing state lifetime in {!r} from {!s} to {!s} seconds'.format(
+                coll.full_name, ttl_index.get('expireAfterSeconds'), lifetime))
+            coll.database.command('collMod', coll.name,
+                                  index={'keyPattern': {'modified_ts': 1}, 'expireAfterSeconds': lifetime})
+    except OperationFailure as e:
+        # Most likely another index on modified_ts, states are then only removed by remove_expired_states
+        logger.error('Could not set up TTL index on modified_ts in {!r}: {!s}'.format(coll.full_name, e))
+        ok = False
+    return ok
+
+
+def remove_expired_states(state_db, lifetime, batch_size=1000, dry_run=False):
+    """
+    Remove proofing states older than `lifetime` seconds, and states without a
+    creation time, in batches.
+
+    :param state_db: Proofing state database
+    :param lifetime: Seconds to keep a proofing state
+    :param batch_size: Number of states to remove per batch
+    :param dry_run: Only count the states that would be removed
+
+    :type state_db: OidcProofingStateDB
+    :type lifetime: int
+    :type batch_size: int
+    :type dry_run: bool
+
+    :return: Number of expired states
+    :rtype: int
+    """
+    coll = state_db._coll
+    expired = datetime.utcnow() - timedelta(seconds=lifetime)
+    spec = {'$or': [{'modified_ts': {'$lt': expired}}, {'modified_ts': {'$exists': False}}]}
+    if dry_run:
+        return coll.find(spec).count()
+
+    removed = 0
+    while True:
+        ids = [doc['_id'] for doc in coll.find(spec, {'_id': True}).limit(batch_size)]
+        if not ids:
+            break
+        result = coll.remove({'_id': {'$in': ids}})
+        removed += result['n']
+        logger.info('Removed {!s} expired proofing states'.format(removed))
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Expire abandoned OIDC proofing states')
+    parser.add_argument('--mongo-uri', required=True, help='MongoDB URI')
+    parser.add_argument('--lifetime', type=int, default=86400, help='Seconds to keep a proofing state')
+    parser.add_argument('--batch-size', type=int, default=1000, help='States to remove per batch')
+    parser.add_argument('--setup-indexes', action='store_true', help='Install the state and TTL indexes')
+    parser.add_argument('--dry-run', action='store_true', help='Only count the expired states')
+    args = parser.parse_args()
+    if args.setup_indexes and args.dry_run:
+        parser.error('--setup-indexes can not be used with --dry-run')
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    state_db = OidcProofingStateDB(args.mongo_uri)
+    count = remove_expired_states(state_db, args.lifetime, batch_size=args.batch_size, dry_run=args.dry_run)
+    if args.dry_run:
+        print('Found {!s} expired proofing states'.format(count))
+    else:
+        print('Removed {!s} expired proofing states'.format(count))
+        if args.setup_indexes:
+            # Remove the backlog first, the unique index can not be built on duplicate states
+            setup_state_indexes(state_db, args.lifetime)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+"""
+Rewrite stored OIDC proofs in the compressed archival format.
+
+Proofs are read and rewritten in batches, in _id order, so the tool can be
+stopped and restarted at any time. Documents that are modified while the tool
+is running are skipped and picked up by the next run.
+
+Usage:
+
+    python -m eduid_webapp.oidc_proofing.migrate_proofs --mongo-uri mongodb://localhost [--batch-size 500]
+"""
+
+from __future__ import absolute_import, print_function
+
+import time
+import logging
+import argparse
+
+from eduid_webapp.oidc_proofing.mock_proof import ProofDB
+
+__author__ = 'lundberg'
+
+logger = logging.getLogger(__name__)
+
+
+def migrate_proofs(proofdb, batch_size=500, dry_run=False, pause=0.0):
+    """
+    :param proofdb: Proof database
+    :param batch_size: Number of documents to rewrite per batch
+    :param dry_run: Only count the documents that would be rewritten
+    :param pause: Seconds to sleep between batches, to limit the load on the database
+
+    :type proofdb: ProofDB
+    :type batch_size: int
+    :type dry_run: bool
+    :type pause: float
+
+    :return: Number of documents read and number of documents rewritten
+    :rtype: (int, int)
+    """
+    read = rewritten = 0
+    last_id = None
+    while True:
+        docs = proofdb.get_legacy_documents(batch_size, after_id=last_id)
+        if not docs:
+            break
+        last_id = docs[-1]['_id']
+        read += len(docs)
+        if not dry_run:
+            rewritten += proofdb.archive_documents(docs)
+        logger.info('Processed {!s} proofs, rewrote {!s} (last _id {!s})'.format(read, rewritten, last_id))
+        if pause:
+            time.sleep(pause)
+    return read, rewritten
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rewrite OIDC proofs in the compressed archival format')
+    parser.add_argument('--mongo-uri', required=True, help='MongoDB URI')
+    parser.add_argument('--batch-size', type=int, default=500, help='Documents per batch')
+    parser.add_argument('--pause', type=float, default=0.0, help='Seconds to sleep between batches')
+    parser.add_argument('--dry-run', action='store_true', help='Only count the documents to rewrite')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    proofdb = ProofDB(args.mongo_uri)
+    read, rewritten = migrate_proofs(proofdb, batch_size=args.batch_size, dry_run=args.dry_run, pause=args.pause)
+    print('Found {!s} proofs in the old format, rewrote {!s}'.format(read, rewritten))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,60 +2,207 @@
 
 from __future__ import absolute_import
 
-import copy
 import bson
+import zlib
+import base64
+import calendar
 import datetime
 import logging
+from pymongo import ASCENDING, DESCENDING
 from eduid_userdb.db import BaseDB
 from eduid_userdb.exceptions import UserHasUnknownData, DocumentOutOfSync, DocumentDoesNotExist
 
+try:
+    from bson.codec_options import CodecOptions
+    from bson.raw_bson import RawBSONDocument
+except ImportError:  # pymongo < 3.2
+    CodecOptions = RawBSONDocument = None
+
 __author__ = 'lundberg'
 
 # Store all data received from the op
 
+# The responses from the OP are stored together as a zlib compressed BSON document
+RESPONSE_KEYS = ('authn_resp', 'token_resp', 'userinfo')
+ARCHIVE_KEYS = ('payload', 'payload_format', 'sub', 'identity')
+PAYLOAD_FORMAT = 'bson+zlib'
+
+
+def encode_payload(responses):
+    """
+    :param responses: authn_resp, token_resp and userinfo
+    :type responses: dict
+
+    :return: Compressed payload
+    :rtype: bson.Binary
+    """
+    return bson.Binary(zlib.compress(bson.BSON.encode(responses)))
+
+
+def decode_payload(payload):
+    """
+    :param payload: Compressed payload created by encode_payload
+    :type payload: bson.Binary | str | bytes
+
+    :return: authn_resp, token_resp and userinfo
+    :rtype: dict
+    """
+    return bson.BSON(zlib.decompress(bytes(payload))).decode()
+
+
+def expand_document(doc, fields=None):
+    """
+    Replace the compressed payload of a stored proof document with the responses it contains.
+
+    Documents that have not been migrated to the archival format are left as they are.
+
+    :param doc: Proof document as read from the database
+    :param fields: Names of the fields to keep, None to keep all
+
+    :type doc: dict
+    :type fields: list | None
+
+    :return: The same document
+    :rtype: dict
+    """
+    payload = doc.get('payload')
+    if payload is not None:
+        doc.update(decode_payload(payload))
+    for key in ARCHIVE_KEYS:
+        doc.pop(key, None)
+    if fields is not None:
+        for key in list(doc.keys()):
+            if key not in fields and key != '_id':
+                del doc[key]
+    return doc
+
+
+def _decode(value):
+    """
+    Turn a lazily decoded BSON document, and anything nested in it, into plain Python types.
+
+    :param value: Any value read from a proof document
+    :return: The value with all RawBSONDocuments replaced by dicts
+    """
+    if RawBSONDocument is not None and isinstance(value, RawBSONDocument):
+        return dict((key, _decode(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    return value
+
+
+def encode_cursor(doc):
+    """
+    Create an opaque pagination cursor pointing after a proof document.
+
+    :param doc: Proof document with at least _id and modified_ts
+    :type doc: dict
+
+    :return: Cursor
+    :rtype: str
+    """
+    modified_ts = doc['modified_ts']
+    if modified_ts.tzinfo is not None:
+        modified_ts = modified_ts.replace(tzinfo=None) - modified_ts.utcoffset()
+    millis = calendar.timegm(modified_ts.timetuple()) * 1000 + modified_ts.microsecond // 1000
+    value = '{!s}.{!s}'.format(millis, doc['_id'])
+    return base64.urlsafe_b64encode(value.encode('ascii')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    :param cursor: Cursor created by encode_cursor
+    :type cursor: str | unicode
+
+    :return: modified_ts and _id of the document the cursor points after
+    :rtype: (datetime.datetime, bson.ObjectId)
+
+    :raise ValueError: The cursor is not valid
+    """
+    try:
+        millis, _id = base64.urlsafe_b64decode(str(cursor)).decode('ascii').split('.')
+        modified_ts = datetime.datetime.utcfromtimestamp(int(millis) // 1000)
+        return modified_ts.replace(microsecond=int(millis) % 1000 * 1000), bson.ObjectId(_id)
+    except (TypeError, ValueError, UnicodeError, bson.errors.InvalidId):
+        raise ValueError('Invalid cursor: {!r}'.format(cursor))
+
 
 class Proof(object):
+    """
+    The data received from the OP for one proofing.
+
+    The document given to the constructor is referenced, not copied. A private
+    shallow copy is made the first time the proof is modified (copy-on-write),
+    and the large nested responses are only decoded when they are accessed.
+
+    Both the plain format, with the responses as nested documents, and the
+    archival format written by ProofDB, with the responses in a compressed
+    payload, are accepted.
+    """
+
+    __slots__ = ('_data', '_shared')
+
+    _known_keys = frozenset(RESPONSE_KEYS + ARCHIVE_KEYS + ('_id', 'eduPersonPrincipalName', 'modified_ts'))
+
     def __init__(self, data, raise_on_unknown=True):
-        self._data_in = copy.deepcopy(data)  # to not modify callers data
-        self._data = dict()
+        self._data = data
+        self._shared = True
+
+        if 'eduPersonPrincipalName' not in data:
+            raise KeyError('eduPersonPrincipalName')
+        if 'payload' not in data:
+            for key in RESPONSE_KEYS:
+                if key not in data:
+                    raise KeyError(key)
+        elif data.get('payload_format', PAYLOAD_FORMAT) != PAYLOAD_FORMAT:
+            raise ValueError('Unknown payload format {!r}'.format(data['payload_format']))
 
         # things without setters
         # _id
-        _id = self._data_in.pop('_id', None)
-        if _id is None:
-            _id = bson.ObjectId()
+        _id = data.get('_id')
         if not isinstance(_id, bson.ObjectId):
-            _id = bson.ObjectId(_id)
-        self._data['_id'] = _id
-        # eppn
-        eppn = self._data_in.pop('eduPersonPrincipalName')
-        self._data['eduPersonPrincipalName'] = eppn
-
-        # authn_resp
-        authn_resp = self._data_in.pop('authn_resp')
-        self._data['authn_resp'] = authn_resp
-
-        # token_resp
-        token_resp = self._data_in.pop('token_resp')
-        self._data['token_resp'] = token_resp
-
-        # userinfo
-        userinfo = self._data_in.pop('userinfo')
-        self._data['userinfo'] = userinfo
-
-        self.modified_ts = self._data_in.pop('modified_ts', None)
-
-        if len(self._data_in) > 0:
-            if raise_on_unknown:
-                raise UserHasUnknownData('User {!s} unknown data: {!r}'.format(
-                    self.eppn, self._data_in.keys()
-                ))
-            # Just keep everything that is left as-is
-            self._data.update(self._data_in)
+            if _id is None:
+                _id = bson.ObjectId()
+            self._writable()['_id'] = bson.ObjectId(_id)
+
+        if 'modified_ts' in data and data['modified_ts'] is None:
+            del self._writable()['modified_ts']
+
+        unknown_keys = set(data.keys()) - self._known_keys
+        if unknown_keys and raise_on_unknown:
+            raise UserHasUnknownData('User {!s} unknown data: {!r}'.format(self.eppn, list(unknown_keys)))
 
     def __repr__(self):
         return '<eduID {!s}: {!s}>'.format(self.__class__.__name__, self.eppn)
 
+    def _writable(self):
+        """
+        Get a private copy of the proof data that is safe to modify.
+
+        :rtype: dict
+        """
+        if self._shared:
+            self._data = dict(self._data.items())
+            self._shared = False
+        return self._data
+
+    def _get_decoded(self, key):
+        """
+        Get a (possibly nested) value, decoding it on first access.
+
+        :param key: Key in the proof data
+        :type key: str | unicode
+        """
+        if key not in self._data and key in RESPONSE_KEYS:
+            # Archived proof, decode all responses at once
+            data = self._writable()
+            data.update(decode_payload(data['payload']))
+        value = self._data[key]
+        if RawBSONDocument is not None and isinstance(value, (RawBSONDocument, list)):
+            value = _decode(value)
+            self._writable()[key] = value
+        return value
+
     @property
     def _id(self):
         """
@@ -75,13 +222,16 @@ class Proof(object):
         return self._data['eduPersonPrincipalName']
 
     @property
-    def auth_resp(self):
+    def authn_resp(self):
         """
-        Get the user's auth_resp
+        Get the user's authn_resp
 
         :rtype: dict
         """
-        return self._data['auth_resp']
+        return self._get_decoded('authn_resp')
+
+    # Kept for backwards compatibility
+    auth_resp = authn_resp
 
     @property
     def token_resp(self):
@@ -90,7 +240,7 @@ class Proof(object):
 
         :rtype: dict
         """
-        return self._data['token_resp']
+        return self._get_decoded('token_resp')
 
     @property
     def userinfo(self):
@@ -99,7 +249,7 @@ class Proof(object):
 
         :rtype: dict
         """
-        return self._data['userinfo']
+        return self._get_decoded('userinfo')
 
     @property
     def modified_ts(self):
@@ -121,10 +271,33 @@ class Proof(object):
             return
         if value is True:
             value = datetime.datetime.utcnow()
-        self._data['modified_ts'] = value
+        self._writable()['modified_ts'] = value
 
     def to_dict(self):
-        res = copy.copy(self._data)  # avoid caller messing with our _data
+        """
+        :return: A shallow copy of the proof data with all responses decoded
+        :rtype: dict
+        """
+        res = dict((key, self._get_decoded(key)) for key in RESPONSE_KEYS)
+        for key, value in self._data.items():
+            if key not in res and key not in ARCHIVE_KEYS:
+                res[key] = _decode(value)
+        return res
+
+    def to_storage_dict(self):
+        """
+        The proof in archival format. The fields used for lookups are kept as
+        top level fields and the responses are put in a compressed payload.
+
+        :rtype: dict
+        """
+        res = dict((key, value) for key, value in self._data.items() if key not in RESPONSE_KEYS)
+        if 'payload' not in res:
+            responses = dict((key, self._get_decoded(key)) for key in RESPONSE_KEYS)
+            res['payload'] = encode_payload(responses)
+            res['sub'] = responses['userinfo'].get('sub')
+            res['identity'] = responses['userinfo'].get('identity')
+        res['payload_format'] = PAYLOAD_FORMAT
         return res
 
 
@@ -134,6 +307,16 @@ class ProofDB(BaseDB):
 
     def __init__(self, db_uri, db_name='eduid_oidc_proofing', collection='proofs'):
         BaseDB.__init__(self, db_uri, db_name, collection)
+        # Read proofs as raw BSON so that the nested responses are only decoded when used
+        self._raw_coll = None
+        if RawBSONDocument is not None:
+            self._raw_coll = self._coll.with_options(codec_options=CodecOptions(document_class=RawBSONDocument))
+        # Serves both lookups by eppn and the sorted, paginated listing of a users proofs, _id is the
+        # tiebreak of the listing sort order
+        self._coll.ensure_index([('eduPersonPrincipalName', ASCENDING), ('modified_ts', DESCENDING),
+                                 ('_id', DESCENDING)], name='eppn-modified_ts-_id-idx', background=True)
+        self._coll.ensure_index('sub', name='sub-idx', sparse=True, background=True)
+        self._coll.ensure_index('identity', name='identity-idx', sparse=True, background=True)
 
     def get_proofs_by_eppn(self, eppn, raise_on_missing=True):
         """
@@ -151,9 +334,110 @@ class ProofDB(BaseDB):
         :raise self.DocumentDoesNotExist: No user match the search criteria
         """
 
-        data = self._get_documents_by_attr('eduPersonPrincipalName', eppn, raise_on_missing)
+        if self._raw_coll is None:
+            data = self._get_documents_by_attr('eduPersonPrincipalName', eppn, raise_on_missing)
+        else:
+            data = list(self._raw_coll.find({'eduPersonPrincipalName': eppn}))
+            if not data and raise_on_missing:
+                raise DocumentDoesNotExist('No document matching eduPersonPrincipalName={!r}'.format(eppn))
         return [self.ProofDataClass(item) for item in data]
 
+    def get_proofs_page(self, eppn, limit, after=None, fields=None):
+        """
+        Get one page of a user's proofs, newest first.
+
+        Sorting, paging and projection is done by the database using the
+        (eduPersonPrincipalName, modified_ts, _id) index.
+
+        :param eppn: eppn
+        :param limit: Maximum number of proofs to return
+        :param after: Cursor returned with the previous page, None for the first page
+        :param fields: Names of the fields to return, None for all fields except _id
+
+        :type eppn: str | unicode
+        :type limit: int
+        :type after: str | unicode | None
+        :type fields: list | None
+
+        :return: The proofs as dicts and the cursor for the next page (None if there are no more proofs)
+        :rtype: (list, str | None)
+
+        :raise ValueError: after is not a valid cursor
+        """
+        spec = {'eduPersonPrincipalName': eppn}
+        if after is not None:
+            modified_ts, _id = decode_cursor(after)
+            spec['$or'] = [
+                {'modified_ts': {'$lt': modified_ts}},
+                {'modified_ts': modified_ts, '_id': {'$lt': _id}},
+            ]
+        projection = None
+        if fields is not None:
+            projection = dict((field, True) for field in fields)
+            projection['modified_ts'] = True  # Needed for the cursor, _id is always returned
+            if any(field in RESPONSE_KEYS for field in fields):
+                projection['payload'] = True
+
+        cursor = self._coll.find(spec, projection)
+        cursor = cursor.sort([('modified_ts', DESCENDING), ('_id', DESCENDING)]).limit(limit + 1)
+        docs = list(cursor)
+
+        next_cursor = None
+        if len(docs) > limit:
+            docs = docs[:limit]
+            next_cursor = encode_cursor(docs[-1])
+        for doc in docs:
+            expand_document(doc, fields)
+            del doc['_id']
+        return docs, next_cursor
+
+    def get_legacy_documents(self, batch_size, after_id=None):
+        """
+        Get a batch of proof documents that are not yet in archival format, in _id order.
+
+        :param batch_size: Maximum number of documents to return
+        :param after_id: Only return documents with a larger _id
+
+        :type batch_size: int
+        :type after_id: bson.ObjectId | None
+
+        :rtype: list
+        """
+        spec = {'payload': {'$exists': False}}
+        if after_id is not None:
+            spec['_id'] = {'$gt': after_id}
+        return list(self._coll.find(spec).sort('_id', ASCENDING).limit(batch_size))
+
+    def archive_documents(self, docs):
+        """
+        Rewrite proof documents in archival format.
+
+        The documents are replaced as they are, modified_ts is not updated. A
+        document that has been changed since it was read is left for a later run.
+
+        :param docs: Proof documents as read from the database
+        :type docs: list
+
+        :return: Number of rewritten documents
+        :rtype: int
+        """
+        if not docs:
+            return 0
+        bulk = self._coll.initialize_unordered_bulk_op()
+        queued = 0
+        for doc in docs:
+            try:
+                storage_doc = self.ProofDataClass(doc, raise_on_unknown=False).to_storage_dict()
+            except (KeyError, ValueError) as e:
+                logging.error('{!s} Can not archive proof {!s}: {!r}'.format(self, doc.get('_id'), e))
+                continue
+            bulk.find({'_id': doc['_id'], 'modified_ts': doc.get('modified_ts')}).replace_one(storage_doc)
+            queued += 1
+        if not queued:
+            return 0
+        result = bulk.execute()
+        return result['nModified']
+
     def save(self, proof, check_sync=True):
         """
 
@@ -170,14 +454,14 @@ class ProofDB(BaseDB):
         proof.modified_ts = True  # update to current time
         if modified is None:
             # document has never been modified
-            result = self._coll.insert(proof.to_dict())
+            result = self._coll.insert(proof.to_storage_dict())
             logging.debug("{!s} Inserted new state {!r} into {!r}): {!r})".format(
                 self, proof, self._coll_name, result))
         else:
             test_doc = {'_id': proof._id}
             if check_sync:
                 test_doc['modified_ts'] = modified
-            result = self._coll.update(test_doc, proof.to_dict(), upsert=(not check_sync))
+            result = self._coll.update(test_doc, proof.to_storage_dict(), upsert=(not check_sync))
             if check_sync and result['n'] == 0:
                 db_ts = None
                 db_state = self._coll.find_one({'_id': proof._id})
@@ -25,3 +25,4 @@ class NonceResponseSchema(FluxStandardAction):
 class ProofResponseSchema(EduidSchema):
 
     proofs = fields.List(fields.Dict)
+    next = fields.String(allow_none=True)
@@ -48,3 +48,17 @@ PROVIDER_CONFIGURATION_INFO = {
 
 }
 USERINFO_ENDPOINT_METHOD = 'POST'
+# Seconds to wait for the provider, also limited by the request deadline
+OIDC_HTTP_TIMEOUT = 10
+
+# Seconds a request may spend in outbound calls, keep it below the front-end proxy timeout.
+# REQUEST_DEADLINES overrides it per blueprint name.
+REQUEST_DEADLINE = 25
+REQUEST_DEADLINES = {}
+
+# Seconds until an unfinished proofing state is removed
+PROOFING_STATE_LIFETIME = 86400
+
+# Proofs listing
+PROOFS_PAGE_SIZE = 20
+PROOFS_MAX_PAGE_SIZE = 100
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+"""
+Memory and time benchmark for loading OIDC proofs.
+
+Loads N proof documents the way ProofDB.get_proofs_by_eppn does and compares
+the previous Proof implementation (deep copy of every document) with the
+current one, both for documents decoded by pymongo as dicts and for lazily
+decoded RawBSONDocuments, and for documents in the compressed archival
+format. Every scenario runs in a fresh process.
+
+Usage:
+
+    python -m eduid_webapp.oidc_proofing.tests.bench_proof [-n 100000]
+"""
+
+from __future__ import absolute_import, print_function
+
+import os
+import copy
+import time
+import argparse
+import resource
+import datetime
+import multiprocessing
+
+import bson
+
+from eduid_webapp.oidc_proofing.mock_proof import Proof, RawBSONDocument
+
+__author__ = 'lundberg'
+
+
+class LegacyProof(object):
+    """
+    The Proof implementation as it looked before it was slimmed down, kept here for comparison.
+    """
+
+    def __init__(self, data):
+        self._data_in = copy.deepcopy(data)
+        self._data = dict()
+        _id = self._data_in.pop('_id', None)
+        if _id is None:
+            _id = bson.ObjectId()
+        self._data['_id'] = _id
+        self._data['eduPersonPrincipalName'] = self._data_in.pop('eduPersonPrincipalName')
+        self._data['authn_resp'] = self._data_in.pop('authn_resp')
+        self._data['token_resp'] = self._data_in.pop('token_resp')
+        self._data['userinfo'] = self._data_in.pop('userinfo')
+        modified_ts = self._data_in.pop('modified_ts', None)
+        if modified_ts is not None:
+            self._data['modified_ts'] = modified_ts
+
+    @property
+    def eppn(self):
+        return self._data['eduPersonPrincipalName']
+
+    @property
+    def modified_ts(self):
+        return self._data.get('modified_ts')
+
+    def to_dict(self):
+        return copy.copy(self._data)
+
+
+def make_document(i):
+    """
+    :return: A proof document shaped like the ones saved by the authorization response view
+    :rtype: dict
+    """
+    now = datetime.datetime.utcnow().replace(microsecond=0)
+    sub = str(bson.ObjectId())
+    id_token = {
+        'iss': 'https://op.example.com/',
+        'sub': sub,
+        'aud': ['eduid-oidc-proofing'],
+        'exp': 1480000000 + i,
+        'iat': 1479996400 + i,
+        'auth_time': 1479996400 + i,
+        'nonce': 'n' * 32,
+        'acr': 'http://id.elegnamnden.se/loa/1.0/loa3',
+    }
+    return {
+        '_id': bson.ObjectId(),
+        'eduPersonPrincipalName': 'hubba-{:06d}'.format(i % 1000),
+        'authn_resp': {'code': 'c' * 43, 'state': 's' * 32},
+        'token_resp': {
+            'access_token': 'a' * 64,
+            'token_type': 'Bearer',
+            'expires_in': 3600,
+            'id_token': id_token,
+            'id_token_jwt': 'j' * 900,
+        },
+        'userinfo': {'sub': sub, 'identity': '1980{:08d}'.format(i)},
+        'modified_ts': now,
+    }
+
+
+def current_rss():
+    """
+    :return: Resident set size of this process in bytes
+    :rtype: int
+    """
+    try:
+        with open('/proc/self/statm') as fd:
+            return int(fd.read().split()[1]) * resource.getpagesize()
+    except IOError:
+        # Peak RSS (kilobytes on Linux) is the best we can do without /proc
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_scenario(name, count, queue):
+    if name == 'archived':
+        encoded = [bson.BSON.encode(Proof(make_document(i)).to_storage_dict()) for i in range(count)]
+    else:
+        encoded = [bson.BSON.encode(make_document(i)) for i in range(count)]
+
+    if name == 'raw':
+        decode = RawBSONDocument
+        proof_class = Proof
+    else:
+        decode = lambda data: bson.BSON(data).decode()
+        proof_class = LegacyProof if name == 'legacy' else Proof
+
+    rss_before = current_rss()
+    t0 = time.time()
+    proofs = [proof_class(decode(data)) for data in encoded]
+    t1 = time.time()
+    # What the /proofs view needs for every proof
+    listing = sorted(proofs, key=lambda proof: proof.modified_ts, reverse=True)
+    t2 = time.time()
+    rss_after = current_rss()
+
+    queue.put({
+        'name': name,
+        'load': t1 - t0,
+        'sort': t2 - t1,
+        'rss': rss_after - rss_before,
+        'count': len(listing),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare memory use and load time of Proof implementations')
+    parser.add_argument('-n', '--count', type=int, default=100000, help='Number of proofs to load')
+    args = parser.parse_args()
+
+    scenarios = ['legacy', 'dict', 'archived']
+    if RawBSONDocument is not None:
+        scenarios.append('raw')
+
+    print('Loading {!s} proofs per scenario (pid {!s})'.format(args.count, os.getpid()))
+    print('{:<8} {:>10} {:>10} {:>12} {:>14}'.format('scenario', 'load (s)', 'sort (s)', 'RSS (MiB)',
+                                                    'bytes/proof'))
+    for name in scenarios:
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=run_scenario, args=(name, args.count, queue))
+        process.start()
+        result = queue.get()
+        process.join()
+        print('{name:<8} {load:>10.3f} {sort:>10.3f} {rss_mib:>12.1f} {per_proof:>14.0f}'.format(
+            rss_mib=result['rss'] / 1024.0 / 1024.0, per_proof=float(result['rss']) / result['count'], **result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+"""
+A minimal OpenID Provider that runs in a local thread.
+
+It implements what the OIDC proofing app talks to: provider discovery, JWKS,
+the authentication request endpoint, the token endpoint and the userinfo
+endpoint. The step where the user identifies with the proofing app and the
+OP redirects back is done with MockOP.authenticate, which returns the query
+string for the authorization response.
+
+    op = MockOP()
+    op.start()
+    config['PROVIDER_CONFIGURATION_INFO'] = {'issuer': op.issuer}
+    ...
+    op.stop()
+"""
+
+from __future__ import absolute_import
+
+import time
+import base64
+import threading
+
+from flask import Flask, request, jsonify, abort
+from werkzeug.serving import make_server
+from Crypto.PublicKey import RSA
+from jwkest.jwk import RSAKey
+from oic.oic.message import IdToken
+
+from eduid_common.api.utils import get_unique_hash
+
+try:
+    from urllib import urlencode
+except ImportError:  # Python3
+    from urllib.parse import urlencode
+
+__author__ = 'lundberg'
+
+
+class MockOP(object):
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, token_lifetime=3600):
+        """
+        :param host: Interface to listen on
+        :param port: Port to listen on, 0 picks a free port
+        :param latency: Seconds every endpoint sleeps before responding, to simulate a remote OP
+        :param token_lifetime: Lifetime of issued tokens in seconds
+
+        :type host: str
+        :type port: int
+        :type latency: float
+        :type token_lifetime: int
+        """
+        self.latency = latency
+        self.token_lifetime = token_lifetime
+        self.key = RSAKey(key=RSA.generate(2048), kid='mock-op', use='sig')
+
+        self._lock = threading.Lock()
+        self._authn_requests = {}  # nonce -> authentication request
+        self._codes = {}  # code -> authentication
+        self._access_tokens = {}  # access token -> authentication
+
+        self.app = self._create_app()
+        self._server = make_server(host, port, self.app, threaded=True)
+        self.issuer = 'http://{!s}:{!s}'.format(host, self._server.server_port)
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='mock-op')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._thread.join()
+
+    @property
+    def provider_configuration(self):
+        return {
+            'issuer': self.issuer,
+            'authorization_endpoint': '{!s}/authentication'.format(self.issuer),
+            'token_endpoint': '{!s}/token'.format(self.issuer),
+            'userinfo_endpoint': '{!s}/userinfo'.format(self.issuer),
+            'jwks_uri': '{!s}/jwks'.format(self.issuer),
+            'claims_parameter_supported': True,
+            'grant_types_supported': ['authorization_code'],
+            'id_token_signing_alg_values_supported': ['RS256'],
+            'response_modes_supported': ['query'],
+            'response_types_supported': ['code'],
+            'scopes_supported': ['openid'],
+            'subject_types_supported': ['pairwise'],
+            'token_endpoint_auth_methods_supported': ['client_secret_basic'],
+        }
+
+    def authenticate(self, nonce, identity):
+        """
+        Simulate a user identifying with the proofing app for the authentication request with `nonce`.
+
+        :param nonce: The nonce from the QR code
+        :param identity: The national identity number the user identified as
+
+        :type nonce: str | unicode
+        :type identity: str | unicode
+
+        :return: Query string for the authorization response to the relying party
+        :rtype: str
+        """
+        with self._lock:
+            authn_request = self._authn_requests.pop(nonce)
+            code = get_unique_hash()
+            self._codes[code] = {
+                'client_id': authn_request['client_id'],
+                'nonce': nonce,
+                'sub': get_unique_hash(),
+                'identity': identity,
+                'auth_time': int(time.time()),
+            }
+        return urlencode({'code': code, 'state': authn_request['state']})
+
+    def _id_token(self, authn):
+        now = int(time.time())
+        id_token = IdToken(iss=self.issuer, sub=authn['sub'], aud=[authn['client_id']], exp=now + self.token_lifetime,
+                           iat=now, auth_time=authn['auth_time'], nonce=authn['nonce'])
+        return id_token.to_jwt([self.key], 'RS256')
+
+    def _create_app(self):
+        app = Flask(__name__)
+
+        @app.before_request
+        def simulate_latency():
+            if self.latency:
+                time.sleep(self.latency)
+
+        @app.route('/.well-known/openid-configuration')
+        def discovery():
+            return jsonify(self.provider_configuration)
+
+        @app.route('/jwks')
+        def jwks():
+            return jsonify({'keys': [self.key.serialize()]})
+
+        @app.route('/authentication', methods=['POST'])
+        def authentication():
+            args = request.form.to_dict()
+            for key in ['client_id', 'response_type', 'redirect_uri', 'state', 'nonce']:
+                if not args.get(key):
+                    abort(400)
+            with self._lock:
+                self._authn_requests[args['nonce']] = args
+            return 'OK'
+
+        @app.route('/token', methods=['POST'])
+        def token():
+            auth = request.headers.get('Authorization', '')
+            if not auth.startswith('Basic '):
+                abort(401)
+            client_id = base64.b64decode(auth[len('Basic '):].encode('ascii')).decode('utf-8').split(':')[0]
+            with self._lock:
+                authn = self._codes.pop(request.form.get('code'), None)
+                if authn is None or authn['client_id'] != client_id:
+                    return jsonify({'error': 'invalid_grant'}), 400
+                access_token = get_unique_hash()
+                self._access_tokens[access_token] = authn
+            return jsonify({
+                'access_token': access_token,
+                'token_type': 'Bearer',
+                'expires_in': self.token_lifetime,
+                'id_token': self._id_token(authn),
+            })
+
+        @app.route('/userinfo', methods=['GET', 'POST'])
+        def userinfo():
+            access_token = request.values.get('access_token')
+            auth = request.headers.get('Authorization', '')
+            if auth.startswith('Bearer '):
+                access_token = auth[len('Bearer '):]
+            with self._lock:
+                authn = self._access_tokens.get(access_token)
+            if authn is None:
+                return jsonify({'error': 'invalid_token'}), 401
+            return jsonify({'sub': authn['sub'], 'identity': authn['identity']})
+
+        return app
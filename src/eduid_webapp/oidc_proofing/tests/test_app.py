@@ -15,6 +15,8 @@ from eduid_userdb.data_samples import NEW_USER_EXAMPLE
 from eduid_userdb.user import User
 from eduid_common.api.testing import EduidAPITestCase
 from eduid_webapp.oidc_proofing.app import init_oidc_proofing_app
+from eduid_webapp.oidc_proofing.mock_proof import Proof
+from eduid_webapp.oidc_proofing.tests.mock_op import MockOP
 
 __author__ = 'lundberg'
 
@@ -22,6 +24,17 @@ __author__ = 'lundberg'
 class AppTests(EduidAPITestCase):
     """Base TestCase for those tests that need a full environment setup"""
 
+    @classmethod
+    def setUpClass(cls):
+        super(AppTests, cls).setUpClass()
+        cls.mock_op = MockOP()
+        cls.mock_op.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.mock_op.stop()
+        super(AppTests, cls).tearDownClass()
+
     def setUp(self):
         super(AppTests, self).setUp()
 
@@ -38,48 +51,6 @@ class AppTests(EduidAPITestCase):
 
         self.client = self.app.test_client()
 
-        self.oidc_provider_config = {
-            'authorization_endpoint': 'https://example.com/op/authentication',
-            'claims_parameter_supported': True,
-            'grant_types_supported': [
-                'authorization_code',
-                'implicit'
-            ],
-            'id_token_signing_alg_values_supported': [
-                'RS256'
-            ],
-            'issuer': 'https://example.com/op/',
-            'jwks_uri': 'https://example.com/op/jwks',
-            'response_modes_supported': [
-                'query',
-                'fragment'
-            ],
-            'response_types_supported': [
-                'code',
-                'code id_token',
-                'code token',
-                'code id_token token'
-            ],
-            'scopes_supported': [
-                'openid'
-            ],
-            'subject_types_supported': [
-                'pairwise'
-            ],
-            'token_endpoint': 'https://example.com/op/token',
-            'token_endpoint_auth_methods_supported': [
-                'client_secret_basic'
-            ],
-            'userinfo_endpoint': 'https://example.com/op/userinfo'
-        }
-
-        class MockResponse(object):
-            def __init__(self, status_code, text):
-                self.status_code = status_code
-                self.text = text
-
-        self.oidc_provider_config_response = MockResponse(200, json.dumps(self.oidc_provider_config))
-
         # Replace user with one without previous proofings
         userdata = deepcopy(NEW_USER_EXAMPLE)
         del userdata['nins']
@@ -103,7 +74,7 @@ class AppTests(EduidAPITestCase):
                 'CELERY_TASK_SERIALIZER': 'json'
             },
             'PROVIDER_CONFIGURATION_INFO': {
-                'issuer': 'https://example.com'
+                'issuer': self.mock_op.issuer
             },
             'CLIENT_REGISTRATION_INFO': {
                 'client_id': 'test_client',
@@ -116,13 +87,63 @@ class AppTests(EduidAPITestCase):
         super(AppTests, self).tearDown()
         with self.app.app_context():
             self.app.proofing_statedb._drop_whole_collection()
+            self.app.proofing_userdb._drop_whole_collection()
+            self.app.proofdb._drop_whole_collection()
             self.app.central_userdb._drop_whole_collection()
 
-    #@patch('eduid_webapp.oidc_proofing.app.Client.http_request')
-    #def test_authenticate(self, mock_response):
-    #    mock_response.return_value = self.oidc_provider_config_response
-    #    response = self.client.get('/proofing')
-    #    self.assertEqual(response.status_code, 302)  # Redirect to token service
-    #    with self.session_cookie(self.client, self.test_user_eppn) as client:
-    #        response = client.get('/proofing')
-    #    self.assertEqual(response.status_code, 200)  # Authenticated request
+    def test_authenticate(self):
+        response = self.client.get('/proofs')
+        self.assertEqual(response.status_code, 302)  # Redirect to token service
+        with self.session_cookie(self.client, self.test_user_eppn) as client:
+            response = client.get('/proofs')
+        self.assertEqual(response.status_code, 200)  # Authenticated request
+
+    def test_proofs_unknown_fields(self):
+        self.app.proofdb.save(Proof(data={
+            'eduPersonPrincipalName': self.test_user_eppn,
+            'authn_resp': {'code': 'code', 'state': 'state'},
+            'token_resp': {'access_token': 'access_token', 'id_token': {'sub': 'sub', 'nonce': 'nonce'}},
+            'userinfo': {'sub': 'sub', 'identity': self.test_user_nin},
+        }))
+        with self.session_cookie(self.client, self.test_user_eppn) as client:
+            response = client.get('/proofs?fields=no-such-field')
+        self.assertEqual(response.status_code, 200)
+        proofs = json.loads(response.data)['payload']['proofs']
+        # All fields are returned when none of the requested fields are known
+        self.assertEqual(proofs[0]['eduPersonPrincipalName'], self.test_user_eppn)
+        self.assertEqual(proofs[0]['userinfo']['identity'], self.test_user_nin)
+
+    @patch('eduid_common.api.am.AmRelay.request_user_sync')
+    def test_proofing_flow(self, mock_request_user_sync):
+        mock_request_user_sync.return_value = True
+        with self.session_cookie(self.client, self.test_user_eppn) as client:
+            response = client.post('/proofing', data=json.dumps({'nin': self.test_user_nin}),
+                                   content_type=self.content_type_json)
+        self.assertEqual(response.status_code, 200)
+        payload = json.loads(response.data)['payload']
+        qr_data = json.loads(payload['qr_code'][1:])
+        self.assertIsNotNone(self.app.proofing_statedb.get_state_by_eppn(self.test_user_eppn,
+                                                                          raise_on_missing=False))
+
+        # The user identifies with the proofing app and the OP calls back
+        query_string = self.mock_op.authenticate(qr_data['nonce'], self.test_user_nin)
+        response = self.client.get('/authorization-response?{!s}'.format(query_string),
+                                   headers={'Authorization': 'Bearer {!s}'.format(qr_data['token'])})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mock_request_user_sync.call_count, 1)
+
+        user = self.app.proofing_userdb.get_user_by_eppn(self.test_user_eppn)
+        self.assertEqual(user.nins.primary.number, self.test_user_nin)
+        self.assertTrue(user.nins.primary.is_verified)
+        self.assertEqual(len(self.app.proofdb.get_proofs_by_eppn(self.test_user_eppn)), 1)
+        self.assertIsNone(self.app.proofing_statedb.get_state_by_eppn(self.test_user_eppn, raise_on_missing=False))
+
+    def test_authorization_response_wrong_token(self):
+        with self.session_cookie(self.client, self.test_user_eppn) as client:
+            response = client.post('/proofing', data=json.dumps({'nin': self.test_user_nin}),
+                                   content_type=self.content_type_json)
+        qr_data = json.loads(json.loads(response.data)['payload']['qr_code'][1:])
+        query_string = self.mock_op.authenticate(qr_data['nonce'], self.test_user_nin)
+        response = self.client.get('/authorization-response?{!s}'.format(query_string),
+                                   headers={'Authorization': 'Bearer not-the-token'})
+        self.assertEqual(response.status_code, 403)
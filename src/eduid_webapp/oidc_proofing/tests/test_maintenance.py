@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import sys
+import unittest
+
+from mock import patch
+from pymongo.errors import OperationFailure
+
+from eduid_webapp.oidc_proofing.maintenance import STATE_INDEX_NAME, TTL_INDEX_NAME, main, setup_state_indexes
+
+__author__ = 'lundberg'
+
+
+class FakeDatabase(object):
+
+    def __init__(self):
+        self.commands = []
+        self.error = None
+
+    def command(self, name, value, **kwargs):
+        if self.error is not None:
+            raise self.error
+        self.commands.append((name, value, kwargs))
+
+
+class FakeCollection(object):
+    """
+    The parts of a pymongo collection used by setup_state_indexes, with the indexes in a dict.
+    """
+
+    name = 'proofing_state'
+    full_name = 'eduid_oidc_proofing.proofing_state'
+
+    def __init__(self):
+        self.indexes = {}
+        self.errors = {}
+        self.database = FakeDatabase()
+
+    def ensure_index(self, key, name=None, **kwargs):
+        if name in self.errors:
+            raise self.errors[name]
+        self.indexes[name] = dict(kwargs, key=[(key, 1)])
+
+    def index_information(self):
+        return self.indexes
+
+
+class FakeStateDB(object):
+
+    def __init__(self):
+        self._coll = FakeCollection()
+
+
+class SetupStateIndexesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.state_db = FakeStateDB()
+        self.coll = self.state_db._coll
+
+    def test_setup(self):
+        self.assertTrue(setup_state_indexes(self.state_db, 3600))
+        self.assertTrue(self.coll.indexes[STATE_INDEX_NAME]['unique'])
+        self.assertEqual(self.coll.indexes[TTL_INDEX_NAME]['expireAfterSeconds'], 3600)
+
+    def test_lifetime_changed(self):
+        setup_state_indexes(self.state_db, 3600)
+        self.assertTrue(setup_state_indexes(self.state_db, 7200))
+        self.assertEqual(self.coll.database.commands,
+                         [('collMod', 'proofing_state',
+                           {'index': {'keyPattern': {'modified_ts': 1}, 'expireAfterSeconds': 7200}})])
+
+    def test_unique_index_failure(self):
+        self.coll.errors[STATE_INDEX_NAME] = OperationFailure('E11000 duplicate key error')
+        self.assertFalse(setup_state_indexes(self.state_db, 3600))
+        # The TTL index is still set up
+        self.assertIn(TTL_INDEX_NAME, self.coll.indexes)
+
+    def test_ttl_index_failure(self):
+        # Like an existing index on modified_ts with other options
+        self.coll.errors[TTL_INDEX_NAME] = OperationFailure('Index with name: modified_ts_1 already exists '
+                                                            'with different options')
+        self.assertFalse(setup_state_indexes(self.state_db, 3600))
+        self.assertIn(STATE_INDEX_NAME, self.coll.indexes)
+
+    def test_collmod_failure(self):
+        setup_state_indexes(self.state_db, 3600)
+        self.coll.database.error = OperationFailure('not authorized to execute command collMod')
+        self.assertFalse(setup_state_indexes(self.state_db, 7200))
+
+
+class MainTests(unittest.TestCase):
+
+    @patch('eduid_webapp.oidc_proofing.maintenance.OidcProofingStateDB')
+    def test_setup_indexes_with_dry_run(self, mock_state_db):
+        argv = ['maintenance', '--mongo-uri', 'mongodb://localhost', '--setup-indexes', '--dry-run']
+        with patch.object(sys, 'argv', argv):
+            with patch('sys.stderr'):
+                self.assertRaises(SystemExit, main)
+        self.assertFalse(mock_state_db.called)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import unittest
+from datetime import datetime
+from bson import BSON, ObjectId
+
+from eduid_userdb.exceptions import UserHasUnknownData
+from eduid_webapp.oidc_proofing.mock_proof import Proof, RawBSONDocument, encode_cursor, decode_cursor
+from eduid_webapp.oidc_proofing.mock_proof import expand_document
+
+__author__ = 'lundberg'
+
+
+class ProofTests(unittest.TestCase):
+
+    def setUp(self):
+        self.data = {
+            'eduPersonPrincipalName': 'hubba-bubba',
+            'authn_resp': {'code': 'code', 'state': 'state'},
+            'token_resp': {'access_token': 'access_token', 'id_token': {'sub': 'sub', 'nonce': 'nonce'}},
+            'userinfo': {'sub': 'sub', 'identity': '200001023456'},
+        }
+
+    def test_does_not_modify_callers_data(self):
+        proof = Proof(self.data)
+        proof.modified_ts = True
+        self.assertIsInstance(proof._id, ObjectId)
+        self.assertNotIn('_id', self.data)
+        self.assertNotIn('modified_ts', self.data)
+
+    def test_no_copy_until_modified(self):
+        self.data['_id'] = ObjectId()
+        proof = Proof(self.data)
+        self.assertIs(proof._data, self.data)
+        proof.modified_ts = True
+        self.assertIsNot(proof._data, self.data)
+
+    def test_unknown_data(self):
+        self.data['foo'] = 'bar'
+        self.assertRaises(UserHasUnknownData, Proof, self.data)
+        proof = Proof(self.data, raise_on_unknown=False)
+        self.assertEqual(proof.to_dict()['foo'], 'bar')
+
+    def test_missing_data(self):
+        del self.data['userinfo']
+        self.assertRaises(KeyError, Proof, self.data)
+
+    def test_properties(self):
+        proof = Proof(self.data)
+        self.assertEqual(proof.eppn, 'hubba-bubba')
+        self.assertEqual(proof.authn_resp, self.data['authn_resp'])
+        self.assertEqual(proof.auth_resp, self.data['authn_resp'])
+        self.assertEqual(proof.token_resp, self.data['token_resp'])
+        self.assertEqual(proof.userinfo, self.data['userinfo'])
+        self.assertIsNone(proof.modified_ts)
+
+    @unittest.skipIf(RawBSONDocument is None, 'RawBSONDocument not available')
+    def test_raw_bson(self):
+        self.data['_id'] = ObjectId()
+        self.data['modified_ts'] = datetime.utcnow().replace(microsecond=0)
+        proof = Proof(RawBSONDocument(BSON.encode(self.data)))
+        self.assertEqual(proof.eppn, 'hubba-bubba')
+        self.assertEqual(proof.token_resp, self.data['token_resp'])
+        self.assertIsInstance(proof.token_resp['id_token'], dict)
+        self.assertIsInstance(proof.to_dict()['userinfo'], dict)
+        self.assertEqual(proof.to_dict(), self.data)
+
+    def test_storage_format(self):
+        self.data['modified_ts'] = datetime.utcnow()
+        storage_doc = Proof(self.data).to_storage_dict()
+        for key in ['authn_resp', 'token_resp', 'userinfo']:
+            self.assertNotIn(key, storage_doc)
+        self.assertEqual(storage_doc['eduPersonPrincipalName'], 'hubba-bubba')
+        self.assertEqual(storage_doc['sub'], 'sub')
+        self.assertEqual(storage_doc['identity'], '200001023456')
+
+        proof = Proof(storage_doc)
+        self.assertEqual(proof.userinfo, self.data['userinfo'])
+        expected = dict(self.data, _id=storage_doc['_id'])
+        self.assertEqual(proof.to_dict(), expected)
+        self.assertEqual(expand_document(dict(storage_doc)), expected)
+        self.assertEqual(proof.to_storage_dict()['payload'], storage_doc['payload'])
+
+    def test_storage_format_fields(self):
+        storage_doc = Proof(self.data).to_storage_dict()
+        doc = expand_document(dict(storage_doc), fields=['userinfo'])
+        self.assertEqual(doc, {'_id': storage_doc['_id'], 'userinfo': self.data['userinfo']})
+
+
+class CursorTests(unittest.TestCase):
+
+    def test_roundtrip(self):
+        doc = {'_id': ObjectId(), 'modified_ts': datetime(2016, 11, 24, 13, 37, 42, 123000)}
+        modified_ts, _id = decode_cursor(encode_cursor(doc))
+        self.assertEqual(modified_ts, doc['modified_ts'])
+        self.assertEqual(_id, doc['_id'])
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, decode_cursor, 'not a cursor')
+        self.assertRaises(ValueError, decode_cursor, encode_cursor({'_id': 'x', 'modified_ts': datetime.utcnow()}))
@@ -9,7 +9,6 @@ import json
 from flask import request, make_response, url_for
 from flask import current_app, Blueprint
 from oic.oic.message import AuthorizationResponse, ClaimsRequest, Claims
-from operator import itemgetter
 from marshmallow.exceptions import ValidationError
 
 from eduid_userdb.proofing import ProofingUser
@@ -17,8 +16,9 @@ from eduid_userdb.nin import Nin
 from eduid_common.api.utils import get_unique_hash, StringIO
 from eduid_common.api.decorators import require_user, require_eppn, MarshalWith, UnmarshalWith
 from eduid_userdb.proofing import OidcProofingState
+from eduid_webapp.api.deadline import get_timeout, check_deadline
 from eduid_webapp.oidc_proofing import schemas
-from eduid_webapp.oidc_proofing.mock_proof import Proof, DocumentDoesNotExist
+from eduid_webapp.oidc_proofing.mock_proof import Proof
 
 __author__ = 'lundberg'
 
@@ -28,6 +28,9 @@ OIDC code very inspired by https://github.com/its-dirg/Flask-pyoidc
 
 oidc_proofing_views = Blueprint('oidc_proofing', __name__, url_prefix='')
 
+# Fields that can be requested from /proofs
+PROOF_FIELDS = ['eduPersonPrincipalName', 'authn_resp', 'token_resp', 'userinfo', 'modified_ts']
+
 
 @oidc_proofing_views.route('/authorization-response')
 def authorization_response():
@@ -107,6 +110,10 @@ def authorization_response():
 
         # XXX: Send proofing data to some kind of proofing log
 
+        # The relay call can not be given a timeout, so the deadline is checked before the user is saved.
+        # Once saved, the sync is always requested.
+        check_deadline('attribute manager sync')
+
         # User from central db is as up to date as it can be no need to check for modified time
         user.modified_ts = True
         # Save user to private db
@@ -174,7 +181,9 @@ def proofing(user, nin):
         current_app.logger.debug('AuthenticationRequest args:')
         current_app.logger.debug(oidc_args)
         try:
-            response = requests.post(current_app.oidc_client.authorization_endpoint, data=oidc_args)
+            timeout = get_timeout('authentication request', current_app.config['OIDC_HTTP_TIMEOUT'])
+            response = requests.post(current_app.oidc_client.authorization_endpoint, data=oidc_args,
+                                     timeout=timeout)
         except requests.exceptions.ConnectionError as e:
             msg = 'No connection to authorization endpoint: {!s}'.format(e)
             current_app.logger.error(msg)
@@ -208,15 +217,16 @@ def proofing(user, nin):
 @require_eppn
 def proofs(eppn):
     current_app.logger.debug('Getting proofs for user with eppn {!s}.'.format(eppn))
+    limit = request.args.get('limit', current_app.config['PROOFS_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, current_app.config['PROOFS_MAX_PAGE_SIZE']))
+    after = request.args.get('after')
+    fields = PROOF_FIELDS
+    if request.args.get('fields'):
+        # Unknown field names are ignored, all fields are returned if none are known
+        fields = [field for field in request.args['fields'].split(',') if field in PROOF_FIELDS] or PROOF_FIELDS
     try:
-        proof_data = current_app.proofdb.get_proofs_by_eppn(eppn)
-    except DocumentDoesNotExist:
-        return {'proofs': []}
-    data = []
-    for proof in proof_data:
-        tmp = proof.to_dict()
-        del tmp['_id']
-        data.append(tmp)
-    data = sorted(data, key=itemgetter('modified_ts'), reverse=True)
-    return {'proofs': data}
-
+        proof_data, next_cursor = current_app.proofdb.get_proofs_page(eppn, limit, after=after, fields=fields)
+    except ValueError as e:
+        current_app.logger.error('Bad proofs request from user with eppn {!s}: {!s}'.format(eppn, e))
+        return {'_status': 'error', 'error': 'Invalid cursor'}
+    return {'proofs': proof_data, 'next': next_cursor}
@@ -36,6 +36,7 @@ from __future__ import absolute_import
 from eduid_common.api.app import eduid_init_app
 from eduid_common.api import am
 from eduid_userdb.dashboard import DashboardUserDB
+from eduid_webapp.api.userdb import init_central_userdb
 
 
 try:
@@ -75,6 +76,7 @@ def pd_init_app(name, config):
     # XXX: attributes that can be changed by a sync call
     app = am.init_relay(app, 'eduid_dashboard')
 
+    app = init_central_userdb(app)
     app.dashboard_userdb = DashboardUserDB(app.config['MONGO_URI'])
 
     app.logger.info('Init {} app...'.format(name))
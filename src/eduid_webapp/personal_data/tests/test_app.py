@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import json
+from copy import deepcopy
+
+from eduid_userdb.data_samples import NEW_USER_EXAMPLE
+from eduid_userdb.dashboard import DashboardUser
+from eduid_userdb.user import User
+from eduid_common.api.testing import EduidAPITestCase
+from eduid_webapp.personal_data.app import pd_init_app
+
+__author__ = 'lundberg'
+
+
+class AppTests(EduidAPITestCase):
+
+    def setUp(self):
+        super(AppTests, self).setUp()
+
+        self.test_user_eppn = 'hubba-bubba'
+        self.client = self.app.test_client()
+
+        user = User(data=deepcopy(NEW_USER_EXAMPLE))
+        user.modified_ts = True
+        self.app.central_userdb.save(user, check_sync=False)
+        self.app.dashboard_userdb.save(DashboardUser(data=deepcopy(NEW_USER_EXAMPLE)), check_sync=False)
+
+    def load_app(self, config):
+        """
+        Called from the parent class, so we can provide the appropriate flask
+        app for this test case.
+        """
+        return pd_init_app('testing', config)
+
+    def update_config(self, config):
+        config.update({
+            'AM_BROKER_URL': 'amqp://dummy',
+            'CELERY_CONFIG': {
+                'CELERY_RESULT_BACKEND': 'amqp',
+                'CELERY_TASK_SERIALIZER': 'json'
+            },
+        })
+        return config
+
+    def tearDown(self):
+        super(AppTests, self).tearDown()
+        with self.app.app_context():
+            self.app.central_userdb._drop_whole_collection()
+            self.app.dashboard_userdb._drop_whole_collection()
+
+    def get_user(self, etag=None):
+        headers = {}
+        if etag is not None:
+            headers['If-None-Match'] = etag
+        with self.session_cookie(self.client, self.test_user_eppn) as client:
+            return client.get('/user', headers=headers)
+
+    def test_get_user(self):
+        response = self.get_user()
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(response.headers.get('ETag'))
+        data = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(data['payload']['given_name'], NEW_USER_EXAMPLE['givenName'])
+
+    def test_get_user_not_modified(self):
+        etag = self.get_user().headers['ETag']
+        response = self.get_user(etag=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        self.assertEqual(response.headers.get('ETag'), etag)
+
+    def test_get_user_saved(self):
+        etag = self.get_user().headers['ETag']
+        user = self.app.central_userdb.get_user_by_eppn(self.test_user_eppn)
+        user.modified_ts = True
+        self.app.central_userdb.save(user, check_sync=False)
+        response = self.get_user(etag=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(response.headers.get('ETag'))
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_get_user_without_modified_ts(self):
+        self.app.central_userdb._coll.update_one({'eduPersonPrincipalName': self.test_user_eppn},
+                                                 {'$unset': {'modified_ts': ''}})
+        response = self.get_user()
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.headers.get('ETag'))
+
+    def test_get_user_cache_control(self):
+        response = self.get_user()
+        self.assertIn('private', response.headers['Cache-Control'])
+        self.assertIn('no-cache', response.headers['Cache-Control'])
+        etag = response.headers['ETag']
+        response = self.get_user(etag=etag)
+        self.assertIn('private', response.headers['Cache-Control'])
+        self.assertIn('no-cache', response.headers['Cache-Control'])
@@ -33,7 +33,9 @@
 
 from __future__ import absolute_import
 
-from flask import Blueprint
+import hashlib
+
+from flask import Blueprint, current_app, request, session
 
 from eduid_userdb.exceptions import UserOutOfSync
 from eduid_common.api.decorators import require_dashboard_user, MarshalWith, UnmarshalWith
@@ -43,13 +45,48 @@ from eduid_webapp.personal_data.schemas import PersonalDataSchema, PersonalDataR
 pd_views = Blueprint('personal_data', __name__, url_prefix='')
 
 
-@pd_views.route('/user', methods=['GET'])
+def get_user_etag(eppn):
+    """
+    ETag for the personal data of a user, from the user's modified_ts in the central user database.
+    Only modified_ts is read, so requests with a matching If-None-Match are answered without
+    loading the user.
+
+    :param eppn: eduPersonPrincipalName of the logged in user
+    :type eppn: str | None
+
+    :return: The ETag, None if the user has no modified_ts
+    :rtype: str | None
+    """
+    if not eppn:
+        return None
+    modified_ts = current_app.central_userdb.get_modified_ts(eppn)
+    if not modified_ts:
+        return None
+    return hashlib.sha1('{!s}:{!s}'.format(eppn, modified_ts.isoformat()).encode('utf-8')).hexdigest()
+
+
 @MarshalWith(PersonalDataResponseSchema)
 @require_dashboard_user
-def get_user(user):
+def _get_user(user):
     return PersonalDataSchema().dump(user).data
 
 
+@pd_views.route('/user', methods=['GET'])
+def get_user():
+    etag = get_user_etag(session.get('user_eppn'))
+    if etag is not None and etag in request.if_none_match:
+        # Made into a 304 Not Modified by make_conditional
+        response = current_app.response_class()
+    else:
+        response = _get_user()
+    if etag is not None:
+        response.set_etag(etag)
+    # Cached by the browser only, and always revalidated
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
 @pd_views.route('/user', methods=['POST'])
 @UnmarshalWith(PersonalDataSchema)
 @MarshalWith(PersonalDataResponseSchema)
@@ -4,9 +4,12 @@ from __future__ import absolute_import
 
 from eduid_common.api.app import eduid_init_app
 from eduid_common.api.utils import urlappend
-from eduid_userdb.support import db
 from flask import url_for
 
+from eduid_webapp.api.metrics import init_metrics
+from eduid_webapp.support import db
+from eduid_webapp.support.search_index import SupportSearchIndexDB
+
 
 def register_template_funcs(app):
 
@@ -25,6 +28,10 @@ def register_template_funcs(app):
         # If STATIC_URL is not set use Flask default
         return url_for('static', filename=filename)
 
+    @app.template_global()
+    def replica_lag():
+        return app.support_replica_lag.lag()
+
 
 def support_init_app(name, config):
     """
@@ -48,18 +55,26 @@ def support_init_app(name, config):
 
     app = eduid_init_app(name, config)
     app.config.update(config)
+    init_metrics(app)
 
     from eduid_webapp.support.views import support_views
     app.register_blueprint(support_views, url_prefix=app.config.get('APPLICATION_ROOT', None))
 
-    app.support_user_db = db.SupportUserDB(app.config['MONGO_URI'])
-    app.support_authn_db = db.SupportAuthnInfoDB(app.config['MONGO_URI'])
-    app.support_verification_db = db.SupportVerificationsDB(app.config['MONGO_URI'])
-    app.support_proofing_log_db = db.SupportProofingLogDB(app.config['MONGO_URI'])
-    app.support_dashboard_db = db.SupportDashboardUserDB(app.config['MONGO_URI'])
-    app.support_signup_db = db.SupportSignupUserDB(app.config['MONGO_URI'])
-    app.support_actions_db = db.SupportActionsDB(app.config['MONGO_URI'])
-    app.support_letter_proofing_db = db.SupportLetterProofingDB(app.config['MONGO_URI'])
+    # Support reads go to secondaries by default, see eduid_webapp.support.db
+    mongo_uri = db.support_mongo_uri(app.config['MONGO_URI'], app.config.get('SUPPORT_MONGO_READ_PREFERENCE'),
+                                     app.config.get('SUPPORT_MONGO_MAX_STALENESS'))
+    app.support_user_db = db.SupportUserDB(mongo_uri)
+    app.support_authn_db = db.SupportAuthnInfoDB(mongo_uri)
+    app.support_verification_db = db.SupportVerificationsDB(mongo_uri)
+    app.support_proofing_log_db = db.SupportProofingLogDB(mongo_uri)
+    app.support_dashboard_db = db.SupportDashboardUserDB(mongo_uri)
+    app.support_signup_db = db.SupportSignupUserDB(mongo_uri)
+    app.support_actions_db = db.SupportActionsDB(mongo_uri)
+    app.support_letter_proofing_db = db.SupportLetterProofingDB(mongo_uri)
+    app.support_replica_lag = db.ReplicaLagMonitor(app.support_user_db._coll.database.client, app.metrics,
+                                                   interval=app.config.get('SUPPORT_REPLICA_LAG_INTERVAL', 30))
+    if app.config.get('SUPPORT_SEARCH_INDEX'):
+        app.support_search_index = SupportSearchIndexDB(mongo_uri)
 
     register_template_funcs(app)
 
@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+
+"""
+Support databases with bulk lookups.
+
+The databases from eduid_userdb.support look up the data of one user per
+call, so showing N users costs about nine queries per user. The classes
+here add methods that fetch the data of all users in a search result with
+one $in query per collection, returning it keyed on user id or eppn.
+
+The support app reads with the SUPPORT_MONGO_READ_PREFERENCE read
+preference, from secondaries by default, so that support searches do not
+load the primary. The lookups take a `fresh` argument to read from the
+primary instead, for when the data must be up to date. How far behind the
+secondaries are is checked by ReplicaLagMonitor.
+
+The lookups also take a `max_time_ms` argument, passed on to MongoDB, so
+that a query the caller has stopped waiting for is stopped by the server
+instead of holding a lookup thread.
+"""
+
+from __future__ import absolute_import
+
+import time
+import logging
+import threading
+
+from bson import ObjectId
+from pymongo import ReadPreference
+from eduid_userdb.exceptions import UserHasUnknownData
+from eduid_userdb.support import db
+
+__author__ = 'lundberg'
+
+logger = logging.getLogger(__name__)
+
+# Fields needed for the search result list
+SUMMARY_FIELDS = ['eduPersonPrincipalName', 'givenName', 'surname', 'displayName', 'mail', 'mailAliases',
+                  'pending_mail_address']
+
+
+def _object_ids(user_ids):
+    return list(set([user_id if isinstance(user_id, ObjectId) else ObjectId(user_id) for user_id in user_ids]))
+
+
+def _group_by(docs, key, model):
+    """
+    :return: str(doc[key]) -> list of model(doc)
+    :rtype: dict
+    """
+    result = {}
+    for doc in docs:
+        result.setdefault(str(doc[key]), []).append(model(dict(doc)))
+    return result
+
+
+def _primary_mail(doc):
+    mail_aliases = doc.get('mailAliases') or []
+    for alias in mail_aliases:
+        if alias.get('primary'):
+            return alias.get('email')
+    if doc.get('mail'):
+        return doc['mail']
+    if mail_aliases:
+        return mail_aliases[0].get('email')
+    if doc.get('pending_mail_address'):
+        return doc['pending_mail_address'].get('email')
+    return None
+
+
+def _summary(doc):
+    name = doc.get('displayName')
+    if not name:
+        name = ' '.join([part for part in [doc.get('givenName'), doc.get('surname')] if part])
+    return {
+        'user_id': doc['_id'],
+        'eduPersonPrincipalName': doc.get('eduPersonPrincipalName'),
+        'name': name,
+        'mail': _primary_mail(doc),
+    }
+
+
+def support_mongo_uri(uri, read_preference=None, max_staleness=None):
+    """
+    Add read preference options to a MongoDB URI, unless it already has a read preference.
+
+    :param uri: MongoDB URI
+    :param read_preference: Read preference mode, e.g. secondaryPreferred
+    :param max_staleness: Seconds a secondary may be behind the primary to be read from
+
+    :type uri: str
+    :type read_preference: str | None
+    :type max_staleness: int | None
+
+    :rtype: str
+    """
+    if not read_preference or 'readpreference=' in uri.lower():
+        return uri
+    options = ['readPreference={!s}'.format(read_preference)]
+    if max_staleness and read_preference != 'primary':
+        options.append('maxStalenessSeconds={!s}'.format(max_staleness))
+    if '?' in uri:
+        return '{!s}&{!s}'.format(uri, '&'.join(options))
+    if '/' not in uri.split('://', 1)[-1]:
+        uri += '/'
+    return '{!s}?{!s}'.format(uri, '&'.join(options))
+
+
+class ReadCollectionMixin(object):
+
+    def _read_coll(self, fresh=False):
+        """
+        :param fresh: Read from the primary, regardless of the read preference
+        :type fresh: bool
+
+        :rtype: pymongo.collection.Collection
+        """
+        if fresh:
+            return self._coll.with_options(read_preference=ReadPreference.PRIMARY)
+        return self._coll
+
+    def _find(self, spec, fields=None, fresh=False, max_time_ms=None):
+        """
+        :param spec: Query
+        :param fields: Fields to return, None for all
+        :param fresh: Read from the primary, regardless of the read preference
+        :param max_time_ms: Milliseconds the query may run, None for no limit
+
+        :type spec: dict
+        :type fields: list | None
+        :type fresh: bool
+        :type max_time_ms: int | None
+
+        :rtype: pymongo.cursor.Cursor
+        """
+        cursor = self._read_coll(fresh).find(spec, fields)
+        if max_time_ms:
+            cursor = cursor.max_time_ms(max_time_ms)
+        return cursor
+
+
+class BulkUserMixin(ReadCollectionMixin):
+    """
+    Bulk lookups for the UserDB based support databases.
+    """
+
+    def _user_from_document(self, doc):
+        return self.UserClass(data=doc)
+
+    def get_users_by_ids(self, user_ids, fresh=False, max_time_ms=None):
+        """
+        :param user_ids: User ids
+        :param fresh: Read from the primary
+        :param max_time_ms: Milliseconds the query may run, None for no limit
+        :type user_ids: list
+        :type fresh: bool
+        :type max_time_ms: int | None
+
+        :return: str(user_id) -> user, for the users found
+        :rtype: dict
+        """
+        if not user_ids:
+            return {}
+        users = {}
+        for doc in self._find({'_id': {'$in': _object_ids(user_ids)}}, fresh=fresh, max_time_ms=max_time_ms):
+            user = self._user_from_document(doc)
+            if user is not None:
+                users[str(doc['_id'])] = user
+        return users
+
+    def get_summaries_by_ids(self, user_ids, fresh=False, max_time_ms=None):
+        """
+        Get the eppn, name and primary mail address of users, without loading the whole users.
+
+        :param user_ids: User ids
+        :param fresh: Read from the primary
+        :param max_time_ms: Milliseconds the query may run, None for no limit
+        :type user_ids: list
+        :type fresh: bool
+        :type max_time_ms: int | None
+
+        :return: str(user_id) -> dict with user_id, eduPersonPrincipalName, name and mail
+        :rtype: dict
+        """
+        if not user_ids:
+            return {}
+        docs = self._find({'_id': {'$in': _object_ids(user_ids)}}, SUMMARY_FIELDS, fresh, max_time_ms)
+        return dict((str(doc['_id']), _summary(doc)) for doc in docs)
+
+
+class SupportUserDB(BulkUserMixin, db.SupportUserDB):
+    pass
+
+
+class SupportDashboardUserDB(BulkUserMixin, db.SupportDashboardUserDB):
+    pass
+
+
+class SupportSignupUserDB(BulkUserMixin, db.SupportSignupUserDB):
+
+    def _user_from_document(self, doc):
+        try:
+            return super(SupportSignupUserDB, self)._user_from_document(doc)
+        except UserHasUnknownData:
+            # The user has completed signup but is in an old format, disregard
+            return None
+
+
+class SupportAuthnInfoDB(ReadCollectionMixin, db.SupportAuthnInfoDB):
+
+    def get_authn_infos(self, user_ids, fresh=False, max_time_ms=None):
+        """
+        :param user_ids: User ids
+        :param fresh: Read from the primary
+        :param max_time_ms: Milliseconds the query may run, None for no limit
+        :type user_ids: list
+        :type fresh: bool
+        :type max_time_ms: int | None
+
+        :return: str(user_id) -> authn info, for the users found
+        :rtype: dict
+        """
+        if not user_ids:
+            return {}
+        docs = self._find({'_id': {'$in': _object_ids(user_ids)}}, fresh=fresh, max_time_ms=max_time_ms)
+        return dict((str(doc['_id']), self.model(dict(doc))) for doc in docs)
+
+
+class SupportVerificationsDB(ReadCollectionMixin, db.SupportVerificationsDB):
+
+    def get_verifications_by_ids(self, user_ids, fresh=False, max_time_ms=None):
+        """
+        :param user_ids: User ids
+        :param fresh: Read from the primary
+        :param max_time_ms: Milliseconds the query may run, None for no limit
+        :type user_ids: list
+        :type fresh: bool
+        :type max_time_ms: int | None
+
+        :return: str(user_id) -> list of verifications
+        :rtype: dict
+        """
+        if not user_ids:
+            return {}
+        docs = self._find({'user_oid': {'$in': _object_ids(user_ids)}}, fresh=fresh, max_time_ms=max_time_ms)
+        return _group_by(docs, 'user_oid', self.model)
+
+
+class SupportActionsDB(ReadCollectionMixin, db.SupportActionsDB):
+
+    def get_actions_by_ids(self, user_ids, fresh=False, max_time_ms=None):
+        """
+        :param user_ids: User ids
+        :param fresh: Read from the primary
+        :param max_time_ms: Milliseconds the query may run, None for no limit
+        :type user_ids: list
+        :type fresh: bool
+        :type max_time_ms: int | None
+
+        :return: str(user_id) -> list of actions
+        :rtype: dict
+        """
+        if not user_ids:
+            return {}
+        docs = self._find({'user_oid': {'$in': _object_ids(user_ids)}}, fresh=fresh, max_time_ms=max_time_ms)
+        return _group_by(docs, 'user_oid', self.model)
+
+
+class SupportProofingLogDB(ReadCollectionMixin, db.SupportProofingLogDB):
+
+    def get_entries_by_eppns(self, eppns, fresh=False, max_time_ms=None):
+        """
+        :param eppns: eduPersonPrincipalNames
+        :param fresh: Read from the primary
+        :param max_time_ms: Milliseconds the query may run, None for no limit
+        :type eppns: list
+        :type fresh: bool
+        :type max_time_ms: int | None
+
+        :return: eppn -> list of proofing log entries
+        :rtype: dict
+        """
+        if not eppns:
+            return {}
+        docs = self._find({'eduPersonPrincipalName': {'$in': list(set(eppns))}}, fresh=fresh, max_time_ms=max_time_ms)
+        return _group_by(docs, 'eduPersonPrincipalName', self.model)
+
+
+class SupportLetterProofingDB(ReadCollectionMixin, db.SupportLetterProofingDB):
+
+    def get_proofing_states(self, eppns, fresh=False, max_time_ms=None):
+        """
+        :param eppns: eduPersonPrincipalNames
+        :param fresh: Read from the primary
+        :param max_time_ms: Milliseconds the query may run, None for no limit
+        :type eppns: list
+        :type fresh: bool
+        :type max_time_ms: int | None
+
+        :return: eppn -> proofing state, for the users found
+        :rtype: dict
+        """
+        if not eppns:
+            return {}
+        docs = self._find({'eduPersonPrincipalName': {'$in': list(set(eppns))}}, fresh=fresh, max_time_ms=max_time_ms)
+        return dict((doc['eduPersonPrincipalName'], self.model(dict(doc))) for doc in docs)
+
+
+class ReplicaLagMonitor(object):
+    """
+    How far the secondaries of the replica set are behind the primary, checked at most every
+    `interval` seconds with replSetGetStatus. The lag is also kept in the app metrics, as
+    'mongodb.replica_lag.max' and 'mongodb.replica_lag.<member>'.
+    """
+
+    def __init__(self, client, metrics, interval=30):
+        """
+        :param client: MongoDB client
+        :param metrics: Where to keep the lag
+        :param interval: Seconds between checks
+
+        :type client: pymongo.MongoClient
+        :type metrics: eduid_webapp.api.metrics.Metrics
+        :type interval: int
+        """
+        self.client = client
+        self.metrics = metrics
+        self.interval = interval
+        self._checked = 0
+        self._lag = None
+        self._lock = threading.Lock()
+
+    def _check(self):
+        status = self.client.admin.command('replSetGetStatus')
+        members = status.get('members', [])
+        primary = [member['optimeDate'] for member in members if member.get('stateStr') == 'PRIMARY']
+        if not primary:
+            return None
+        lags = {}
+        for member in members:
+            if member.get('stateStr') == 'SECONDARY':
+                lags[member['name']] = max((primary[0] - member['optimeDate']).total_seconds(), 0)
+                self.metrics.set('mongodb.replica_lag.{!s}'.format(member['name']), lags[member['name']])
+        return max(lags.values()) if lags else 0
+
+    def lag(self):
+        """
+        :return: Seconds the most lagging secondary is behind the primary, None if not known
+        :rtype: float | None
+        """
+        with self._lock:
+            if time.time() - self._checked < self.interval:
+                return self._lag
+            # Other threads get the previous value until this check is done
+            self._checked = time.time()
+        try:
+            lag = self._check()
+        except Exception as e:
+            # Not a replica set, or not allowed to run replSetGetStatus
+            logger.debug('Could not get replica set status: {!r}'.format(e))
+            lag = None
+        if lag is not None:
+            self.metrics.set('mongodb.replica_lag.max', lag)
+        with self._lock:
+            self._lag = lag
+        return lag
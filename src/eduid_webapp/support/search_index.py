@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+
+"""
+Search index for the support app.
+
+A support search used to look in the central user database by eppn, NIN,
+mail address and phone number, and then in the signup database by mail
+address and pending mail address, one query after another and without
+support for partial values. The search index has one document per user and
+source database, with the eppn, names, mail addresses, phone numbers and
+NINs of the user normalised into a list of tokens. A search is then one
+query on the indexed tokens, matching token prefixes for queries of at
+least SUPPORT_SEARCH_MIN_PREFIX_LENGTH characters.
+
+The index is kept up to date by running this module periodically, which
+indexes the users modified since the last run:
+
+    python -m eduid_webapp.support.search_index --mongo-uri mongodb://localhost
+
+Users without modified_ts, that have never been modified by an app, are only
+indexed by a full run, with --full, which also drops removed users from the
+index. The first run indexes all users.
+"""
+
+from __future__ import absolute_import, print_function
+
+import re
+import logging
+import argparse
+from datetime import datetime, timedelta
+
+from eduid_userdb.db import BaseDB
+
+from eduid_webapp.support import db
+
+__author__ = 'lundberg'
+
+logger = logging.getLogger(__name__)
+
+# Fields of the user documents that tokens are made from
+INDEXED_FIELDS = ['eduPersonPrincipalName', 'givenName', 'surname', 'displayName', 'mail', 'mailAliases',
+                  'pending_mail_address', 'mobile', 'phone', 'nins', 'norEduPersonNIN', 'modified_ts']
+
+# Users modified while the previous run was going on are indexed again
+UPDATE_OVERLAP = timedelta(minutes=1)
+# Sources a user can be indexed from, i.e. index documents per user
+SOURCES = ['central', 'signup']
+# Default maximum number of users found by a search
+SEARCH_LIMIT = 500
+
+_PHONE_RE = re.compile(r'^\+?[\d\s\-()./]+$')
+_PHONE_STRIP_RE = re.compile(r'[\s\-()./]')
+
+
+def normalize_mail(value):
+    return value.strip().lower()
+
+
+def normalize_phone(value, country_code='+46'):
+    """
+    Normalise a phone number to its international format, numbers without a
+    country code are assumed to be from `country_code`.
+
+    :type value: str
+    :type country_code: str
+    :rtype: str
+    """
+    number = _PHONE_STRIP_RE.sub('', value)
+    if number.startswith('00'):
+        return '+' + number[2:]
+    if number.startswith('0'):
+        return country_code + number[1:]
+    return number
+
+
+def normalize_nin(value):
+    return _PHONE_STRIP_RE.sub('', value).replace('+', '')
+
+
+def _values(items, key):
+    """
+    Values from a list of dicts or strings, e.g. mailAliases or old style norEduPersonNIN.
+    """
+    for item in items or []:
+        if isinstance(item, dict):
+            item = item.get(key)
+        if item:
+            yield item
+
+
+def document_tokens(doc):
+    """
+    :param doc: User document from the central user database or the signup database
+    :type doc: dict
+
+    :return: Tokens the user should be found by
+    :rtype: list
+    """
+    tokens = set()
+    if doc.get('eduPersonPrincipalName'):
+        tokens.add(doc['eduPersonPrincipalName'].lower())
+    for key in ['givenName', 'surname', 'displayName']:
+        if doc.get(key):
+            tokens.update(doc[key].lower().split())
+
+    mails = list(_values(doc.get('mailAliases'), 'email'))
+    mails.extend(_values([doc.get('mail'), doc.get('pending_mail_address')], 'email'))
+    tokens.update(normalize_mail(mail) for mail in mails)
+
+    phones = list(_values(doc.get('mobile'), 'mobile'))
+    phones.extend(_values(doc.get('phone'), 'number'))
+    tokens.update(normalize_phone(phone) for phone in phones)
+
+    nins = list(_values(doc.get('nins'), 'number'))
+    nins.extend(_values(doc.get('norEduPersonNIN'), 'number'))
+    tokens.update(normalize_nin(nin) for nin in nins)
+    return sorted(tokens)
+
+
+def query_terms(query):
+    """
+    :param query: Search query
+    :type query: str
+
+    :return: Normalised alternatives for a single value, or the words of a name, and whether all
+             the words have to match
+    :rtype: (list, bool)
+    """
+    query = query.strip().lower()
+    if _PHONE_RE.match(query):
+        return sorted(set([query, normalize_phone(query), normalize_nin(query)])), False
+    words = query.split()
+    return words, len(words) > 1
+
+
+class SupportSearchIndexDB(BaseDB):
+
+    def __init__(self, db_uri, db_name='eduid_support', collection='search_index'):
+        super(SupportSearchIndexDB, self).__init__(db_uri, db_name, collection)
+        self._state_coll = self._coll.database[collection + '_state']
+        self._coll.ensure_index([('source', 1), ('user_id', 1)], name='source-user_id-idx', unique=True,
+                                background=True)
+        self._coll.ensure_index('tokens', name='tokens-idx', background=True)
+        # Gives the matches of a search in source order, without sorting them in memory
+        self._coll.ensure_index([('source', 1), ('tokens', 1)], name='source-tokens-idx', background=True)
+
+    def index_document(self, source, doc):
+        """
+        :param source: Name of the database the document is from
+        :param doc: User document
+        :type source: str
+        :type doc: dict
+        """
+        self._coll.update({'source': source, 'user_id': doc['_id']}, {
+            'source': source,
+            'user_id': doc['_id'],
+            'eduPersonPrincipalName': doc.get('eduPersonPrincipalName'),
+            'tokens': document_tokens(doc),
+            'modified_ts': doc.get('modified_ts'),
+            'indexed_ts': datetime.utcnow(),
+        }, upsert=True)
+
+    def remove_older(self, source, indexed_before):
+        """
+        Remove the documents from `source` that were not indexed since `indexed_before`.
+
+        :rtype: int
+        """
+        return self._coll.remove({'source': source, 'indexed_ts': {'$lt': indexed_before}})['n']
+
+    def get_last_update(self, source):
+        state = self._state_coll.find_one({'_id': source})
+        if state is None:
+            return None
+        return state['updated_ts']
+
+    def set_last_update(self, source, updated_ts):
+        self._state_coll.update({'_id': source}, {'_id': source, 'updated_ts': updated_ts}, upsert=True)
+
+    def search(self, query, min_prefix_length=3, limit=SEARCH_LIMIT):
+        """
+        :param query: eppn, name, mail address, phone number or NIN, or the start of one
+        :param min_prefix_length: Shorter queries only match whole tokens
+        :param limit: Maximum number of users
+
+        :type query: str
+        :type min_prefix_length: int
+        :type limit: int
+
+        :return: Dicts with user_id and eduPersonPrincipalName of the users found, with the eppn
+                 from the central user database if the user is in it
+        :rtype: list
+        """
+        terms, match_all = query_terms(query)
+        if not terms:
+            return []
+        patterns = [re.compile('^' + re.escape(term)) if len(term) >= min_prefix_length else term
+                    for term in terms]
+        spec = {'tokens': {'$all' if match_all else '$in': patterns}}
+        cursor = self._coll.find(spec, {'user_id': True, 'eduPersonPrincipalName': True, 'source': True})
+        # A user has one document per source, so this many documents hold at least `limit` users
+        cursor = cursor.sort('source', 1).hint('source-tokens-idx').limit(limit * len(SOURCES))
+        users = {}
+        for doc in cursor:
+            if doc['user_id'] not in users:
+                users[doc['user_id']] = {'user_id': doc['user_id'],
+                                         'eduPersonPrincipalName': doc.get('eduPersonPrincipalName')}
+                if len(users) >= limit:
+                    break
+        return sorted(users.values(), key=lambda user: str(user['user_id']))
+
+
+def update_search_index(index_db, source, source_coll, full=False):
+    """
+    Index the users in `source_coll` modified since the last update, or all of them.
+
+    :param index_db: Search index
+    :param source: Name of the source database
+    :param source_coll: User collection of the source database
+    :param full: Index all users, also those without modified_ts, and remove users no longer in
+                 `source_coll` from the index
+
+    :type index_db: SupportSearchIndexDB
+    :type source: str
+    :type source_coll: pymongo.collection.Collection
+    :type full: bool
+
+    :return: Number of indexed users
+    :rtype: int
+    """
+    started = datetime.utcnow()
+    spec = {}
+    last_update = index_db.get_last_update(source)
+    if not full and last_update is not None:
+        spec = {'modified_ts': {'$gte': last_update - UPDATE_OVERLAP}}
+    count = 0
+    for doc in source_coll.find(spec, INDEXED_FIELDS):
+        index_db.index_document(source, doc)
+        count += 1
+    if full:
+        removed = index_db.remove_older(source, started)
+        logger.info('Removed {!s} users no longer in {!s} from the search index'.format(removed, source))
+    index_db.set_last_update(source, started)
+    logger.info('Indexed {!s} users from {!s}'.format(count, source))
+    return count
+
+
+def source_collections(mongo_uri):
+    """
+    :return: Source name -> user collection
+    :rtype: dict
+    """
+    return {
+        'central': db.SupportUserDB(mongo_uri)._coll,
+        'signup': db.SupportSignupUserDB(mongo_uri)._coll,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Update the support search index')
+    parser.add_argument('--mongo-uri', required=True, help='MongoDB URI')
+    parser.add_argument('--full', action='store_true', help='Index all users and remove users no longer found')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    index_db = SupportSearchIndexDB(args.mongo_uri)
+    for source, source_coll in source_collections(args.mongo_uri).items():
+        count = update_search_index(index_db, source, source_coll, full=args.full)
+        print('Indexed {!s} users from {!s}'.format(count, source))
+
+
+if __name__ == '__main__':
+    main()
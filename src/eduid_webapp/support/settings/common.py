@@ -26,3 +26,25 @@ LOG_LEVEL = 'INFO'
 STATIC_URL = ''  # Use Flask default static dir if not set
 SUPPORT_PERSONNEL = ['']
 
+# Threads for the concurrent database lookups of the support views
+SUPPORT_LOOKUP_THREADS = 16
+# Seconds to wait for the database lookups of a search, sections not fetched in time are shown as unavailable
+SUPPORT_LOOKUP_TIMEOUT = 10
+# Search the index maintained by eduid_webapp.support.search_index first, requires the index to be kept up to date
+SUPPORT_SEARCH_INDEX = False
+# Queries at least this long also match the start of mail addresses, phone numbers etc.
+SUPPORT_SEARCH_MIN_PREFIX_LENGTH = 3
+# Users listed per page of search results
+SUPPORT_SEARCH_PAGE_SIZE = 25
+# Users whose data is fetched together, with one query per database, when all data of a page is shown
+SUPPORT_DETAILS_CHUNK_SIZE = 5
+# Searches matching more users only list the first ones
+SUPPORT_SEARCH_MAX_RESULTS = 500
+# Read preference for the support databases, added to MONGO_URI unless it has one
+SUPPORT_MONGO_READ_PREFERENCE = 'secondaryPreferred'
+# Seconds a secondary may be behind the primary and still be read from, at least 90
+SUPPORT_MONGO_MAX_STALENESS = 120
+# Seconds between checks of the replica set lag shown in the support views
+SUPPORT_REPLICA_LAG_INTERVAL = 30
+# Seconds between logging the process metrics (cache hits, session writes etc.), 0 to not log them
+METRICS_LOG_INTERVAL = 300
@@ -2,8 +2,16 @@
 
 from __future__ import absolute_import
 
+import json
+import time
+
+from mock import patch
+from bson import ObjectId
+
 from eduid_common.api.testing import EduidAPITestCase
 from eduid_webapp.support.app import support_init_app
+from eduid_webapp.support.search_index import update_search_index
+from eduid_webapp.support.views import get_users_data, iter_users_data
 
 __author__ = 'lundberg'
 
@@ -16,6 +24,7 @@ class SupportAppTests(EduidAPITestCase):
 
         self.test_user_eppn = 'hubba-bubba'
         self.client = self.app.test_client()
+        update_search_index(self.app.support_search_index, 'central', self.app.support_user_db._coll, full=True)
 
     def load_app(self, config):
         """
@@ -27,6 +36,7 @@ class SupportAppTests(EduidAPITestCase):
     def update_config(self, config):
         config.update({
             'SUPPORT_PERSONNEL': ['hubba-bubba'],
+            'SUPPORT_SEARCH_INDEX': True,
         })
         return config
 
@@ -42,6 +52,8 @@ class SupportAppTests(EduidAPITestCase):
             self.app.support_actions_db._drop_whole_collection()
             self.app.support_letter_proofing_db._drop_whole_collection()
             self.app.central_userdb._drop_whole_collection()
+            self.app.support_search_index._drop_whole_collection()
+            self.app.support_search_index._state_coll.drop()
 
     def test_authenticate(self):
         response = self.client.get('/')
@@ -50,3 +62,158 @@ class SupportAppTests(EduidAPITestCase):
             response = client.get('/')
         self.assertEqual(response.status_code, 200)  # Authenticated request
 
+    def test_search_user(self):
+        with self.session_cookie(self.client, self.test_user_eppn) as client:
+            response = client.post('/', data={'query': self.test_user_eppn})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'1 user was found', response.data)
+
+    def test_search_user_by_prefix(self):
+        with self.session_cookie(self.client, self.test_user_eppn) as client:
+            response = client.post('/', data={'query': 'HUBBA-B'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'1 user was found', response.data)
+
+    def test_search_index_incremental(self):
+        # Only users modified since the previous run are indexed again
+        update_search_index(self.app.support_search_index, 'central', self.app.support_user_db._coll)
+        users = self.app.support_search_index.search(self.test_user_eppn)
+        self.assertEqual([user['eduPersonPrincipalName'] for user in users], [self.test_user_eppn])
+
+    def test_search_index_without_modified_ts(self):
+        self.app.support_user_db._coll.update({'eduPersonPrincipalName': self.test_user_eppn},
+                                              {'$unset': {'modified_ts': True}})
+        self.app.support_search_index._coll.remove({})
+        # Users without modified_ts are not scanned again by every incremental run
+        self.assertEqual(update_search_index(self.app.support_search_index, 'central',
+                                             self.app.support_user_db._coll), 0)
+        self.assertEqual(self.app.support_search_index.search(self.test_user_eppn), [])
+        # but are indexed by a full run
+        update_search_index(self.app.support_search_index, 'central', self.app.support_user_db._coll, full=True)
+        users = self.app.support_search_index.search(self.test_user_eppn)
+        self.assertEqual([user['eduPersonPrincipalName'] for user in users], [self.test_user_eppn])
+
+    def test_search_index_limit(self):
+        self.app.support_search_index.index_document('signup', {'_id': ObjectId(),
+                                                                'eduPersonPrincipalName': 'hubba-baba'})
+        users = self.app.support_search_index.search('hubba', limit=1)
+        self.assertEqual(len(users), 1)
+        # Central users come first
+        self.assertEqual(users[0]['eduPersonPrincipalName'], self.test_user_eppn)
+
+    def test_search_user_not_indexed(self):
+        # Users not in the index yet are found by the search in the user databases
+        self.app.support_search_index._coll.remove({})
+        with self.session_cookie(self.client, self.test_user_eppn) as client:
+            response = client.post('/', data={'query': self.test_user_eppn})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'1 user was found', response.data)
+
+    def test_get_users_by_ids(self):
+        user = self.app.central_userdb.get_user_by_eppn(self.test_user_eppn)
+        users = self.app.support_user_db.get_users_by_ids([user.user_id, str(user.user_id)])
+        self.assertEqual(list(users.keys()), [str(user.user_id)])
+        self.assertEqual(users[str(user.user_id)]['eduPersonPrincipalName'], self.test_user_eppn)
+        self.assertEqual(self.app.support_authn_db.get_authn_infos([]), {})
+
+    def test_search_user_pages(self):
+        self.app.config['SUPPORT_SEARCH_PAGE_SIZE'] = 1
+        self.app.config['SUPPORT_SEARCH_MAX_RESULTS'] = 1
+        with self.session_cookie(self.client, self.test_user_eppn) as client:
+            response = client.post('/', data={'query': self.test_user_eppn, 'page': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Page 1 of 1', response.data)
+        self.assertIn(self.test_user_eppn.encode('ascii'), response.data)
+
+    def test_search_user_details(self):
+        with self.session_cookie(self.client, self.test_user_eppn) as client:
+            response = client.post('/', data={'query': self.test_user_eppn, 'details': 1})
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b'Central DB', response.get_data())
+
+    @patch('eduid_webapp.support.views.get_users_data')
+    def test_iter_users_data_chunks(self, mock_get_users_data):
+        mock_get_users_data.side_effect = lambda lookup_users, fresh: [{'user': user} for user in lookup_users]
+        lookup_users = [{'user_id': i} for i in range(5)]
+        users_data = list(iter_users_data(lookup_users, chunk_size=2))
+        self.assertEqual([user_data['user'] for user_data in users_data], lookup_users)
+        # One batched lookup per chunk, not per user
+        self.assertEqual([len(call[0][0]) for call in mock_get_users_data.call_args_list], [2, 2, 1])
+
+    def test_search_query_not_in_urls(self):
+        self.app.config['SUPPORT_SEARCH_PAGE_SIZE'] = 1
+        self.app.config['SUPPORT_SEARCH_MAX_RESULTS'] = 1
+        with self.session_cookie(self.client, self.test_user_eppn) as client:
+            response = client.post('/', data={'query': self.test_user_eppn})
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn(b'query=', response.data)
+            self.assertIn(b'name="query" value="hubba-bubba"', response.data)
+            # A search term in the query string is ignored
+            response = client.get('/?query={!s}'.format(self.test_user_eppn))
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn(b'found using query', response.data)
+
+    def test_user(self):
+        user = self.app.central_userdb.get_user_by_eppn(self.test_user_eppn)
+        with self.session_cookie(self.client, self.test_user_eppn) as client:
+            response = client.get('/user/{!s}'.format(user.user_id))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Central DB', response.data)
+        self.assertIn(self.test_user_eppn.encode('ascii'), response.data)
+
+    def test_user_section(self):
+        user = self.app.central_userdb.get_user_by_eppn(self.test_user_eppn)
+        with self.session_cookie(self.client, self.test_user_eppn) as client:
+            response = client.get('/user/{!s}/user'.format(user.user_id))
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.data.decode('utf-8'))
+            self.assertEqual(data['section'], 'user')
+            self.assertEqual(data['data']['eduPersonPrincipalName'], self.test_user_eppn)
+
+            response = client.get('/user/{!s}/proofing-log'.format(user.user_id))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json.loads(response.data.decode('utf-8'))['data'], [])
+
+            response = client.get('/user/{!s}/unknown-section'.format(user.user_id))
+            self.assertEqual(response.status_code, 404)
+
+    def test_user_unknown(self):
+        with self.session_cookie(self.client, self.test_user_eppn) as client:
+            response = client.get('/user/not-a-user-id')
+            self.assertEqual(response.status_code, 404)
+            response = client.get('/user/{!s}'.format('0' * 24))
+            self.assertEqual(response.status_code, 404)
+
+    @patch('eduid_webapp.support.db.SupportAuthnInfoDB.get_authn_infos')
+    def test_user_lookup_failed(self, mock_get_authn_infos):
+        mock_get_authn_infos.side_effect = RuntimeError('Database unavailable')
+        user = self.app.central_userdb.get_user_by_eppn(self.test_user_eppn)
+        with self.session_cookie(self.client, self.test_user_eppn) as client:
+            response = client.get('/user/{!s}'.format(user.user_id))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Unavailable', response.data)
+
+    def test_lookup_timeout(self):
+        self.app.config['SUPPORT_LOOKUP_TIMEOUT'] = 0.2
+        user = self.app.central_userdb.get_user_by_eppn(self.test_user_eppn)
+        lookup_users = [{'user_id': user.user_id, 'eduPersonPrincipalName': self.test_user_eppn}]
+        get_authn_infos = self.app.support_authn_db.get_authn_infos
+        calls = []
+
+        def slow_get_authn_infos(user_ids, **kwargs):
+            calls.append(kwargs)
+            time.sleep(1)
+            return get_authn_infos(user_ids, **kwargs)
+
+        with self.app.test_request_context('/'):
+            with patch.object(self.app.support_authn_db, 'get_authn_infos', side_effect=slow_get_authn_infos):
+                data = get_users_data(lookup_users)
+            self.assertEqual(data[0]['unavailable'], ['authn'])
+            self.assertEqual(data[0]['user'].eppn, self.test_user_eppn)
+            # The query is limited in MongoDB as well
+            self.assertEqual(calls[0]['max_time_ms'], 200)
+
+            # The pool is still usable while the timed out lookup is running
+            data = get_users_data(lookup_users)
+            self.assertEqual(data[0]['unavailable'], [])
+            self.assertEqual(data[0]['user'].eppn, self.test_user_eppn)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import threading
+import unittest
+from datetime import datetime
+
+from eduid_webapp.api.metrics import Metrics
+from eduid_webapp.support.db import ReplicaLagMonitor, support_mongo_uri
+
+__author__ = 'lundberg'
+
+
+class FakeAdmin(object):
+
+    def __init__(self, status):
+        self.status = status
+        self.commands = 0
+        self.release = None
+
+    def command(self, name):
+        self.commands += 1
+        if self.release is not None:
+            self.release.wait()
+        if isinstance(self.status, Exception):
+            raise self.status
+        return self.status
+
+
+class FakeClient(object):
+
+    def __init__(self, status):
+        self.admin = FakeAdmin(status)
+
+
+class SupportDBTests(unittest.TestCase):
+
+    def test_support_mongo_uri(self):
+        self.assertEqual(support_mongo_uri('mongodb://localhost', 'secondaryPreferred', 120),
+                         'mongodb://localhost/?readPreference=secondaryPreferred&maxStalenessSeconds=120')
+        self.assertEqual(support_mongo_uri('mongodb://db1,db2/?replicaSet=rs0', 'secondary'),
+                         'mongodb://db1,db2/?replicaSet=rs0&readPreference=secondary')
+        self.assertEqual(support_mongo_uri('mongodb://localhost/?readPreference=primary', 'secondary', 120),
+                         'mongodb://localhost/?readPreference=primary')
+        self.assertEqual(support_mongo_uri('mongodb://localhost', 'primary', 120),
+                         'mongodb://localhost/?readPreference=primary')
+        self.assertEqual(support_mongo_uri('mongodb://localhost', None), 'mongodb://localhost')
+
+    def test_replica_lag(self):
+        client = FakeClient({'members': [
+            {'name': 'db1:27017', 'stateStr': 'PRIMARY', 'optimeDate': datetime(2017, 1, 1, 12, 0, 30)},
+            {'name': 'db2:27017', 'stateStr': 'SECONDARY', 'optimeDate': datetime(2017, 1, 1, 12, 0, 20)},
+            {'name': 'db3:27017', 'stateStr': 'SECONDARY', 'optimeDate': datetime(2017, 1, 1, 12, 0, 30)},
+        ]})
+        metrics = Metrics()
+        monitor = ReplicaLagMonitor(client, metrics, interval=60)
+        self.assertEqual(monitor.lag(), 10)
+        self.assertEqual(monitor.lag(), 10)
+        self.assertEqual(client.admin.commands, 1)
+        self.assertEqual(metrics.get('mongodb.replica_lag.max'), 10)
+        self.assertEqual(metrics.get('mongodb.replica_lag.db3:27017'), 0)
+
+    def test_replica_lag_slow_check(self):
+        client = FakeClient({'members': [
+            {'name': 'db1:27017', 'stateStr': 'PRIMARY', 'optimeDate': datetime(2017, 1, 1, 12, 0, 30)},
+            {'name': 'db2:27017', 'stateStr': 'SECONDARY', 'optimeDate': datetime(2017, 1, 1, 12, 0, 20)},
+        ]})
+        monitor = ReplicaLagMonitor(client, Metrics(), interval=60)
+        self.assertEqual(monitor.lag(), 10)
+        monitor._checked = 0
+        client.admin.release = threading.Event()
+        checker = threading.Thread(target=monitor.lag)
+        checker.start()
+        while client.admin.commands < 2:
+            checker.join(0.01)
+        # The previous value is returned while another thread runs replSetGetStatus
+        self.assertEqual(monitor.lag(), 10)
+        self.assertEqual(client.admin.commands, 2)
+        client.admin.release.set()
+        checker.join()
+
+    def test_replica_lag_unknown(self):
+        monitor = ReplicaLagMonitor(FakeClient(RuntimeError('not running with --replSet')), Metrics())
+        self.assertIsNone(monitor.lag())
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import unittest
+
+from eduid_webapp.support.search_index import document_tokens, normalize_phone, query_terms
+
+__author__ = 'lundberg'
+
+
+class SearchIndexTokenTests(unittest.TestCase):
+
+    def test_normalize_phone(self):
+        self.assertEqual(normalize_phone('070-123 45 67'), '+46701234567')
+        self.assertEqual(normalize_phone('0046 70 123 45 67'), '+46701234567')
+        self.assertEqual(normalize_phone('+46 (0)70'), '+46070')
+
+    def test_document_tokens(self):
+        doc = {
+            'eduPersonPrincipalName': 'hubba-bubba',
+            'givenName': 'John',
+            'displayName': 'John Smith',
+            'mailAliases': [{'email': 'John.Smith@Example.com', 'verified': True}],
+            'mail': 'johnsmith@example.org',
+            'mobile': [{'mobile': '070-123 45 67'}],
+            'nins': [{'number': '19800101-1234'}],
+            'norEduPersonNIN': ['197801011234'],
+        }
+        self.assertEqual(document_tokens(doc), ['+46701234567', '197801011234', '198001011234', 'hubba-bubba',
+                                                'john', 'john.smith@example.com', 'johnsmith@example.org',
+                                                'smith'])
+
+    def test_signup_document_tokens(self):
+        doc = {'pending_mail_address': {'email': 'pending@example.com'}, 'mail': None}
+        self.assertEqual(document_tokens(doc), ['pending@example.com'])
+
+    def test_query_terms(self):
+        self.assertEqual(query_terms(' John.Smith@Example.com '), (['john.smith@example.com'], False))
+        self.assertEqual(query_terms('John Smith'), (['john', 'smith'], True))
+        self.assertEqual(query_terms('070-123'), (['+4670123', '070-123', '070123'], False))
+        self.assertEqual(query_terms('19800101-1234'), (['19800101-1234', '198001011234'], False))
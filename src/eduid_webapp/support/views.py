@@ -1,59 +1,291 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 
-from flask import Blueprint, current_app, request, render_template
+from functools import partial
+from collections import OrderedDict
+
+from bson import ObjectId, json_util
+from flask import Blueprint, Response, abort, current_app, request, render_template, stream_with_context
 from eduid_common.api.decorators import require_support_personnel
-from eduid_userdb.exceptions import UserHasUnknownData
+
+from eduid_webapp.api.concurrency import get_thread_pool, run_concurrently
+from eduid_webapp.support.search_index import SEARCH_LIMIT
 
 support_views = Blueprint('support', __name__, url_prefix='', template_folder='templates')
 
+# Section name -> value when there is no data, in the order the sections are listed
+SECTIONS = OrderedDict([
+    ('user', None),
+    ('dashboard_user', None),
+    ('signup_user', None),
+    ('authn', None),
+    ('verifications', []),
+    ('proofing_log', []),
+    ('actions', []),
+    ('letter_proofing', None),
+])
+# Sections looked up by eppn, the others by user id
+EPPN_SECTIONS = ['proofing_log', 'letter_proofing']
+
+
+def _lookup_max_time_ms():
+    """
+    :return: Milliseconds a lookup query may run in MongoDB, from SUPPORT_LOOKUP_TIMEOUT
+    :rtype: int | None
+    """
+    timeout = current_app.config.get('SUPPORT_LOOKUP_TIMEOUT', 10)
+    if not timeout:
+        return None
+    return int(timeout * 1000)
+
+
+def _lookups(user_ids, eppns, fresh=False):
+    """
+    :return: Section name -> callable fetching the section for all users
+    :rtype: dict
+    """
+    app = current_app
+    options = {'fresh': fresh, 'max_time_ms': _lookup_max_time_ms()}
+    return {
+        # Users
+        'user': partial(app.support_user_db.get_users_by_ids, user_ids, **options),
+        'dashboard_user': partial(app.support_dashboard_db.get_users_by_ids, user_ids, **options),
+        'signup_user': partial(app.support_signup_db.get_users_by_ids, user_ids, **options),
+        # Aux data
+        'authn': partial(app.support_authn_db.get_authn_infos, user_ids, **options),
+        'verifications': partial(app.support_verification_db.get_verifications_by_ids, user_ids, **options),
+        'proofing_log': partial(app.support_proofing_log_db.get_entries_by_eppns, eppns, **options),
+        'actions': partial(app.support_actions_db.get_actions_by_ids, user_ids, **options),
+        'letter_proofing': partial(app.support_letter_proofing_db.get_proofing_states, eppns, **options),
+    }
+
+
+def _run_in_app_context(app, lookups, name):
+    with app.app_context():
+        return lookups[name]()
+
+
+def get_users_data(lookup_users, fresh=False):
+    """
+    Fetch the data shown for the found users, with one query per database for all of them.
+
+    The queries run concurrently in a thread pool of SUPPORT_LOOKUP_THREADS threads. Sections that
+    fail or are not fetched within SUPPORT_LOOKUP_TIMEOUT seconds are listed in 'unavailable'. The
+    queries are also limited to SUPPORT_LOOKUP_TIMEOUT in MongoDB, so that they do not keep running
+    in the pool after the timeout.
+
+    :param lookup_users: Users found by the search
+    :param fresh: Read from the primary
+    :type lookup_users: list
+    :type fresh: bool
+
+    :return: One dict of data per user
+    :rtype: list
+    """
+    user_ids = [user['user_id'] for user in lookup_users]
+    eppns = [user['eduPersonPrincipalName'] for user in lookup_users]
+
+    app = current_app._get_current_object()
+    lookups = _lookups(user_ids, eppns, fresh)
+    pool = get_thread_pool('support-lookups', app.config.get('SUPPORT_LOOKUP_THREADS', 16))
+    results = run_concurrently(pool, partial(_run_in_app_context, app, lookups), list(lookups.keys()),
+                               timeout=app.config.get('SUPPORT_LOOKUP_TIMEOUT', 10))
+
+    sections = {}
+    unavailable = []
+    for name, (outcome, value) in results.items():
+        if outcome == 'ok':
+            sections[name] = value
+        else:
+            current_app.logger.error('Support lookup of {!s}: {!s} {!r}'.format(name, outcome, value))
+            sections[name] = {}
+            unavailable.append(name)
+
+    users = list()
+    for user_id, eppn in zip(user_ids, eppns):
+        user_id = str(user_id)
+        users.append({
+            'user': sections['user'].get(user_id),
+            'dashboard_user': sections['dashboard_user'].get(user_id),
+            'signup_user': sections['signup_user'].get(user_id),
+            'authn': sections['authn'].get(user_id, {}),
+            'verifications': sections['verifications'].get(user_id, []),
+            'proofing_log': sections['proofing_log'].get(eppn, []),
+            'actions': sections['actions'].get(user_id, []),
+            'letter_proofing': sections['letter_proofing'].get(eppn, {}),
+            'unavailable': unavailable,
+        })
+    return users
+
+
+def search_users(search_query, limit=SEARCH_LIMIT):
+    """
+    :param search_query: eppn, NIN, mail address or phone number, or with the search index also
+                         names and the start of any of them
+    :param limit: Maximum number of users
+    :type search_query: str
+    :type limit: int
+
+    :return: Users with at least user_id and eduPersonPrincipalName
+    :rtype: list
+    """
+    if current_app.config.get('SUPPORT_SEARCH_INDEX'):
+        lookup_users = current_app.support_search_index.search(
+            search_query, min_prefix_length=current_app.config.get('SUPPORT_SEARCH_MIN_PREFIX_LENGTH', 3),
+            limit=limit)
+        if lookup_users:
+            return lookup_users
+        # The user can have been added or changed since the last index update
+        current_app.logger.debug('No match in the search index, searching the user databases')
+
+    lookup_users = current_app.support_user_db.search_users(search_query)
+    if len(lookup_users) == 0:
+        # If no users where found in the central database look in signup database
+        lookup_users = current_app.support_signup_db.get_user_by_mail(search_query, raise_on_missing=False,
+                                                                      return_list=True, include_unconfirmed=True)
+    if len(lookup_users) == 0:
+        user = current_app.support_signup_db.get_user_by_pending_mail_address(search_query)
+        if user:
+            lookup_users = [user]
+    if limit:
+        return lookup_users[:limit]
+    return lookup_users
+
+
+def get_user_summaries(lookup_users, fresh=False):
+    """
+    Get the eppn, name and primary mail address of users from the central user database, or from
+    the signup database for users not in the central user database.
+
+    :param lookup_users: Users with at least user_id
+    :param fresh: Read from the primary
+    :type lookup_users: list
+    :type fresh: bool
+
+    :return: Summary dicts in the order of lookup_users, for the users found
+    :rtype: list
+    """
+    user_ids = [user['user_id'] for user in lookup_users]
+    max_time_ms = _lookup_max_time_ms()
+    summaries = current_app.support_user_db.get_summaries_by_ids(user_ids, fresh, max_time_ms)
+    missing = [user_id for user_id in user_ids if str(user_id) not in summaries]
+    summaries.update(current_app.support_signup_db.get_summaries_by_ids(missing, fresh, max_time_ms))
+    return [summaries[str(user_id)] for user_id in user_ids if str(user_id) in summaries]
+
+
+def iter_users_data(lookup_users, fresh=False, chunk_size=None):
+    """
+    Fetch the data of chunk_size users at a time with get_users_data, for rendering the users as
+    their data arrives.
+
+    :param lookup_users: Users with at least user_id and eduPersonPrincipalName
+    :param fresh: Read from the primary
+    :param chunk_size: Users per get_users_data call, SUPPORT_DETAILS_CHUNK_SIZE if not given
+    :type lookup_users: list
+    :type fresh: bool
+    :type chunk_size: int | None
+
+    :return: Data dicts like from get_users_data
+    :rtype: collections.Iterable
+    """
+    if chunk_size is None:
+        chunk_size = current_app.config.get('SUPPORT_DETAILS_CHUNK_SIZE', 5)
+    chunk_size = max(chunk_size, 1)
+    for start in range(0, len(lookup_users), chunk_size):
+        for user_data in get_users_data(lookup_users[start:start + chunk_size], fresh):
+            yield user_data
+
+
+def read_fresh():
+    """
+    :return: True if the request asks for data read from the primary, with fresh=1 in the query string or form
+    :rtype: bool
+    """
+    return bool(request.values.get('fresh'))
+
+
+def stream_template(template_name, **context):
+    """
+    Like render_template, but the output is generated as the template is rendered.
+    """
+    current_app.update_template_context(context)
+    template = current_app.jinja_env.get_template(template_name)
+    return template.stream(context)
+
 
 @support_views.route('/', methods=['GET', 'POST'])
 @require_support_personnel
 def index(logged_in_user):
-    if request.method == 'POST':
-        search_query = request.form.get('query')
-        lookup_users = current_app.support_user_db.search_users(request.form.get('query'))
-        users = list()
+    # The search term is a NIN, phone number or mail address, so it is only accepted in the POST body
+    # to keep it out of URLs, access logs, browser history and Referer headers
+    search_query = request.form.get('query')
+    if not search_query:
+        return render_template('index.html')
 
+    max_results = current_app.config.get('SUPPORT_SEARCH_MAX_RESULTS', 500)
+    lookup_users = search_users(search_query, limit=max_results + 1)
+    if len(lookup_users) == 0:
+        current_app.logger.warn('Support personnel: {!r} searched for {!r} without any match found'
+                                .format(logged_in_user, search_query))
+        return render_template('index.html', error="No users matched the search query")
+
+    current_app.logger.info('Support personnel: {!r} searched for {!r}'.format(logged_in_user, search_query))
+    truncated = len(lookup_users) > max_results
+    lookup_users = lookup_users[:max_results]
+
+    page_size = current_app.config.get('SUPPORT_SEARCH_PAGE_SIZE', 25)
+    pages = (len(lookup_users) + page_size - 1) // page_size
+    try:
+        page = min(max(int(request.form.get('page', 1)), 1), pages)
+    except ValueError:
+        page = 1
+    fresh = read_fresh()
+    users = get_user_summaries(lookup_users[(page - 1) * page_size:page * page_size], fresh)
+    context = dict(users=users, search_query=search_query, total=len(lookup_users), truncated=truncated,
+                   page=page, pages=pages, fresh=fresh)
+    context['sections'] = [section.replace('_', '-') for section in SECTIONS]
+    if request.form.get('details'):
+        # Send each user to the browser as soon as their data is fetched
+        details = iter_users_data(users, fresh)
+        return Response(stream_with_context(stream_template('index.html', details=details, **context)))
+    return render_template('index.html', **context)
+
+
+@support_views.route('/user/<user_id>', methods=['GET'])
+@require_support_personnel
+def user(logged_in_user, user_id):
+    if not ObjectId.is_valid(user_id):
+        abort(404)
+    fresh = read_fresh()
+    lookup_users = get_user_summaries([{'user_id': ObjectId(user_id)}], fresh)
+    if len(lookup_users) == 0:
+        abort(404)
+
+    current_app.logger.info('Support personnel: {!r} viewed user {!r}'.format(
+        logged_in_user, lookup_users[0]['eduPersonPrincipalName']))
+    return render_template('user.html', item=get_users_data(lookup_users, fresh)[0], fresh=fresh)
+
+
+@support_views.route('/user/<user_id>/<section>', methods=['GET'])
+@require_support_personnel
+def user_section(logged_in_user, user_id, section):
+    """
+    One section of the user data as JSON, e.g. /user/<user_id>/proofing-log.
+    """
+    section = section.replace('-', '_')
+    if section not in SECTIONS or not ObjectId.is_valid(user_id):
+        abort(404)
+    user_id = ObjectId(user_id)
+    key = str(user_id)
+    eppn = None
+    if section in EPPN_SECTIONS:
+        lookup_users = get_user_summaries([{'user_id': user_id}], read_fresh())
         if len(lookup_users) == 0:
-            # If no users where found in the central database look in signup database
-            lookup_users = current_app.support_signup_db.get_user_by_mail(search_query, raise_on_missing=False,
-                                                                          return_list=True, include_unconfirmed=True)
-            if len(lookup_users) == 0:
-                user = current_app.support_signup_db.get_user_by_pending_mail_address(search_query)
-                if user:
-                    lookup_users = [user]
-            if len(lookup_users) == 0:
-                current_app.logger.warn('Support personnel: {!r} searched for {!r} without any match found'
-                                        .format(logged_in_user, search_query))
-                return render_template('index.html', error="No users matched the search query")
-
-        current_app.logger.info('Support personnel: {!r} searched for {!r}'.format(logged_in_user, search_query))
-        for user in lookup_users:
-            user_data = dict()
-            # Users
-            user_data['user'] = current_app.support_user_db.get_user_by_id(user_id=user['user_id'],
-                                                                           raise_on_missing=False)
-            user_data['dashboard_user'] = current_app.support_dashboard_db.get_user_by_id(user_id=user['user_id'],
-                                                                                          raise_on_missing=False)
-            try:
-                user_data['signup_user'] = current_app.support_signup_db.get_user_by_id(user_id=user['user_id'],
-                                                                                        raise_on_missing=False)
-            except UserHasUnknownData:
-                # The user has completed signup but is in an old format, disregard
-                user_data['signup_user'] = None
-
-            # Aux data
-            user_data['authn'] = current_app.support_authn_db.get_authn_info(user_id=user['user_id'])
-            user_data['verifications'] = current_app.support_verification_db.get_verifications(user_id=user['user_id'])
-            user_data['proofing_log'] = current_app.support_proofing_log_db.get_entries(
-                eppn=user['eduPersonPrincipalName'])
-            user_data['actions'] = current_app.support_actions_db.get_actions(user_id=user['user_id'])
-            user_data['letter_proofing'] = current_app.support_letter_proofing_db.get_proofing_state(
-                eppn=user['eduPersonPrincipalName'])
-            users.append(user_data)
-
-        return render_template('index.html', users=users, search_query=search_query)
-    else:
-        return render_template('index.html')
+            abort(404)
+        key = eppn = lookup_users[0]['eduPersonPrincipalName']
+
+    current_app.logger.info('Support personnel: {!r} viewed {!s} of user {!s}'.format(logged_in_user, section,
+                                                                                       user_id))
+    data = _lookups([user_id], [eppn], read_fresh())[section]().get(key, SECTIONS[section])
+    return Response(json_util.dumps({'user_id': user_id, 'section': section, 'data': data}),
+                    mimetype='application/json')